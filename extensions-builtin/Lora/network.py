@@ -22,12 +22,30 @@ class SdVersion(enum.Enum):
 
 
 class NetworkOnDisk:
-    def __init__(self, name, filename):
+    def __init__(self, name, filename, index_entry=None):
+        """index_entry is information about the file stored in network_index; if provided, the file is not read."""
+
         self.name = name
         self.filename = filename
         self.metadata = {}
         self.is_safetensors = os.path.splitext(filename)[1].lower() == ".safetensors"
 
+        if index_entry is not None:
+            self.metadata = index_entry["metadata"]
+            self.alias = index_entry["alias"]
+            self.sd_version = SdVersion[index_entry["sd_version"]]
+            self.hash = None
+            self.shorthash = None
+            self.set_hash(index_entry["hash"], update_index=False)
+
+            if not self.hash:
+                self.set_hash(hashes.sha256_from_cache(self.filename, "lora/" + self.name, use_addnet_hash=self.is_safetensors) or '')
+
+            if not self.hash:
+                hashes.background_hasher.enqueue(self.filename, "lora/" + self.name, use_addnet_hash=self.is_safetensors)
+
+            return
+
         def read_metadata():
             metadata = sd_models.read_metadata_from_safetensors(filename)
 
@@ -56,6 +74,9 @@ class NetworkOnDisk:
             ''
         )
 
+        if not self.hash:
+            hashes.background_hasher.enqueue(self.filename, "lora/" + self.name, use_addnet_hash=self.is_safetensors)
+
         self.sd_version = self.detect_version()
 
     def detect_version(self):
@@ -68,7 +89,7 @@ class NetworkOnDisk:
 
         return SdVersion.Unknown
 
-    def set_hash(self, v):
+    def set_hash(self, v, update_index=True):
         self.hash = v
         self.shorthash = self.hash[0:12]
 
@@ -76,6 +97,10 @@ class NetworkOnDisk:
             import networks
             networks.available_network_hash_lookup[self.shorthash] = self
 
+            if update_index:
+                import network_index
+                network_index.index.set_hash(self.filename, self.hash)
+
     def read_hash(self):
         if not self.hash:
             self.set_hash(hashes.sha256(self.filename, "lora/" + self.name, use_addnet_hash=self.is_safetensors) or '')
@@ -0,0 +1,135 @@
+import os
+import threading
+
+from modules import cache, shared, util
+
+index_version = 1
+
+
+class NetworkIndex:
+    """
+    Persistent index of network files, so that refreshing the list of networks does not read every file.
+
+    Contents of every directory are stored together with directory's mtime; a directory is listed again only if its mtime changed,
+    which happens when files are added, removed or renamed in it. Information about each file (size, mtime, alias, version, hash, metadata)
+    is stored too, and re-checked only for files in changed directories.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def dirs_cache():
+        return cache.cache("lora-index-dirs")
+
+    @staticmethod
+    def files_cache():
+        return cache.cache("lora-index-files")
+
+    def list_directory(self, directory, allowed_extensions):
+        files = []
+        subdirs = []
+
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=True):
+                    subdirs.append(entry.path)
+                elif os.path.splitext(entry.name)[1].lower() in allowed_extensions:
+                    files.append(entry.path)
+
+        return files, subdirs
+
+    def list_files(self, paths, allowed_extensions):
+        """
+        Returns files in paths and their subdirectories, in same order as shared.walk_files, and a set of directories that changed since
+        last call.
+        """
+
+        allowed_extensions = set(allowed_extensions)
+        dirs = self.dirs_cache()
+        files_cache = self.files_cache()
+
+        found = []
+        changed = set()
+        visited = set()
+
+        with self.lock:
+            stack = [x for x in paths if x and os.path.isdir(x)]
+            while stack:
+                directory = stack.pop()
+
+                realpath = os.path.realpath(directory)
+                if realpath in visited:
+                    continue
+                visited.add(realpath)
+
+                try:
+                    mtime = os.stat(directory).st_mtime
+                except OSError:
+                    continue
+
+                entry = dirs.get(directory)
+                if entry is None or entry.get("version") != index_version or entry["mtime"] != mtime:
+                    try:
+                        files, subdirs = self.list_directory(directory, allowed_extensions)
+                    except OSError:
+                        continue
+
+                    for filename in set(entry["files"] if entry else []) - set(files):
+                        files_cache.pop(filename, None)
+
+                    entry = {"version": index_version, "mtime": mtime, "files": files, "subdirs": subdirs}
+                    dirs[directory] = entry
+                    changed.add(directory)
+
+                stack += entry["subdirs"]
+
+                if not shared.opts.list_hidden_files and ("/." in directory or "\\." in directory):
+                    continue
+
+                found += [(directory, filename) for filename in entry["files"]]
+
+        found.sort(key=lambda x: (util.natural_sort_key(x[0]), util.natural_sort_key(os.path.basename(x[1]))))
+
+        return [filename for _, filename in found], changed
+
+    def get(self, filename, verify):
+        """Returns stored information about the file; if verify is True, it's only returned if file's size and mtime did not change."""
+
+        entry = self.files_cache().get(filename)
+        if entry is None or not verify:
+            return entry
+
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+
+        if entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+            return None
+
+        return entry
+
+    def store(self, net):
+        stat = os.stat(net.filename)
+
+        self.files_cache()[net.filename] = {
+            "name": net.name,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "alias": net.alias,
+            "sd_version": net.sd_version.name,
+            "hash": net.hash,
+            "metadata": net.metadata,
+        }
+
+    def set_hash(self, filename, value):
+        files_cache = self.files_cache()
+
+        entry = files_cache.get(filename)
+        if entry is not None and entry["hash"] != value:
+            entry["hash"] = value
+            files_cache[filename] = entry
+
+
+index = NetworkIndex()
@@ -1,4 +1,5 @@
 from __future__ import annotations
+import collections
 import gradio as gr
 import logging
 import os
@@ -6,6 +7,7 @@ import re
 
 import lora_patches
 import network
+import network_index
 import network_lora
 import network_glora
 import network_hada
@@ -385,7 +387,92 @@ def restore_weights_backup(obj, field, weight):
         setattr(obj, field, None)
         return
 
-    getattr(obj, field).copy_(weight)
+    current = getattr(obj, field)
+    if current is None:
+        device = obj.weight.device if getattr(obj, 'weight', None) is not None else devices.device
+        setattr(obj, field, torch.nn.Parameter(weight.to(device, copy=True), requires_grad=False))
+        return
+
+    current.copy_(weight)
+
+
+class NetworkWeightsCache:
+    """
+    LRU cache of layer weights with a set of networks applied, bounded by total size of stored tensors.
+
+    Keys are layer name plus the set of networks with their multipliers; going back to a recently used set of networks
+    copies weights from the cache instead of calculating them again. Cleared when a model is loaded.
+    """
+
+    def __init__(self):
+        self.entries = collections.OrderedDict()
+        self.nbytes = 0
+
+    @property
+    def size_limit(self):
+        return int(shared.opts.lora_weights_cache_size * 1024 * 1024)
+
+    @staticmethod
+    def storage_device():
+        return devices.device if shared.opts.lora_weights_cache_device == "GPU" else devices.cpu
+
+    def get(self, layer_name, key):
+        entry = self.entries.get((layer_name, key))
+        if entry is None:
+            return None
+
+        self.entries.move_to_end((layer_name, key))
+        return entry[0], entry[1]
+
+    def put(self, layer_name, key, weights, bias):
+        if self.size_limit <= 0:
+            return
+
+        device = self.storage_device()
+
+        def copy(x):
+            return None if x is None else x.detach().to(device, copy=True)
+
+        weights = tuple(copy(x) for x in weights) if isinstance(weights, tuple) else copy(weights)
+        bias = copy(bias)
+        nbytes = sum(x.element_size() * x.nelement() for x in (*(weights if isinstance(weights, tuple) else [weights]), bias) if x is not None)
+
+        old = self.entries.pop((layer_name, key), None)
+        if old is not None:
+            self.nbytes -= old[2]
+
+        self.entries[(layer_name, key)] = (weights, bias, nbytes)
+        self.nbytes += nbytes
+        self.apply_size_limit()
+
+    def apply_size_limit(self):
+        while self.entries and self.nbytes > self.size_limit:
+            _, (_, _, nbytes) = self.entries.popitem(last=False)
+            self.nbytes -= nbytes
+
+    def clear(self, *args):
+        self.entries.clear()
+        self.nbytes = 0
+
+
+weights_cache = NetworkWeightsCache()
+
+
+def network_restore_weights(self, weights, bias):
+    if isinstance(self, torch.nn.MultiheadAttention):
+        restore_weights_backup(self, 'in_proj_weight', weights[0])
+        restore_weights_backup(self.out_proj, 'weight', weights[1])
+        restore_weights_backup(self.out_proj, 'bias', bias)
+    else:
+        restore_weights_backup(self, 'weight', weights)
+        restore_weights_backup(self, 'bias', bias)
+
+
+def network_current_weights(self):
+    if isinstance(self, torch.nn.MultiheadAttention):
+        return (self.in_proj_weight, self.out_proj.weight), self.out_proj.bias
+
+    return self.weight, getattr(self, 'bias', None)
 
 
 def network_restore_weights_from_backup(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn.GroupNorm, torch.nn.LayerNorm, torch.nn.MultiheadAttention]):
@@ -451,6 +538,15 @@ def network_apply_weights(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn
         self.network_bias_backup = bias_backup
 
     if current_names != wanted_names:
+        cache_key = wanted_names + tuple(x.mtime for x in loaded_networks)
+        cached = weights_cache.get(network_layer_name, cache_key) if wanted_names != () and weights_cache.size_limit > 0 else None
+        if cached is not None:
+            with torch.no_grad():
+                network_restore_weights(self, *cached)
+
+            self.network_current_names = wanted_names
+            return
+
         network_restore_weights_from_backup(self)
 
         for net in loaded_networks:
@@ -539,6 +635,10 @@ def network_apply_weights(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn
             logging.debug(f"Network {net.name} layer {network_layer_name}: couldn't find supported operation")
             extra_network_lora.errors[net.name] = extra_network_lora.errors.get(net.name, 0) + 1
 
+        # layers not changed by any of the networks are not cached since their weights are the same as backup
+        if wanted_names != () and any(network_layer_name in net.modules or network_layer_name + "_q_proj" in net.modules for net in loaded_networks):
+            weights_cache.put(network_layer_name, cache_key, *network_current_weights(self))
+
         self.network_current_names = wanted_names
 
 
@@ -648,17 +748,17 @@ def network_MultiheadAttention_load_state_dict(self, *args, **kwargs):
 
 
 def process_network_files(names: list[str] | None = None):
-    candidates = list(shared.walk_files(shared.cmd_opts.lora_dir, allowed_extensions=[".pt", ".ckpt", ".safetensors"]))
-    candidates += list(shared.walk_files(shared.cmd_opts.lyco_dir_backcompat, allowed_extensions=[".pt", ".ckpt", ".safetensors"]))
+    candidates, changed_dirs = network_index.index.list_files([shared.cmd_opts.lora_dir, shared.cmd_opts.lyco_dir_backcompat], allowed_extensions=[".pt", ".ckpt", ".safetensors"])
     for filename in candidates:
-        if os.path.isdir(filename):
-            continue
         name = os.path.splitext(os.path.basename(filename))[0]
         # if names is provided, only load networks with names in the list
         if names and name not in names:
             continue
         try:
-            entry = network.NetworkOnDisk(name, filename)
+            index_entry = network_index.index.get(filename, verify=os.path.dirname(filename) in changed_dirs)
+            entry = network.NetworkOnDisk(name, filename, index_entry=index_entry)
+            if index_entry is None:
+                network_index.index.store(entry)
         except OSError:  # should catch FileNotFoundError and PermissionError etc.
             errors.report(f"Failed to load network {name} from {filename}", exc_info=True)
             continue
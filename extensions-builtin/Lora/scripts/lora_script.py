@@ -27,6 +27,7 @@ def before_ui():
 networks.originals = lora_patches.LoraPatches()
 
 script_callbacks.on_model_loaded(networks.assign_network_names_to_compvis_modules)
+script_callbacks.on_model_loaded(networks.weights_cache.clear)
 script_callbacks.on_script_unloaded(unload)
 script_callbacks.on_before_ui(before_ui)
 script_callbacks.on_infotext_pasted(networks.infotext_pasted)
@@ -40,6 +41,8 @@ shared.options_templates.update(shared.options_section(('extra_networks', "Extra
     "lora_show_all": shared.OptionInfo(False, "Always show all networks on the Lora page").info("otherwise, those detected as for incompatible version of Stable Diffusion will be hidden"),
     "lora_hide_unknown_for_versions": shared.OptionInfo([], "Hide networks of unknown versions for model versions", gr.CheckboxGroup, {"choices": ["SD1", "SD2", "SDXL"]}),
     "lora_in_memory_limit": shared.OptionInfo(0, "Number of Lora networks to keep cached in memory", gr.Number, {"precision": 0}),
+    "lora_weights_cache_size": shared.OptionInfo(0, "Size of cache for model weights with Lora networks applied (MB)", gr.Number, {"precision": 0}).info("0 = disable; switching back to a recently used combination of networks and weights copies cached weights instead of calculating them again"),
+    "lora_weights_cache_device": shared.OptionInfo("CPU", "Store cached weights with Lora networks applied in", gr.Radio, {"choices": ["CPU", "GPU"]}),
     "lora_not_found_warning_console": shared.OptionInfo(False, "Lora not found warning in console"),
     "lora_not_found_gradio_warning": shared.OptionInfo(False, "Lora not found warning popup in webui"),
 }))
@@ -68,6 +71,22 @@ def api_networks(_: gr.Blocks, app: FastAPI):
     async def refresh_loras():
         return networks.list_available_networks()
 
+    @app.get("/sdapi/v1/lora-index")
+    async def get_lora_index(name: str = None, alias: str = None, hash: str = None):
+        """Looks up networks by name, alias or hash (full or at least 12 characters); with no arguments, lists all networks."""
+
+        if name is not None:
+            found = [networks.available_networks.get(name)]
+        elif alias is not None:
+            found = [networks.available_network_aliases.get(alias)]
+        elif hash is not None:
+            found = [networks.available_network_hash_lookup.get(hash[0:12].lower())]
+            found = [x for x in found if x is not None and x.hash.startswith(hash.lower())]
+        else:
+            found = list(networks.available_networks.values())
+
+        return [{**create_lora_json(obj), "sd_version": obj.sd_version.name, "hash": obj.hash} for obj in found if obj is not None]
+
 
 script_callbacks.on_app_started(api_networks)
 
@@ -100,3 +119,5 @@ def infotext_pasted(infotext, d):
 script_callbacks.on_infotext_pasted(infotext_pasted)
 
 shared.opts.onchange("lora_in_memory_limit", networks.purge_networks_from_memory)
+shared.opts.onchange("lora_weights_cache_size", networks.weights_cache.apply_size_limit)
+shared.opts.onchange("lora_weights_cache_device", networks.weights_cache.clear)
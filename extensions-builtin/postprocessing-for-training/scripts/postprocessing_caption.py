@@ -20,11 +20,23 @@ class ScriptPostprocessingCeption(scripts_postprocessing.ScriptPostprocessing):
             return
 
         captions = [pp.caption]
+        tags_index = None
 
         if "Deepbooru" in option:
-            captions.append(deepbooru.model.tag(pp.image))
+            if pp.tag_later is None:
+                captions.append(deepbooru.model.tag(pp.image))
+            else:
+                tags_index = len(captions)
+                captions.append(None)
 
         if "BLIP" in option:
             captions.append(shared.interrogator.interrogate(pp.image.convert("RGB")))
 
         pp.caption = ", ".join([x for x in captions if x])
+
+        if tags_index is not None:
+            def set_tags(tags):
+                captions[tags_index] = tags
+                pp.caption = ", ".join([x for x in captions if x])
+
+            pp.tag_later(pp.image, set_tags)
@@ -1,7 +1,11 @@
 import base64
 import io
+import json
 import os
+import queue
+import threading
 import time
+import uuid
 import datetime
 import uvicorn
 import ipaddress
@@ -12,20 +16,19 @@ from io import BytesIO
 from fastapi import APIRouter, Depends, FastAPI, Request, Response
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.exceptions import HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.encoders import jsonable_encoder
 from secrets import compare_digest
 
 import modules.shared as shared
-from modules import sd_samplers, deepbooru, sd_hijack, images, scripts, ui, postprocessing, errors, restart, shared_items, script_callbacks, infotext_utils, sd_models, sd_schedulers, sysinfo
+from modules import sd_samplers, sd_hijack, images, scripts, postprocessing, errors, restart, shared_items, script_callbacks, infotext_utils, sd_models, sd_schedulers, sysinfo, sd_models_mmap, hashes, conds_cache, job_scheduler, images_writer, micro_batching, timer
 from modules.api import models
 from modules.shared import opts
-from modules.processing import StableDiffusionProcessingTxt2Img, StableDiffusionProcessingImg2Img, process_images
+from modules.processing import StableDiffusionProcessingTxt2Img, StableDiffusionProcessingImg2Img, process_images, wait_for_image_saves
 from modules.textual_inversion.textual_inversion import create_embedding, train_embedding
 from modules.hypernetworks.hypernetwork import create_hypernetwork, train_hypernetwork
 from PIL import PngImagePlugin
 from modules.sd_models_config import find_checkpoint_config_near_filename
-from modules.realesrgan_model import get_realesrgan_models
 from modules import devices
 from typing import Any
 import piexif
@@ -49,6 +52,15 @@ def validate_sampler_name(name):
     return name
 
 
+def request_client(request: Request):
+    """Identifies the client for fair sharing of the job queue between clients."""
+
+    if request is None or request.client is None:
+        return None
+
+    return request.client.host
+
+
 def setUpscalers(req: dict):
     reqDict = vars(req)
     reqDict['extras_upscaler_1'] = reqDict.pop('upscaler_1', None)
@@ -100,11 +112,11 @@ def decode_base64_to_image(encoding):
         raise HTTPException(status_code=500, detail="Invalid encoded image") from e
 
 
-def encode_pil_to_base64(image):
+def encode_pil_to_bytes(image, image_format=None):
+    image_format = (image_format or opts.samples_format).lower()
+
     with io.BytesIO() as output_bytes:
-        if isinstance(image, str):
-            return image
-        if opts.samples_format.lower() == 'png':
+        if image_format == 'png':
             use_metadata = False
             metadata = PngImagePlugin.PngInfo()
             for key, value in image.info.items():
@@ -113,14 +125,14 @@ def encode_pil_to_base64(image):
                     use_metadata = True
             image.save(output_bytes, format="PNG", pnginfo=(metadata if use_metadata else None), quality=opts.jpeg_quality)
 
-        elif opts.samples_format.lower() in ("jpg", "jpeg", "webp"):
+        elif image_format in ("jpg", "jpeg", "webp"):
             if image.mode in ("RGBA", "P"):
                 image = image.convert("RGB")
             parameters = image.info.get('parameters', None)
             exif_bytes = piexif.dump({
                 "Exif": { piexif.ExifIFD.UserComment: piexif.helper.UserComment.dump(parameters or "", encoding="unicode") }
             })
-            if opts.samples_format.lower() in ("jpg", "jpeg"):
+            if image_format in ("jpg", "jpeg"):
                 image.save(output_bytes, format="JPEG", exif = exif_bytes, quality=opts.jpeg_quality)
             else:
                 image.save(output_bytes, format="WEBP", exif = exif_bytes, quality=opts.jpeg_quality, lossless=opts.webp_lossless)
@@ -128,9 +140,92 @@ def encode_pil_to_base64(image):
         else:
             raise HTTPException(status_code=500, detail="Invalid image format")
 
-        bytes_data = output_bytes.getvalue()
+        return output_bytes.getvalue()
+
+
+def encode_pil_to_base64(image):
+    if isinstance(image, str):
+        return image
+
+    return base64.b64encode(encode_pil_to_bytes(image))
+
+
+stream_media_types = {"png": "image/png", "jpg": "image/jpeg", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+
+def stream_image_format(image_format):
+    """Returns the format images of a streaming response are encoded in; raises HTTPException if it's not supported."""
+
+    image_format = (image_format or opts.samples_format).lower()
+    if image_format not in stream_media_types:
+        raise HTTPException(status_code=422, detail=f"Invalid stream image format: {image_format}")
+
+    return image_format
+
+
+def stream_processing_response(generate, parameters, *, send_images=True, image_format=None):
+    """
+    Runs generate(image_ready_callback) on a separate thread and returns a multipart/mixed response with one part per image,
+    sent as soon as the image is ready, and a final JSON part with parameters and info, same as in the regular response.
+
+    Images are encoded on the background image writer pool if it's enabled. Infotext of each image is sent in X-Infotext header of its part as a JSON string.
+    """
+
+    image_format = stream_image_format(image_format)
 
-    return base64.b64encode(bytes_data)
+    boundary = uuid.uuid4().hex
+    parts = queue.Queue()
+    sent = set()
+
+    def add_image(image, infotext):
+        sent.add(id(image))
+        if not send_images or isinstance(image, str):
+            return
+
+        def encode():
+            return encode_pil_to_bytes(image, image_format)
+
+        # without the pool, the image is encoded by the thread sending the response rather than the one generating images
+        if images_writer.image_writer.max_threads() > 0:
+            encode = images_writer.image_writer.run(encode).result
+
+        parts.put(("image", encode, infotext))
+
+    def run():
+        try:
+            processed = generate(add_image)
+            for image in processed.images:
+                if id(image) not in sent:
+                    add_image(image, image.info.get("parameters") if hasattr(image, "info") else None)
+
+            parts.put(("json", {"parameters": parameters, "info": processed.js()}, None))
+        except Exception as e:
+            errors.report("Error generating images for streaming response", exc_info=True)
+            parts.put(("json", {"error": type(e).__name__, "errors": str(e)}, None))
+        finally:
+            parts.put(None)
+
+    def part(headers, data):
+        head = "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+        return f"--{boundary}\r\n{head}Content-Length: {len(data)}\r\n\r\n".encode() + data + b"\r\n"
+
+    def body():
+        while (item := parts.get()) is not None:
+            kind, value, infotext = item
+            if kind == "image":
+                headers = {"Content-Type": stream_media_types[image_format]}
+                if infotext is not None:
+                    headers["X-Infotext"] = json.dumps(infotext)
+
+                yield part(headers, value())
+            else:
+                yield part({"Content-Type": "application/json"}, json.dumps(jsonable_encoder(value)).encode())
+
+        yield f"--{boundary}--\r\n".encode()
+
+    threading.Thread(target=run, name="api-stream", daemon=True).start()
+
+    return StreamingResponse(body(), media_type=f"multipart/mixed; boundary={boundary}")
 
 
 def api_middleware(app: FastAPI):
@@ -151,6 +246,7 @@ def api_middleware(app: FastAPI):
         res: Response = await call_next(req)
         duration = str(round(time.time() - ts, 4))
         res.headers["X-Process-Time"] = duration
+        timer.record_first_response()
         endpoint = req.scope.get('path', 'err')
         if shared.cmd_opts.api_log and endpoint.startswith('/sdapi'):
             print('API {t} {code} {prot}/{ver} {method} {endpoint} {cli} {duration}'.format(
@@ -216,6 +312,7 @@ class Api:
         self.add_api_route("/sdapi/v1/png-info", self.pnginfoapi, methods=["POST"], response_model=models.PNGInfoResponse)
         self.add_api_route("/sdapi/v1/progress", self.progressapi, methods=["GET"], response_model=models.ProgressResponse)
         self.add_api_route("/sdapi/v1/interrogate", self.interrogateapi, methods=["POST"])
+        self.add_api_route("/sdapi/v1/deepbooru-batch", self.deepbooru_batch_api, methods=["POST"], response_model=models.DeepbooruBatchResponse)
         self.add_api_route("/sdapi/v1/interrupt", self.interruptapi, methods=["POST"])
         self.add_api_route("/sdapi/v1/skip", self.skip, methods=["POST"])
         self.add_api_route("/sdapi/v1/options", self.get_config, methods=["GET"], response_model=models.OptionsModel)
@@ -235,6 +332,9 @@ class Api:
         self.add_api_route("/sdapi/v1/refresh-embeddings", self.refresh_embeddings, methods=["POST"])
         self.add_api_route("/sdapi/v1/refresh-checkpoints", self.refresh_checkpoints, methods=["POST"])
         self.add_api_route("/sdapi/v1/refresh-vae", self.refresh_vae, methods=["POST"])
+        self.add_api_route("/sdapi/v1/hashing-progress", self.get_hashing_progress, methods=["GET"], response_model=models.HashingProgressResponse)
+        self.add_api_route("/sdapi/v1/conds-cache", self.get_conds_cache_stats, methods=["GET"], response_model=models.CondsCacheResponse)
+        self.add_api_route("/sdapi/v1/conds-cache", self.clear_conds_cache, methods=["DELETE"])
         self.add_api_route("/sdapi/v1/create/embedding", self.create_embedding, methods=["POST"], response_model=models.CreateResponse)
         self.add_api_route("/sdapi/v1/create/hypernetwork", self.create_hypernetwork, methods=["POST"], response_model=models.CreateResponse)
         self.add_api_route("/sdapi/v1/train/embedding", self.train_embedding, methods=["POST"], response_model=models.TrainResponse)
@@ -255,22 +355,39 @@ class Api:
 
         self.default_script_arg_txt2img = []
         self.default_script_arg_img2img = []
+        self.scripts_lock = Lock()
+
+        # with --nowebui, the UI that arranges script arguments is only built once a request needs scripts
+        if not shared.cmd_opts.nowebui:
+            self.prepare_scripts()
+
+    def prepare_scripts(self):
+        """Makes sure scripts are initialized and their default arguments are known."""
+
+        with self.scripts_lock:
+            if self.default_script_arg_txt2img and self.default_script_arg_img2img:
+                return
+
+            txt2img_script_runner = scripts.scripts_txt2img
+            img2img_script_runner = scripts.scripts_img2img
+
+            if not txt2img_script_runner.scripts or not img2img_script_runner.scripts:
+                from modules import ui, ui_extra_networks
 
-        txt2img_script_runner = scripts.scripts_txt2img
-        img2img_script_runner = scripts.scripts_img2img
+                if shared.cmd_opts.nowebui:
+                    ui_extra_networks.register_default_pages()
 
-        if not txt2img_script_runner.scripts or not img2img_script_runner.scripts:
-            ui.create_ui()
+                ui.create_ui()
 
-        if not txt2img_script_runner.scripts:
-            txt2img_script_runner.initialize_scripts(False)
-        if not self.default_script_arg_txt2img:
-            self.default_script_arg_txt2img = self.init_default_script_args(txt2img_script_runner)
+            if not txt2img_script_runner.scripts:
+                txt2img_script_runner.initialize_scripts(False)
+            if not self.default_script_arg_txt2img:
+                self.default_script_arg_txt2img = self.init_default_script_args(txt2img_script_runner)
 
-        if not img2img_script_runner.scripts:
-            img2img_script_runner.initialize_scripts(True)
-        if not self.default_script_arg_img2img:
-            self.default_script_arg_img2img = self.init_default_script_args(img2img_script_runner)
+            if not img2img_script_runner.scripts:
+                img2img_script_runner.initialize_scripts(True)
+            if not self.default_script_arg_img2img:
+                self.default_script_arg_img2img = self.init_default_script_args(img2img_script_runner)
 
 
 
@@ -295,12 +412,16 @@ class Api:
         return script, script_idx
 
     def get_scripts_list(self):
+        self.prepare_scripts()
+
         t2ilist = [script.name for script in scripts.scripts_txt2img.scripts if script.name is not None]
         i2ilist = [script.name for script in scripts.scripts_img2img.scripts if script.name is not None]
 
         return models.ScriptsList(txt2img=t2ilist, img2img=i2ilist)
 
     def get_script_info(self):
+        self.prepare_scripts()
+
         res = []
 
         for script_list in [scripts.scripts_txt2img.scripts, scripts.scripts_img2img.scripts]:
@@ -432,9 +553,10 @@ class Api:
 
         return params
 
-    def text2imgapi(self, txt2imgreq: models.StableDiffusionTxt2ImgProcessingAPI):
+    def text2imgapi(self, txt2imgreq: models.StableDiffusionTxt2ImgProcessingAPI, request: Request = None):
         task_id = txt2imgreq.force_task_id or create_task_id("txt2img")
 
+        self.prepare_scripts()
         script_runner = scripts.scripts_txt2img
 
         infotext_script_args = {}
@@ -459,40 +581,74 @@ class Api:
         args.pop('script_args', None) # will refeed them to the pipeline directly after initializing them
         args.pop('alwayson_scripts', None)
         args.pop('infotext', None)
+        args.pop('priority', None)
+        args.pop('response_mode', None)
+        args.pop('stream_image_format', None)
 
         script_args = self.init_script_args(txt2imgreq, self.default_script_arg_txt2img, selectable_scripts, selectable_script_idx, script_runner, input_script_args=infotext_script_args)
 
         send_images = args.pop('send_images', True)
         args.pop('save_images', None)
 
+        # checked before the task is queued, so that a bad request does not leave it in the queue
+        if txt2imgreq.response_mode == "stream":
+            stream_image_format(txt2imgreq.stream_image_format)
+
         add_task_to_queue(task_id)
 
-        with self.queue_lock:
-            with closing(StableDiffusionProcessingTxt2Img(sd_model=shared.sd_model, **args)) as p:
+        def queue():
+            return self.queue_lock.job(id_task=task_id, priority=txt2imgreq.priority, client=request_client(request))
+
+        def process(process_args, image_ready_callback, task_ids):
+            with closing(StableDiffusionProcessingTxt2Img(sd_model=shared.sd_model, **process_args)) as p:
                 p.is_api = True
+                p.image_ready_callback = image_ready_callback
                 p.scripts = script_runner
                 p.outpath_grids = opts.outdir_txt2img_grids
                 p.outpath_samples = opts.outdir_txt2img_samples
 
                 try:
                     shared.state.begin(job="scripts_txt2img")
-                    start_task(task_id)
+                    start_task(task_ids[0])
                     if selectable_scripts is not None:
                         p.script_args = script_args
                         processed = scripts.scripts_txt2img.run(p, *p.script_args) # Need to pass args as list here
                     else:
                         p.script_args = tuple(script_args) # Need to pass args as tuple here
                         processed = process_images(p)
-                    finish_task(task_id)
+
+                    wait_for_image_saves(p, processed)
+
+                    for x in task_ids:
+                        finish_task(x)
                 finally:
                     shared.state.end()
                     shared.total_tqdm.clear()
 
+            return processed
+
+        # only plain requests are batched together: scripts may depend on batch size or produce extra images
+        batch_key = None
+        if micro_batching.batcher.enabled() and selectable_scripts is None and not txt2imgreq.alwayson_scripts:
+            batch_key = micro_batching.batch_key(args, priority=txt2imgreq.priority, client=request_client(request))
+
+        def generate(image_ready_callback=None):
+            if batch_key is not None:
+                return micro_batching.batcher.run(batch_key, task_id, args, image_ready_callback, queue, process)
+
+            with queue():
+                return process(args, image_ready_callback, [task_id])
+
+        if txt2imgreq.response_mode == "stream":
+            return stream_processing_response(generate, vars(txt2imgreq), send_images=send_images, image_format=txt2imgreq.stream_image_format)
+
+        processed = generate()
+
         b64images = list(map(encode_pil_to_base64, processed.images)) if send_images else []
 
         return models.TextToImageResponse(images=b64images, parameters=vars(txt2imgreq), info=processed.js())
 
-    def img2imgapi(self, img2imgreq: models.StableDiffusionImg2ImgProcessingAPI):
+    def img2imgapi(self, img2imgreq: models.StableDiffusionImg2ImgProcessingAPI, request: Request = None):
         task_id = img2imgreq.force_task_id or create_task_id("img2img")
 
         init_images = img2imgreq.init_images
@@ -503,6 +659,7 @@ class Api:
         if mask:
             mask = decode_base64_to_image(mask)
 
+        self.prepare_scripts()
         script_runner = scripts.scripts_img2img
 
         infotext_script_args = {}
@@ -529,35 +686,57 @@ class Api:
         args.pop('script_args', None)  # will refeed them to the pipeline directly after initializing them
         args.pop('alwayson_scripts', None)
         args.pop('infotext', None)
+        args.pop('priority', None)
+        args.pop('response_mode', None)
+        args.pop('stream_image_format', None)
 
         script_args = self.init_script_args(img2imgreq, self.default_script_arg_img2img, selectable_scripts, selectable_script_idx, script_runner, input_script_args=infotext_script_args)
 
         send_images = args.pop('send_images', True)
         args.pop('save_images', None)
 
+        # checked before the task is queued, so that a bad request does not leave it in the queue
+        if img2imgreq.response_mode == "stream":
+            stream_image_format(img2imgreq.stream_image_format)
+
         add_task_to_queue(task_id)
 
-        with self.queue_lock:
-            with closing(StableDiffusionProcessingImg2Img(sd_model=shared.sd_model, **args)) as p:
-                p.init_images = [decode_base64_to_image(x) for x in init_images]
-                p.is_api = True
-                p.scripts = script_runner
-                p.outpath_grids = opts.outdir_img2img_grids
-                p.outpath_samples = opts.outdir_img2img_samples
-
-                try:
-                    shared.state.begin(job="scripts_img2img")
-                    start_task(task_id)
-                    if selectable_scripts is not None:
-                        p.script_args = script_args
-                        processed = scripts.scripts_img2img.run(p, *p.script_args) # Need to pass args as list here
-                    else:
-                        p.script_args = tuple(script_args) # Need to pass args as tuple here
-                        processed = process_images(p)
-                    finish_task(task_id)
-                finally:
-                    shared.state.end()
-                    shared.total_tqdm.clear()
+        def generate(image_ready_callback=None):
+            with self.queue_lock.job(id_task=task_id, priority=img2imgreq.priority, client=request_client(request)):
+                with closing(StableDiffusionProcessingImg2Img(sd_model=shared.sd_model, **args)) as p:
+                    p.init_images = [decode_base64_to_image(x) for x in init_images]
+                    p.is_api = True
+                    p.image_ready_callback = image_ready_callback
+                    p.scripts = script_runner
+                    p.outpath_grids = opts.outdir_img2img_grids
+                    p.outpath_samples = opts.outdir_img2img_samples
+
+                    try:
+                        shared.state.begin(job="scripts_img2img")
+                        start_task(task_id)
+                        if selectable_scripts is not None:
+                            p.script_args = script_args
+                            processed = scripts.scripts_img2img.run(p, *p.script_args) # Need to pass args as list here
+                        else:
+                            p.script_args = tuple(script_args) # Need to pass args as tuple here
+                            processed = process_images(p)
+
+                        wait_for_image_saves(p, processed)
+                        finish_task(task_id)
+                    finally:
+                        shared.state.end()
+                        shared.total_tqdm.clear()
+
+            return processed
+
+        if img2imgreq.response_mode == "stream":
+            if not img2imgreq.include_init_images:
+                img2imgreq.init_images = None
+                img2imgreq.mask = None
+
+            return stream_processing_response(generate, vars(img2imgreq), send_images=send_images, image_format=img2imgreq.stream_image_format)
+
+        processed = generate()
 
         b64images = list(map(encode_pil_to_base64, processed.images)) if send_images else []
 
@@ -593,12 +772,13 @@ class Api:
         if image is None:
             return models.PNGInfoResponse(info="")
 
-        geninfo, items = images.read_info_from_image(image)
-        if geninfo is None:
-            geninfo = ""
+        with job_scheduler.scheduler.lane("cpu").job():
+            geninfo, items = images.read_info_from_image(image)
+            if geninfo is None:
+                geninfo = ""
 
-        params = infotext_utils.parse_generation_parameters(geninfo)
-        script_callbacks.infotext_pasted_callback(geninfo, params)
+            params = infotext_utils.parse_generation_parameters(geninfo)
+            script_callbacks.infotext_pasted_callback(geninfo, params)
 
         return models.PNGInfoResponse(info=geninfo, items=items, parameters=params)
 
@@ -638,17 +818,56 @@ class Api:
         img = decode_base64_to_image(image_b64)
         img = img.convert('RGB')
 
+        # CLIP interrogator running on CPU leaves VRAM and the progress of the current job alone, so it does not wait for generation
+        lane = "cpu" if interrogatereq.model == "clip" and shared.interrogator.running_on_cpu else "gpu"
+
         # Override object param
-        with self.queue_lock:
+        with job_scheduler.scheduler.lane(lane).job():
             if interrogatereq.model == "clip":
                 processed = shared.interrogator.interrogate(img)
             elif interrogatereq.model == "deepdanbooru":
+                from modules import deepbooru
                 processed = deepbooru.model.tag(img)
             else:
                 raise HTTPException(status_code=404, detail="Model not found")
 
         return models.InterrogateResponse(caption=processed)
 
+    def deepbooru_batch_api(self, req: models.DeepbooruBatchRequest):
+        from modules import deepbooru
+
+        if req.directory and shared.cmd_opts.hide_ui_dir_config:
+            raise HTTPException(status_code=403, detail="Tagging a directory is not available with --hide-ui-dir-config")
+        if req.directory and not os.path.isdir(req.directory):
+            raise HTTPException(status_code=404, detail="Directory not found")
+
+        filenames = list(shared.walk_files(req.directory, allowed_extensions=(".png", ".jpg", ".jpeg", ".webp", ".tif", ".tiff"))) if req.directory else []
+        pil_images = [decode_base64_to_image(x) for x in req.images]
+
+        items = []
+        with job_scheduler.scheduler.lane("gpu").job(), deepbooru.model.resident():
+            shared.state.begin(job="deepbooru")
+            shared.state.job_count = len(filenames) + len(pil_images)
+            try:
+                for index, tags in deepbooru.model.tag_many(range(len(pil_images)), load=lambda i: pil_images[i], batch_size=req.batch_size):
+                    items.append(models.DeepbooruBatchItem(name=str(index), caption=tags))
+                    shared.state.nextjob()
+
+                # captions are written as soon as each batch is tagged, so an interrupted job keeps what it has done
+                for filename, tags in deepbooru.model.tag_many(filenames, load=images.read, batch_size=req.batch_size):
+                    if req.write_captions:
+                        try:
+                            postprocessing.write_caption(f"{os.path.splitext(filename)[0]}.txt", tags)
+                        except Exception:
+                            pass  # reported to console by write_caption; the tags are still returned
+
+                    items.append(models.DeepbooruBatchItem(name=filename, caption=tags))
+                    shared.state.nextjob()
+            finally:
+                shared.state.end()
+
+        return models.DeepbooruBatchResponse(items=items)
+
     def interruptapi(self):
         shared.state.interrupt()
 
@@ -741,6 +960,8 @@ class Api:
         return [{"name":x.name(), "cmd_dir": getattr(x, "cmd_dir", None)} for x in shared.face_restorers]
 
     def get_realesrgan_models(self):
+        from modules.realesrgan_model import get_realesrgan_models
+
         return [{"name":x.name,"path":x.data_path, "scale":x.scale} for x in get_realesrgan_models(None)]
 
     def get_prompt_styles(self):
@@ -783,6 +1004,17 @@ class Api:
         with self.queue_lock:
             shared_items.refresh_vae_list()
 
+    def get_hashing_progress(self):
+        return hashes.background_hasher.progress()
+
+    def get_conds_cache_stats(self):
+        return conds_cache.conds_cache.stats()
+
+    def clear_conds_cache(self):
+        conds_cache.conds_cache.clear()
+
+        return {}
+
     def create_embedding(self, args: dict):
         try:
             shared.state.begin(job="create_embedding")
@@ -884,7 +1116,7 @@ class Api:
                 cuda = {'error': 'unavailable'}
         except Exception as err:
             cuda = {'error': f'{err}'}
-        return models.MemoryResponse(ram=ram, cuda=cuda)
+        return models.MemoryResponse(ram=ram, cuda=cuda, checkpoint_cache=sd_models_mmap.mapped_checkpoints.stats())
 
     def get_extensions_list(self):
         from modules import extensions
@@ -4,7 +4,7 @@ from pydantic import BaseModel, Field, create_model
 from typing import Any, Optional, Literal
 from inflection import underscore
 from modules.processing import StableDiffusionProcessingTxt2Img, StableDiffusionProcessingImg2Img
-from modules.shared import sd_upscalers, opts, parser
+from modules.shared import opts, parser
 
 API_NOT_ALLOWED = [
     "self",
@@ -109,6 +109,9 @@ StableDiffusionTxt2ImgProcessingAPI = PydanticModelGenerator(
         {"key": "alwayson_scripts", "type": dict, "default": {}},
         {"key": "force_task_id", "type": str, "default": None},
         {"key": "infotext", "type": str, "default": None},
+        {"key": "priority", "type": int, "default": 0},
+        {"key": "response_mode", "type": str, "default": "json"},
+        {"key": "stream_image_format", "type": str, "default": None},
     ]
 ).generate_model()
 
@@ -128,6 +131,9 @@ StableDiffusionImg2ImgProcessingAPI = PydanticModelGenerator(
         {"key": "alwayson_scripts", "type": dict, "default": {}},
         {"key": "force_task_id", "type": str, "default": None},
         {"key": "infotext", "type": str, "default": None},
+        {"key": "priority", "type": int, "default": 0},
+        {"key": "response_mode", "type": str, "default": "json"},
+        {"key": "stream_image_format", "type": str, "default": None},
     ]
 ).generate_model()
 
@@ -151,8 +157,8 @@ class ExtrasBaseRequest(BaseModel):
     upscaling_resize_w: int = Field(default=512, title="Target Width", ge=1, description="Target width for the upscaler to hit. Only used when resize_mode=1.")
     upscaling_resize_h: int = Field(default=512, title="Target Height", ge=1, description="Target height for the upscaler to hit. Only used when resize_mode=1.")
     upscaling_crop: bool = Field(default=True, title="Crop to fit", description="Should the upscaler crop the image to fit in the chosen size?")
-    upscaler_1: str = Field(default="None", title="Main upscaler", description=f"The name of the main upscaler to use, it has to be one of this list: {' , '.join([x.name for x in sd_upscalers])}")
-    upscaler_2: str = Field(default="None", title="Secondary upscaler", description=f"The name of the secondary upscaler to use, it has to be one of this list: {' , '.join([x.name for x in sd_upscalers])}")
+    upscaler_1: str = Field(default="None", title="Main upscaler", description="The name of the main upscaler to use, it has to be one of the names listed by /sdapi/v1/upscalers")
+    upscaler_2: str = Field(default="None", title="Secondary upscaler", description="The name of the secondary upscaler to use, it has to be one of the names listed by /sdapi/v1/upscalers")
     extras_upscaler_2_visibility: float = Field(default=0, title="Secondary upscaler visibility", ge=0, le=1, allow_inf_nan=False, description="Sets the visibility of secondary upscaler, values should be between 0 and 1.")
     upscale_first: bool = Field(default=False, title="Upscale first", description="Should the upscaler run before restoring faces?")
 
@@ -200,6 +206,19 @@ class InterrogateRequest(BaseModel):
 class InterrogateResponse(BaseModel):
     caption: str = Field(default=None, title="Caption", description="The generated caption for the image.")
 
+class DeepbooruBatchRequest(BaseModel):
+    images: list[str] = Field(default=[], title="Images", description="Images to tag, as Base64 strings containing the images' data.")
+    directory: Optional[str] = Field(default=None, title="Directory", description="Directory on the server with images to tag, including subdirectories; not available with --hide-ui-dir-config.")
+    write_captions: bool = Field(default=False, title="Write captions", description="Save tags of images from the directory into .txt files next to them, as they are tagged; existing captions are handled according to settings.")
+    batch_size: Optional[int] = Field(default=None, title="Batch size", description="Number of images run through the model at once; defaults to the value from settings.")
+
+class DeepbooruBatchItem(BaseModel):
+    name: Optional[str] = Field(default=None, title="Name", description="Path to the image for images from the directory, or its index for images from the request.")
+    caption: str = Field(title="Caption", description="Tags of the image.")
+
+class DeepbooruBatchResponse(BaseModel):
+    items: list[DeepbooruBatchItem] = Field(title="Items", description="Tags of every image that was read successfully, in order.")
+
 class TrainResponse(BaseModel):
     info: str = Field(title="Train info", description="Response string from train embedding or hypernetwork task.")
 
@@ -294,9 +313,34 @@ class EmbeddingsResponse(BaseModel):
     loaded: dict[str, EmbeddingItem] = Field(title="Loaded", description="Embeddings loaded for the current model")
     skipped: dict[str, EmbeddingItem] = Field(title="Skipped", description="Embeddings skipped for the current model (likely due to architecture incompatibility)")
 
+class HashingProgressItem(BaseModel):
+    filename: str = Field(title="Filename")
+    title: str = Field(title="Title", description="Name under which the hash is stored in cache")
+    size: int = Field(title="Size", description="Size of the file in bytes")
+    bytes_done: int = Field(title="Bytes done", description="How many bytes of the file have been hashed so far")
+
+class HashingProgressResponse(BaseModel):
+    threads: int = Field(title="Threads", description="Number of running background hashing threads")
+    queued: int = Field(title="Queued", description="Number of files waiting to be hashed")
+    in_progress: list[HashingProgressItem] = Field(title="In progress", description="Files that are being hashed right now")
+    completed: int = Field(title="Completed", description="Number of files hashed since startup")
+    failed: int = Field(title="Failed", description="Number of files that could not be hashed since startup")
+    bytes_hashed: int = Field(title="Bytes hashed", description="Total size of files hashed since startup")
+
+class CondsCacheResponse(BaseModel):
+    enabled: bool = Field(title="Enabled", description="Whether the shared cond cache is enabled in settings")
+    entries: int = Field(title="Entries", description="Number of conds kept in memory")
+    bytes: int = Field(title="Bytes", description="Total size of conds kept in memory")
+    size_limit: int = Field(title="Size limit", description="Maximum total size of conds kept in memory")
+    hits: int = Field(title="Hits", description="How many times conds were found in memory")
+    disk_hits: int = Field(title="Disk hits", description="How many times conds were loaded from disk")
+    misses: int = Field(title="Misses", description="How many times conds had to be calculated")
+    evictions: int = Field(title="Evictions", description="How many conds were removed from memory to stay within the size limit")
+
 class MemoryResponse(BaseModel):
     ram: dict = Field(title="RAM", description="System memory stats")
     cuda: dict = Field(title="CUDA", description="nVidia CUDA memory stats")
+    checkpoint_cache: dict = Field(default=None, title="Checkpoint cache", description="Memory-mapped checkpoint cache stats")
 
 
 class ScriptsList(BaseModel):
@@ -3,14 +3,14 @@ from functools import wraps
 import html
 import time
 
-from modules import shared, progress, errors, devices, fifo_lock, profiling
+from modules import shared, progress, errors, devices, job_scheduler, profiling
 
-queue_lock = fifo_lock.FIFOLock()
+queue_lock = job_scheduler.scheduler.lane("gpu")
 
 
-def wrap_queued_call(func):
+def wrap_queued_call(func, lane="gpu", priority=0):
     def f(*args, **kwargs):
-        with queue_lock:
+        with job_scheduler.scheduler.lane(lane).job(priority=priority):
             res = func(*args, **kwargs)
 
         return res
@@ -29,7 +29,7 @@ def wrap_gradio_gpu_call(func, extra_outputs=None):
         else:
             id_task = None
 
-        with queue_lock:
+        with queue_lock.job(id_task=id_task):
             shared.state.begin(job=id_task)
             progress.start_task(id_task)
 
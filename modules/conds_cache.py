@@ -0,0 +1,206 @@
+import collections
+import hashlib
+import threading
+
+import torch
+
+from modules import shared, devices, cache, prompt_parser, extra_networks, errors
+
+cond_options = [
+    "comma_padding_backtrack",
+    "sdxl_clip_l_skip",
+    "use_old_emphasis_implementation",
+    "sdxl_refiner_low_aesthetic_score",
+    "sdxl_refiner_high_aesthetic_score",
+]
+"""settings that change tokenization or text encoder output, and are not a part of StableDiffusionProcessing.cached_params"""
+
+
+def map_conds(x, fn):
+    """Returns a copy of conditioning x, which is the result of one of prompt_parser.get_*_conditioning functions, with fn applied to every tensor in it."""
+
+    if isinstance(x, torch.Tensor):
+        return fn(x)
+    if isinstance(x, prompt_parser.ScheduledPromptConditioning):
+        return prompt_parser.ScheduledPromptConditioning(x.end_at_step, map_conds(x.cond, fn))
+    if isinstance(x, prompt_parser.ComposableScheduledPromptConditioning):
+        return prompt_parser.ComposableScheduledPromptConditioning(map_conds(x.schedules, fn), x.weight)
+    if isinstance(x, prompt_parser.MulticondLearnedConditioning):
+        return prompt_parser.MulticondLearnedConditioning(x.shape, map_conds(x.batch, fn))
+    if isinstance(x, dict):
+        return {k: map_conds(v, fn) for k, v in x.items()}
+    if isinstance(x, list):
+        return [map_conds(v, fn) for v in x]
+
+    return x
+
+
+def conds_nbytes(x):
+    seen = {}
+
+    def count(tensor):
+        seen[id(tensor)] = tensor.element_size() * tensor.nelement()
+        return tensor
+
+    map_conds(x, count)
+
+    return sum(seen.values())
+
+
+def stable_repr(x):
+    """Text representation of cond cache parameters that stays the same between program runs."""
+
+    from modules import sd_models
+
+    if isinstance(x, sd_models.CheckpointInfo):
+        return repr((x.filename, x.sha256 or x.hash))
+    if isinstance(x, extra_networks.ExtraNetworkParams):
+        return repr(x.items)
+    if isinstance(x, dict):
+        return "{" + ", ".join(f"{stable_repr(k)}: {stable_repr(v)}" for k, v in sorted(x.items(), key=lambda kv: str(kv[0]))) + "}"
+    if isinstance(x, (list, tuple)):
+        return "[" + ", ".join(stable_repr(v) for v in x) + "]"
+
+    return repr(x)
+
+
+def embeddings_fingerprint():
+    from modules import sd_hijack
+
+    db = sd_hijack.model_hijack.embedding_db
+    return sorted((name, getattr(embedding, 'hash', None)) for name, embedding in db.word_embeddings.items())
+
+
+class CondsCache:
+    """
+    Process-wide LRU cache of text encoder results, shared by all processing objects.
+
+    Keys are built from the same parameters StableDiffusionProcessing.cached_params uses, plus the function that computed the conds and
+    settings from cond_options.
+    Entries are kept on the device they were created on, bounded by the total size of their tensors. If enabled in settings, entries
+    evicted from memory are stored on disk and brought back when needed again.
+    """
+
+    def __init__(self):
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def size_limit(self):
+        return int(shared.opts.conds_cache_size * 1024 * 1024)
+
+    def enabled(self):
+        return self.size_limit > 0
+
+    def disk_cache(self):
+        return cache.cache("conds")
+
+    def key(self, function, required_prompts, cached_params):
+        """Returns key for cache, or None if the cache is disabled."""
+
+        if not self.enabled():
+            return None
+
+        text = stable_repr((
+            function.__module__,
+            function.__qualname__,
+            getattr(required_prompts, 'is_negative_prompt', False),
+            cached_params,
+            {name: getattr(shared.opts, name, None) for name in cond_options},
+            embeddings_fingerprint(),
+        ))
+
+        return hashlib.sha256(text.encode("utf8")).hexdigest()
+
+    def get(self, key):
+        if key is None:
+            return None
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+        if shared.opts.conds_cache_disk:
+            try:
+                conds = self.disk_cache().get(key)
+            except Exception as e:
+                errors.display(e, "reading conds from disk cache")
+                conds = None
+
+            if conds is not None:
+                conds = map_conds(conds, lambda x: x.to(devices.device))
+                with self.lock:
+                    self.disk_hits += 1
+
+                self.put(key, conds)
+                return conds
+
+        with self.lock:
+            self.misses += 1
+
+        return None
+
+    def put(self, key, conds):
+        if key is None:
+            return
+
+        nbytes = conds_nbytes(conds)
+        if nbytes > self.size_limit:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1]
+
+            self.entries[key] = (conds, nbytes)
+            self.nbytes += nbytes
+
+            evicted = self.evict()
+
+        if shared.opts.conds_cache_disk:
+            for evicted_key, evicted_conds in evicted:
+                self.disk_cache()[evicted_key] = map_conds(evicted_conds, lambda x: x.cpu())
+
+    def evict(self):
+        evicted = []
+
+        while self.entries and self.nbytes > self.size_limit:
+            key, (conds, nbytes) = self.entries.popitem(last=False)
+            self.nbytes -= nbytes
+            self.evictions += 1
+            evicted.append((key, conds))
+
+        return evicted
+
+    def apply_size_limit(self):
+        with self.lock:
+            self.evict()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "enabled": self.enabled(),
+                "entries": len(self.entries),
+                "bytes": self.nbytes,
+                "size_limit": self.size_limit,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+conds_cache = CondsCache()
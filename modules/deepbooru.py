@@ -1,10 +1,11 @@
+import contextlib
 import os
 import re
 
 import torch
 import numpy as np
 
-from modules import modelloader, paths, deepbooru_model, devices, images, shared
+from modules import modelloader, paths, deepbooru_model, devices, images, shared, util, errors
 
 re_special = re.compile(r'([\\()])')
 
@@ -12,6 +13,9 @@ re_special = re.compile(r'([\\()])')
 class DeepDanbooru:
     def __init__(self):
         self.model = None
+        self.resident_jobs = 0
+        self.tag_table_key = None
+        self.tag_table_val = None
 
     def load(self):
         if self.model is not None:
@@ -35,10 +39,22 @@ class DeepDanbooru:
         self.model.to(devices.device)
 
     def stop(self):
-        if not shared.opts.interrogate_keep_models_in_memory:
+        if self.resident_jobs == 0 and not shared.opts.interrogate_keep_models_in_memory:
             self.model.to(devices.cpu)
             devices.torch_gc()
 
+    @contextlib.contextmanager
+    def resident(self):
+        """Keeps the model on GPU between calls to tag() until the end of the block, for jobs that tag many images."""
+
+        self.resident_jobs += 1
+        try:
+            yield
+        finally:
+            self.resident_jobs -= 1
+            if self.resident_jobs == 0 and self.model is not None:
+                self.stop()
+
     def tag(self, pil_image):
         self.start()
         res = self.tag_multi(pil_image)
@@ -47,52 +63,109 @@ class DeepDanbooru:
         return res
 
     def tag_multi(self, pil_image, force_disable_ranks=False):
-        threshold = shared.opts.interrogate_deepbooru_score_threshold
-        use_spaces = shared.opts.deepbooru_use_spaces
-        use_escape = shared.opts.deepbooru_escape
-        alpha_sort = shared.opts.deepbooru_sort_alpha
-        include_ranks = shared.opts.interrogate_return_ranks and not force_disable_ranks
+        return self.tag_batch([pil_image], force_disable_ranks=force_disable_ranks)[0]
 
-        pic = images.resize_image(2, pil_image.convert("RGB"), 512, 512)
-        a = np.expand_dims(np.array(pic, dtype=np.float32), 0) / 255
+    def tag_batch(self, pil_images, force_disable_ranks=False):
+        """Returns tags for each of pil_images, running all of them through the model at once; the model must be started."""
 
-        with torch.no_grad(), devices.autocast():
-            x = torch.from_numpy(a).to(devices.device, devices.dtype)
-            y = self.model(x)[0].detach().cpu().numpy()
+        return self.tag_arrays(np.stack([self.prepare_image(x) for x in pil_images]), force_disable_ranks=force_disable_ranks)
 
-        probability_dict = {}
+    def tag_many(self, items, load=None, batch_size=None):
+        """
+        Tags many images, yielding (item, tags) pairs in order as batches are done.
 
-        for tag, probability in zip(self.model.tags, y):
-            if probability < threshold:
-                continue
+        load(item) returns a PIL image for an item, and is called on background threads together with resizing, ahead of the model;
+        if it's None, items are PIL images. The model stays on GPU for the whole job. Items that fail to load are reported and skipped.
+        """
 
-            if tag.startswith("rating:"):
-                continue
+        batch_size = max(1, int(batch_size or shared.opts.deepbooru_batch_size))
 
-            probability_dict[tag] = probability
+        def prepare(item):
+            return self.prepare_image(item if load is None else load(item))
 
-        if alpha_sort:
-            tags = sorted(probability_dict)
-        else:
-            tags = [tag for tag, _ in sorted(probability_dict.items(), key=lambda x: -x[1])]
+        with self.resident():
+            self.start()
 
-        res = []
+            batch = []
+            for item, prepared in util.prefetch(items, prepare, batch_size * 2):
+                if shared.state.interrupted or shared.state.stopping_generation:
+                    break
 
-        filtertags = {x.strip().replace(' ', '_') for x in shared.opts.deepbooru_filter_tags.split(",")}
+                try:
+                    batch.append((item, prepared.result()))
+                except Exception as e:
+                    errors.display(e, f"reading image {item}")
+                    continue
 
-        for tag in [x for x in tags if x not in filtertags]:
-            probability = probability_dict[tag]
+                if len(batch) >= batch_size:
+                    yield from zip([x for x, _ in batch], self.tag_arrays(np.stack([a for _, a in batch])))
+                    batch = []
+
+            if batch:
+                yield from zip([x for x, _ in batch], self.tag_arrays(np.stack([a for _, a in batch])))
+
+    @staticmethod
+    def prepare_image(pil_image):
+        pic = images.resize_image(2, pil_image.convert("RGB"), 512, 512)
+        return np.array(pic, dtype=np.float32) / 255
+
+    def tag_table(self):
+        """Returns tags formatted according to settings, a mask of tags that can be included in results, and position of each tag in alphabetical order."""
+
+        key = (shared.opts.deepbooru_use_spaces, shared.opts.deepbooru_escape, shared.opts.deepbooru_filter_tags)
+        if self.tag_table_key == key:
+            return self.tag_table_val
+
+        use_spaces, use_escape, filter_tags = key
+        filtertags = {x.strip().replace(' ', '_') for x in filter_tags.split(",")}
+
+        formatted = []
+        for tag in self.model.tags:
             tag_outformat = tag
             if use_spaces:
                 tag_outformat = tag_outformat.replace('_', ' ')
             if use_escape:
                 tag_outformat = re.sub(re_special, r'\\\1', tag_outformat)
-            if include_ranks:
-                tag_outformat = f"({tag_outformat}:{probability:.3f})"
 
-            res.append(tag_outformat)
+            formatted.append(tag_outformat)
 
-        return ", ".join(res)
+        allowed = np.array([not tag.startswith("rating:") and tag not in filtertags for tag in self.model.tags])
+
+        alphabetical_rank = np.empty(len(self.model.tags), dtype=np.int64)
+        alphabetical_rank[np.argsort(np.array(self.model.tags), kind="stable")] = np.arange(len(self.model.tags))
+
+        self.tag_table_key = key
+        self.tag_table_val = formatted, allowed, alphabetical_rank
+        return self.tag_table_val
+
+    def tag_arrays(self, a, force_disable_ranks=False):
+        """Returns tags for a batch of prepared images; thresholding and sorting are done with numpy for all tags of an image at once."""
+
+        threshold = shared.opts.interrogate_deepbooru_score_threshold
+        alpha_sort = shared.opts.deepbooru_sort_alpha
+        include_ranks = shared.opts.interrogate_return_ranks and not force_disable_ranks
+
+        with torch.no_grad(), devices.autocast():
+            x = torch.from_numpy(a).to(devices.device, devices.dtype)
+            y = self.model(x).detach().float().cpu().numpy()
+
+        formatted, allowed, alphabetical_rank = self.tag_table()
+        selected = (y >= threshold) & allowed
+
+        res = []
+        for probabilities, mask in zip(y, selected):
+            indexes = np.flatnonzero(mask)
+            if alpha_sort:
+                indexes = indexes[np.argsort(alphabetical_rank[indexes])]
+            else:
+                indexes = indexes[np.argsort(-probabilities[indexes], kind="stable")]
+
+            if include_ranks:
+                res.append(", ".join(f"({formatted[i]}:{probabilities[i]:.3f})" for i in indexes))
+            else:
+                res.append(", ".join(formatted[i] for i in indexes))
+
+        return res
 
 
 model = DeepDanbooru()
@@ -239,6 +239,15 @@ class NansException(Exception):
     pass
 
 
+def is_out_of_memory_error(e):
+    """Returns True if the exception is raised because the device ran out of memory."""
+
+    if isinstance(e, getattr(torch.cuda, "OutOfMemoryError", ())):
+        return True
+
+    return isinstance(e, RuntimeError) and "out of memory" in str(e).lower()
+
+
 def test_for_nans(x, where):
     if shared.cmd_opts.disable_nan_check:
         return
@@ -9,6 +9,9 @@ from modules import errors
 extra_network_registry = {}
 extra_network_aliases = {}
 
+active_key = None
+"""text representation of extra networks from the last activate() call; changes whenever extra networks may change weights of the model"""
+
 
 def initialize():
     extra_network_registry.clear()
@@ -127,6 +130,9 @@ def activate(p, extra_network_data):
     """call activate for extra networks in extra_network_data in specified order, then call
     activate for all remaining registered networks with an empty argument list"""
 
+    global active_key
+    active_key = repr(sorted((name, [x.items for x in params]) for name, params in extra_network_data.items()))
+
     activated = []
 
     for extra_network, extra_network_args in lookup_extra_networks(extra_network_data).items():
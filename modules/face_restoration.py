@@ -1,3 +1,5 @@
+import warnings
+
 from modules import shared
 
 
@@ -8,12 +10,39 @@ class FaceRestoration:
     def restore(self, np_image):
         return np_image
 
+    def restore_batch(self, np_images):
+        return [self.restore(np_image) for np_image in np_images]
 
-def restore_faces(np_image):
+
+def setup_face_restorers():
+    from modules import codeformer_model, gfpgan_model
+
+    shared.face_restorers = []
+
+    warnings.filterwarnings(action="ignore", category=UserWarning, module="torchvision.transforms.functional_tensor")
+    codeformer_model.setup_model(shared.cmd_opts.codeformer_models_path)
+    gfpgan_model.setup_model(shared.cmd_opts.gfpgan_models_path)
+
+
+def get_face_restorer():
     face_restorers = [x for x in shared.face_restorers if x.name() == shared.opts.face_restoration_model or shared.opts.face_restoration_model is None]
     if len(face_restorers) == 0:
-        return np_image
+        return None
 
-    face_restorer = face_restorers[0]
+    return face_restorers[0]
+
+
+def restore_faces(np_image):
+    face_restorer = get_face_restorer()
+    if face_restorer is None:
+        return np_image
 
     return face_restorer.restore(np_image)
+
+
+def restore_faces_batch(np_images):
+    face_restorer = get_face_restorer()
+    if face_restorer is None:
+        return np_images
+
+    return face_restorer.restore_batch(np_images)
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import copy
 import logging
 import os
 from functools import cached_property
@@ -63,51 +64,84 @@ def restore_with_face_helper(
     """
     Find faces in the image using face_helper, restore them using restore_face, and paste them back into the image.
 
-    `restore_face` should take a cropped face image and return a restored face image.
+    `restore_face` should take a batch of cropped face images and return a batch of restored face images.
+    """
+    return restore_batch_with_face_helper([np_image], face_helper, restore_face)[0]
+
+
+def restore_batch_with_face_helper(
+    np_images: list[np.ndarray],
+    face_helper: FaceRestoreHelper,
+    restore_face: Callable[[torch.Tensor], torch.Tensor],
+) -> list[np.ndarray]:
+    """
+    Find faces in all images using face_helper, restore them using restore_face, and paste them back into their images.
+
+    Aligned crops of faces from all images are restored together, in batches of up to `face_restoration_batch_size` faces;
+    detection and pasting back are done for each image separately.
     """
     from torchvision.transforms.functional import normalize
-    np_image = np_image[:, :, ::-1]
-    original_resolution = np_image.shape[0:2]
 
+    helpers = []
     try:
-        logger.debug("Detecting faces...")
-        face_helper.clean_all()
-        face_helper.read_image(np_image)
-        face_helper.get_face_landmarks_5(only_center_face=False, resize=640, eye_dist_threshold=5)
-        face_helper.align_warp_face()
-        logger.debug("Found %d faces, restoring", len(face_helper.cropped_faces))
-        for cropped_face in face_helper.cropped_faces:
-            cropped_face_t = bgr_image_to_rgb_tensor(cropped_face / 255.0)
-            normalize(cropped_face_t, (0.5, 0.5, 0.5), (0.5, 0.5, 0.5), inplace=True)
-            cropped_face_t = cropped_face_t.unsqueeze(0).to(devices.device_codeformer)
+        logger.debug("Detecting faces in %d images...", len(np_images))
+        for np_image in np_images:
+            helper = copy.copy(face_helper)  # shares the detection and parsing models
+            helper.clean_all()
+            helpers.append(helper)
+            helper.read_image(np_image[:, :, ::-1])
+            helper.get_face_landmarks_5(only_center_face=False, resize=640, eye_dist_threshold=5)
+            helper.align_warp_face()
+
+        faces = [(helper, cropped_face) for helper in helpers for cropped_face in helper.cropped_faces]
+        logger.debug("Found %d faces, restoring", len(faces))
+
+        batch_size = max(1, shared.opts.face_restoration_batch_size)
+        for start in range(0, len(faces), batch_size):
+            batch = []
+            for _, cropped_face in faces[start:start + batch_size]:
+                cropped_face_t = bgr_image_to_rgb_tensor(cropped_face / 255.0)
+                normalize(cropped_face_t, (0.5, 0.5, 0.5), (0.5, 0.5, 0.5), inplace=True)
+                batch.append(cropped_face_t)
+
+            batch_t = torch.stack(batch).to(devices.device_codeformer)
 
             try:
                 with torch.no_grad():
-                    cropped_face_t = restore_face(cropped_face_t)
-                devices.torch_gc()
+                    batch_t = restore_face(batch_t)
             except Exception:
                 errors.report('Failed face-restoration inference', exc_info=True)
 
-            restored_face = rgb_tensor_to_bgr_image(cropped_face_t, min_max=(-1, 1))
-            restored_face = (restored_face * 255.0).astype('uint8')
-            face_helper.add_restored_face(restored_face)
-
-        logger.debug("Merging restored faces into image")
-        face_helper.get_inverse_affine(None)
-        img = face_helper.paste_faces_to_input_image()
-        img = img[:, :, ::-1]
-        if original_resolution != img.shape[0:2]:
-            img = cv2.resize(
-                img,
-                (0, 0),
-                fx=original_resolution[1] / img.shape[1],
-                fy=original_resolution[0] / img.shape[0],
-                interpolation=cv2.INTER_LINEAR,
-            )
+            for (helper, _), restored_face_t in zip(faces[start:start + batch_size], batch_t):
+                restored_face = rgb_tensor_to_bgr_image(restored_face_t, min_max=(-1, 1))
+                restored_face = (restored_face * 255.0).astype('uint8')
+                helper.add_restored_face(restored_face)
+
+            del batch_t
+            devices.torch_gc()
+
+        logger.debug("Merging restored faces into images")
+        res = []
+        for np_image, helper in zip(np_images, helpers):
+            original_resolution = np_image.shape[0:2]
+            helper.get_inverse_affine(None)
+            img = helper.paste_faces_to_input_image()
+            img = img[:, :, ::-1]
+            if original_resolution != img.shape[0:2]:
+                img = cv2.resize(
+                    img,
+                    (0, 0),
+                    fx=original_resolution[1] / img.shape[1],
+                    fy=original_resolution[0] / img.shape[0],
+                    interpolation=cv2.INTER_LINEAR,
+                )
+            res.append(img)
         logger.debug("Face restoration complete")
     finally:
+        for helper in helpers:
+            helper.clean_all()
         face_helper.clean_all()
-    return img
+    return res
 
 
 class CommonFaceRestoration(face_restoration.FaceRestoration):
@@ -145,16 +179,23 @@ class CommonFaceRestoration(face_restoration.FaceRestoration):
         np_image: np.ndarray,
         restore_face: Callable[[torch.Tensor], torch.Tensor],
     ) -> np.ndarray:
+        return self.restore_batch_with_helper([np_image], restore_face)[0]
+
+    def restore_batch_with_helper(
+        self,
+        np_images: list[np.ndarray],
+        restore_face: Callable[[torch.Tensor], torch.Tensor],
+    ) -> list[np.ndarray]:
         try:
             if self.net is None:
                 self.net = self.load_net()
         except Exception:
             logger.warning("Unable to load face-restoration model", exc_info=True)
-            return np_image
+            return np_images
 
         try:
             self.send_model_to(self.get_device())
-            return restore_with_face_helper(np_image, self.face_helper, restore_face)
+            return restore_batch_with_face_helper(np_images, self.face_helper, restore_face)
         finally:
             if shared.opts.face_restoration_unload:
                 self.send_model_to(devices.cpu)
@@ -44,11 +44,14 @@ class FaceRestorerGFPGAN(face_restoration_utils.CommonFaceRestoration):
         raise ValueError("No GFPGAN model found")
 
     def restore(self, np_image):
+        return self.restore_batch([np_image])[0]
+
+    def restore_batch(self, np_images):
         def restore_face(cropped_face_t):
             assert self.net is not None
             return self.net(cropped_face_t, return_rgb=False)[0]
 
-        return self.restore_with_helper(np_image, restore_face)
+        return self.restore_batch_with_helper(np_images, restore_face)
 
 
 def gfpgan_fix_faces(np_image):
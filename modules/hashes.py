@@ -1,28 +1,51 @@
 import hashlib
+import itertools
 import os.path
+import queue
+import threading
 
-from modules import shared
+from modules import shared, errors
 import modules.cache
 
 dump_cache = modules.cache.dump_cache
 cache = modules.cache.cache
 
+hash_block_size = 16 * 1024 * 1024
+
+
+def hash_file_contents(file, offset=0, progress=None):
+    """Returns sha256 of an opened binary file's contents starting at offset; hashlib releases GIL for large blocks,
+    so several of these can run in parallel threads."""
 
-def calculate_sha256(filename):
     hash_sha256 = hashlib.sha256()
-    blksize = 1024 * 1024
+    buffer = bytearray(hash_block_size)
+    view = memoryview(buffer)
+
+    file.seek(offset)
+    while True:
+        n = file.readinto(buffer)
+        if not n:
+            break
 
-    with open(filename, "rb") as f:
-        for chunk in iter(lambda: f.read(blksize), b""):
-            hash_sha256.update(chunk)
+        hash_sha256.update(view[:n])
+
+        if progress is not None:
+            progress(n)
 
     return hash_sha256.hexdigest()
 
 
-def sha256_from_cache(filename, title, use_addnet_hash=False):
+def calculate_sha256(filename, progress=None):
+    with open(filename, "rb", buffering=0) as f:
+        return hash_file_contents(f, progress=progress)
+
+
+def sha256_from_cache(filename, title, use_addnet_hash=False, mtime=None):
+    """Returns cached sha256 of the file, or None if it's not in cache or the file was modified; mtime can be passed if caller already knows it."""
+
     hashes = cache("hashes-addnet") if use_addnet_hash else cache("hashes")
     try:
-        ondisk_mtime = os.path.getmtime(filename)
+        ondisk_mtime = os.path.getmtime(filename) if mtime is None else mtime
     except FileNotFoundError:
         return None
 
@@ -38,9 +61,27 @@ def sha256_from_cache(filename, title, use_addnet_hash=False):
     return cached_sha256
 
 
-def sha256(filename, title, use_addnet_hash=False):
+def calculate_and_store_sha256(filename, title, use_addnet_hash=False, progress=None):
     hashes = cache("hashes-addnet") if use_addnet_hash else cache("hashes")
 
+    mtime = os.path.getmtime(filename)
+    if use_addnet_hash:
+        with open(filename, "rb", buffering=0) as file:
+            sha256_value = addnet_hash_safetensors(file, progress=progress)
+    else:
+        sha256_value = calculate_sha256(filename, progress=progress)
+
+    hashes[title] = {
+        "mtime": mtime,
+        "sha256": sha256_value,
+    }
+
+    dump_cache()
+
+    return sha256_value
+
+
+def sha256(filename, title, use_addnet_hash=False):
     sha256_value = sha256_from_cache(filename, title, use_addnet_hash)
     if sha256_value is not None:
         return sha256_value
@@ -48,37 +89,221 @@ def sha256(filename, title, use_addnet_hash=False):
     if shared.cmd_opts.no_hashing:
         return None
 
+    # if a background thread is already reading this file, wait for it rather than reading the file a second time
+    sha256_value = background_hasher.wait(title, use_addnet_hash)
+    if sha256_value is not None:
+        return sha256_value
+
     print(f"Calculating sha256 for {filename}: ", end='')
-    if use_addnet_hash:
-        with open(filename, "rb") as file:
-            sha256_value = addnet_hash_safetensors(file)
-    else:
-        sha256_value = calculate_sha256(filename)
+    sha256_value = calculate_and_store_sha256(filename, title, use_addnet_hash)
     print(f"{sha256_value}")
 
-    hashes[title] = {
-        "mtime": os.path.getmtime(filename),
-        "sha256": sha256_value,
-    }
-
-    dump_cache()
+    background_hasher.discard(title, use_addnet_hash)
 
     return sha256_value
 
 
-def addnet_hash_safetensors(b):
+def addnet_hash_safetensors(b, progress=None):
     """kohya-ss hash for safetensors from https://github.com/kohya-ss/sd-scripts/blob/main/library/train_util.py"""
-    hash_sha256 = hashlib.sha256()
-    blksize = 1024 * 1024
 
     b.seek(0)
     header = b.read(8)
     n = int.from_bytes(header, "little")
 
     offset = n + 8
-    b.seek(offset)
-    for chunk in iter(lambda: b.read(blksize), b""):
-        hash_sha256.update(chunk)
+    return hash_file_contents(b, offset, progress=progress)
+
+
+def hashing_job_key(title, use_addnet_hash):
+    return f"{'addnet' if use_addnet_hash else 'sha256'}/{title}"
+
+
+class HashingJob:
+    def __init__(self, filename, title, use_addnet_hash, priority):
+        self.filename = filename
+        self.title = title
+        self.use_addnet_hash = use_addnet_hash
+        self.priority = priority
+        self.started = False
+        self.size = 0
+        self.bytes_done = 0
+        self.result = None
+        self.done = threading.Event()
+
+    @property
+    def key(self):
+        return hashing_job_key(self.title, self.use_addnet_hash)
+
+    def progress(self, n):
+        self.bytes_done += n
+
+
+class BackgroundHasher:
+    """
+    Calculates sha256 of model files on a bounded pool of background threads.
+
+    Files waiting to be hashed are stored in the 'hashes-pending' cache, so if the program is stopped, the queue is resumed on next start.
+    Jobs with lower priority value are processed first; a file that is needed right now is hashed by the caller in sha256(), which waits for
+    the background thread instead if it's already working on that file.
+    """
+
+    priority_load = 0
+    priority_listing = 10
+
+    def __init__(self):
+        self.queue = queue.PriorityQueue()
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.threads = []
+        self.completed = 0
+        self.failed = 0
+        self.bytes_hashed = 0
+
+    def max_threads(self):
+        if shared.cmd_opts.no_hashing:
+            return 0
+
+        return int(shared.opts.hashes_background_threads)
+
+    def pending_cache(self):
+        return cache("hashes-pending")
+
+    def enqueue(self, filename, title, use_addnet_hash=False, priority=None):
+        """Adds a file to the background hashing queue unless its hash is already known; if it's already queued, priority is raised if needed."""
+
+        if self.max_threads() <= 0:
+            return
+
+        if sha256_from_cache(filename, title, use_addnet_hash) is not None:
+            return
+
+        job = HashingJob(filename, title, use_addnet_hash, self.priority_listing if priority is None else priority)
+
+        with self.lock:
+            existing = self.jobs.get(job.key)
+            if existing is not None:
+                if existing.started or existing.priority <= job.priority:
+                    return
+
+                existing.priority = job.priority
+                job = existing
+            else:
+                self.jobs[job.key] = job
+                self.pending_cache()[job.key] = {"filename": filename, "title": title, "use_addnet_hash": use_addnet_hash}
+
+            self.queue.put((job.priority, next(self.counter), job.key))
+            self.start_threads()
+
+    def prioritize(self, filename, title, use_addnet_hash=False):
+        """Moves a file that is about to be loaded to the front of the queue, so that it's hashed while the loading is being prepared."""
+
+        self.enqueue(filename, title, use_addnet_hash, priority=self.priority_load)
+
+    def resume(self):
+        """Re-adds files that were queued but not hashed when the program was last stopped."""
+
+        if self.max_threads() <= 0:
+            return
+
+        pending = self.pending_cache()
+        for key in list(pending):
+            entry = pending.get(key)
+            if entry is None:
+                continue
+
+            if not os.path.isfile(entry["filename"]):
+                pending.pop(key, None)
+                continue
+
+            self.enqueue(entry["filename"], entry["title"], entry["use_addnet_hash"])
+
+    def wait(self, title, use_addnet_hash=False):
+        """If a background thread is hashing the file, waits for it to finish and returns the hash; otherwise returns None."""
+
+        with self.lock:
+            job = self.jobs.get(hashing_job_key(title, use_addnet_hash))
+
+        if job is None or not job.started:
+            return None
+
+        job.done.wait()
+        return job.result
+
+    def discard(self, title, use_addnet_hash=False):
+        """Removes a file from the queue after its hash has been calculated elsewhere."""
+
+        key = hashing_job_key(title, use_addnet_hash)
+
+        with self.lock:
+            job = self.jobs.get(key)
+            if job is not None and not job.started:
+                del self.jobs[key]
+
+        self.pending_cache().pop(key, None)
+
+    def start_threads(self):
+        self.threads = [x for x in self.threads if x.is_alive()]
+
+        for index in range(len(self.threads), self.max_threads()):
+            thread = threading.Thread(target=self.worker, args=(index, ), name=f"hashing-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def worker(self, index):
+        while index < self.max_threads():
+            try:
+                _, _, key = self.queue.get(timeout=5)
+            except queue.Empty:
+                continue
+
+            with self.lock:
+                job = self.jobs.get(key)
+                if job is None or job.started:
+                    continue
+
+                job.started = True
+
+            self.run_job(job)
+
+    def run_job(self, job):
+        try:
+            job.result = sha256_from_cache(job.filename, job.title, job.use_addnet_hash)
+            if job.result is None:
+                job.size = os.path.getsize(job.filename)
+                job.result = calculate_and_store_sha256(job.filename, job.title, job.use_addnet_hash, progress=job.progress)
+
+            with self.lock:
+                self.completed += 1
+                self.bytes_hashed += job.bytes_done
+        except FileNotFoundError:
+            with self.lock:
+                self.failed += 1
+        except Exception as e:
+            with self.lock:
+                self.failed += 1
+
+            errors.display(e, f"calculating sha256 for {job.filename}")
+        finally:
+            with self.lock:
+                self.jobs.pop(job.key, None)
+
+            self.pending_cache().pop(job.key, None)
+            job.done.set()
+
+    def progress(self):
+        with self.lock:
+            jobs = list(self.jobs.values())
+            completed, failed, bytes_hashed = self.completed, self.failed, self.bytes_hashed
+
+        return {
+            "threads": len([x for x in self.threads if x.is_alive()]),
+            "queued": len([x for x in jobs if not x.started]),
+            "in_progress": [{"filename": x.filename, "title": x.title, "size": x.size, "bytes_done": x.bytes_done} for x in jobs if x.started],
+            "completed": completed,
+            "failed": failed,
+            "bytes_hashed": bytes_hashed,
+        }
 
-    return hash_sha256.hexdigest()
 
+background_hasher = BackgroundHasher()
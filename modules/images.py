@@ -18,8 +18,9 @@ import pillow_avif # noqa: F401
 import string
 import json
 import hashlib
+import threading
 
-from modules import sd_samplers, shared, script_callbacks, errors
+from modules import sd_samplers, shared, script_callbacks, errors, images_writer
 from modules.paths_internal import roboto_ttf_file
 from modules.shared import opts
 
@@ -562,6 +563,56 @@ def get_next_sequence_number(path, basename):
     return result + 1
 
 
+class SequenceNumbers:
+    """
+    Hands out sequence numbers for saved images without listing the directory on every save.
+
+    The directory is listed with get_next_sequence_number once per directory and basename after program start; after that, numbers are
+    given out from memory. Each call to reserve() returns a number no other caller got, so several threads can save into the same directory.
+    Files added by other programs are noticed when save_image finds that a file with the reserved number already exists, and reports the
+    number it actually used with used(). Each directory and basename has its own lock, so listing one directory does not hold up saving
+    into others.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.locks = {}
+        self.next = {}
+
+    @staticmethod
+    def key(path, basename):
+        return os.path.normcase(os.path.abspath(path)), basename
+
+    def lock_for(self, key):
+        with self.lock:
+            return self.locks.setdefault(key, threading.Lock())
+
+    def reserve(self, path, basename):
+        key = self.key(path, basename)
+
+        with self.lock_for(key):
+            number = self.next.get(key)
+            if number is None:
+                number = get_next_sequence_number(path, basename)
+
+            self.next[key] = number + 1
+
+        return number
+
+    def used(self, path, basename, number):
+        key = self.key(path, basename)
+
+        with self.lock_for(key):
+            self.next[key] = max(self.next.get(key, 0), number + 1)
+
+    def clear(self):
+        with self.lock:
+            self.next.clear()
+
+
+sequence_numbers = SequenceNumbers()
+
+
 def save_image_with_geninfo(image, geninfo, filename, extension=None, existing_pnginfo=None, pnginfo_section_name='parameters'):
     """
     Saves image to filename, including geninfo as text information for generation info.
@@ -621,7 +672,7 @@ def save_image_with_geninfo(image, geninfo, filename, extension=None, existing_p
         image.save(filename, format=image_format, quality=opts.jpeg_quality)
 
 
-def save_image(image, path, basename, seed=None, prompt=None, extension='png', info=None, short_filename=False, no_prompt=False, grid=False, pnginfo_section_name='parameters', p=None, existing_info=None, forced_filename=None, suffix="", save_to_dirs=None):
+def save_image(image, path, basename, seed=None, prompt=None, extension='png', info=None, short_filename=False, no_prompt=False, grid=False, pnginfo_section_name='parameters', p=None, existing_info=None, forced_filename=None, suffix="", save_to_dirs=None, image_saves=None):
     """Save an image.
 
     Args:
@@ -647,6 +698,9 @@ def save_image(image, path, basename, seed=None, prompt=None, extension='png', i
             If specified, `basename` and filename pattern will be ignored.
         save_to_dirs (bool):
             If true, the image will be saved into a subdirectory of `path`.
+        image_saves (`list`):
+            If specified, the Future of the write is added to it, so that the caller can wait for the file to be written.
+            Defaults to `p.image_saves`.
 
     Returns: (fullfn, txt_fullfn)
         fullfn (`str`):
@@ -686,13 +740,20 @@ def save_image(image, path, basename, seed=None, prompt=None, extension='png', i
             file_decoration = f"-{file_decoration}"
 
         if add_number:
-            basecount = get_next_sequence_number(path, basename)
+            if opts.save_images_sequence_index:
+                basecount = sequence_numbers.reserve(path, basename)
+            else:
+                basecount = get_next_sequence_number(path, basename)
+
             fullfn = None
             for i in range(500):
                 fn = f"{basecount + i:05}" if basename == '' else f"{basename}-{basecount + i:04}"
                 fullfn = os.path.join(path, f"{fn}{file_decoration}.{extension}")
-                if not os.path.exists(fullfn):
+                if not os.path.exists(fullfn) and not images_writer.image_writer.is_reserved(fullfn):
                     break
+
+            if i > 0 and opts.save_images_sequence_index:
+                sequence_numbers.used(path, basename, basecount + i)
         else:
             fullfn = os.path.join(path, f"{file_decoration}.{extension}")
     else:
@@ -717,6 +778,10 @@ def save_image(image, path, basename, seed=None, prompt=None, extension='png', i
 
         save_image_with_geninfo(image_to_save, info, temp_file_path, extension, existing_pnginfo=params.pnginfo, pnginfo_section_name=pnginfo_section_name)
 
+        if opts.save_images_fsync:
+            with open(temp_file_path, "rb+") as file:
+                os.fsync(file.fileno())
+
         filename = filename_without_extension + extension
         if shared.opts.save_images_replace_action != "Replace":
             n = 0
@@ -731,38 +796,46 @@ def save_image(image, path, basename, seed=None, prompt=None, extension='png', i
         fullfn_without_extension = fullfn_without_extension[:max_name_len - max(4, len(extension))]
         params.filename = fullfn_without_extension + extension
         fullfn = params.filename
-    _atomically_save_image(image, fullfn_without_extension, extension)
-
-    image.already_saved_as = fullfn
-
-    oversize = image.width > opts.target_side_length or image.height > opts.target_side_length
-    if opts.export_for_4chan and (oversize or os.stat(fullfn).st_size > opts.img_downscale_threshold * 1024 * 1024):
-        ratio = image.width / image.height
-        resize_to = None
-        if oversize and ratio > 1:
-            resize_to = round(opts.target_side_length), round(image.height * opts.target_side_length / image.width)
-        elif oversize:
-            resize_to = round(image.width * opts.target_side_length / image.height), round(opts.target_side_length)
-
-        if resize_to is not None:
-            try:
-                # Resizing image with LANCZOS could throw an exception if e.g. image mode is I;16
-                image = image.resize(resize_to, LANCZOS)
-            except Exception:
-                image = image.resize(resize_to)
-        try:
-            _atomically_save_image(image, fullfn_without_extension, ".jpg")
-        except Exception as e:
-            errors.display(e, "saving image as downscaled JPG")
 
     if opts.save_txt and info is not None:
         txt_fullfn = f"{fullfn_without_extension}.txt"
-        with open(txt_fullfn, "w", encoding="utf8") as file:
-            file.write(f"{info}\n")
     else:
         txt_fullfn = None
 
-    script_callbacks.image_saved_callback(params)
+    def write():
+        _atomically_save_image(image, fullfn_without_extension, extension)
+
+        image.already_saved_as = fullfn
+
+        oversize = image.width > opts.target_side_length or image.height > opts.target_side_length
+        if opts.export_for_4chan and (oversize or os.stat(fullfn).st_size > opts.img_downscale_threshold * 1024 * 1024):
+            ratio = image.width / image.height
+            resize_to = None
+            if oversize and ratio > 1:
+                resize_to = round(opts.target_side_length), round(image.height * opts.target_side_length / image.width)
+            elif oversize:
+                resize_to = round(image.width * opts.target_side_length / image.height), round(opts.target_side_length)
+
+            downscaled = image
+            if resize_to is not None:
+                try:
+                    # Resizing image with LANCZOS could throw an exception if e.g. image mode is I;16
+                    downscaled = image.resize(resize_to, LANCZOS)
+                except Exception:
+                    downscaled = image.resize(resize_to)
+            try:
+                _atomically_save_image(downscaled, fullfn_without_extension, ".jpg")
+            except Exception as e:
+                errors.display(e, "saving image as downscaled JPG")
+
+        if txt_fullfn is not None:
+            with open(txt_fullfn, "w", encoding="utf8") as file:
+                file.write(f"{info}\n")
+
+    if image_saves is None:
+        image_saves = getattr(p, 'image_saves', None)
+
+    images_writer.image_writer.submit(write, fullfn, saves=image_saves, callback=lambda: script_callbacks.image_saved_callback(params))
 
     return fullfn, txt_fullfn
 
@@ -0,0 +1,167 @@
+import concurrent.futures
+import os
+import threading
+
+from modules import shared, errors
+
+
+class ImageWriter:
+    """
+    Encodes and writes images to disk on a bounded pool of background threads, so that generation can continue while images are being saved.
+
+    The writer takes ownership of images passed to it: callers must not modify them afterwards. Filenames of images that are queued but not
+    written yet are reserved, so that choosing a filename for the next image does not pick the same one. If the number of threads is set to 0
+    in settings, images are saved by the calling thread, same as before.
+
+    Every write returns a Future; errors of writes done in background are reported to console when they happen, and also kept in the Future
+    so that callers that need the file can wait for it and show the error.
+
+    A write can have a callback that is called after the file is written. In background, callbacks run on writer threads, but one at a
+    time and in the order the writes were submitted, so they see files appear in the same order as when saving on the calling thread.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor = None
+        self.threads = 0
+        self.slots = None
+        self.pending = {}
+        self.callbacks_condition = threading.Condition()
+        self.submitted_count = 0
+        self.callbacks_count = 0
+
+    def max_threads(self):
+        return int(shared.opts.save_images_async_threads)
+
+    def get_executor(self):
+        with self.lock:
+            threads = self.max_threads()
+            if self.executor is None or self.threads != threads:
+                if self.executor is not None:
+                    self.executor.shutdown(wait=False)
+
+                self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads, thread_name_prefix="image-writer")
+                self.threads = threads
+
+                # limit number of images held in memory waiting to be written; when the limit is reached, the caller waits
+                self.slots = threading.Semaphore(threads * 4)
+
+            return self.executor, self.slots
+
+    def run(self, func):
+        """Calls func() on the pool if it's enabled, or on the calling thread otherwise; returns a Future with the result."""
+
+        if self.max_threads() <= 0:
+            future = concurrent.futures.Future()
+            try:
+                future.set_result(func())
+            except Exception as e:
+                future.set_exception(e)
+
+            return future
+
+        executor, _ = self.get_executor()
+        return executor.submit(func)
+
+    @staticmethod
+    def key(filename):
+        return os.path.normcase(os.path.abspath(filename))
+
+    def is_reserved(self, filename):
+        with self.lock:
+            return self.key(filename) in self.pending
+
+    def submit(self, func, filename, saves=None, callback=None):
+        """
+        Calls func() to write the file, in background if enabled, and then callback() if it's given and the write succeeded; returns a Future
+        for the write, which is also added to saves list if it's given.
+        """
+
+        future = concurrent.futures.Future()
+        future.filename = filename
+
+        if self.max_threads() <= 0:
+            func()
+            if callback is not None:
+                callback()
+
+            future.set_result(None)
+        else:
+            self.submit_to_pool(func, filename, future, callback)
+
+        if saves is not None:
+            saves.append(future)
+
+        return future
+
+    def run_callback_in_order(self, number, callback):
+        """Waits until callbacks of all writes submitted before the write with this number are done, then calls callback if it's not None."""
+
+        with self.callbacks_condition:
+            while self.callbacks_count != number:
+                self.callbacks_condition.wait()
+
+            try:
+                if callback is not None:
+                    callback()
+            finally:
+                self.callbacks_count += 1
+                self.callbacks_condition.notify_all()
+
+    def submit_to_pool(self, func, filename, future, callback):
+        executor, slots = self.get_executor()
+        key = self.key(filename)
+
+        slots.acquire()
+
+        def task():
+            error = None
+            try:
+                func()
+            except Exception as e:
+                errors.display(e, f"saving image {filename}")
+                error = e
+
+            try:
+                self.run_callback_in_order(number, callback if error is None else None)
+            except Exception as e:
+                errors.display(e, f"running callbacks for {filename}")
+
+            with self.lock:
+                if self.pending.get(key) is future:
+                    del self.pending[key]
+
+            slots.release()
+
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+
+        # the pool starts tasks in the order they are submitted, so a task waiting for callbacks of earlier ones never waits for a task
+        # that has not started
+        with self.lock:
+            number = self.submitted_count
+
+            try:
+                executor.submit(task)
+            except Exception:
+                slots.release()
+                raise
+
+            self.pending[key] = future
+            self.submitted_count += 1
+
+    def wait(self, futures):
+        """Waits for all writes in the list to finish; returns a list of messages for writes that failed."""
+
+        res = []
+        for future in futures:
+            e = future.exception()
+            if e is not None:
+                res.append(f"Error saving {future.filename}: {type(e).__name__}: {e}")
+
+        return res
+
+
+image_writer = ImageWriter()
@@ -6,7 +6,7 @@ import numpy as np
 from PIL import Image, ImageOps, ImageFilter, ImageEnhance, UnidentifiedImageError
 import gradio as gr
 
-from modules import images
+from modules import images, util
 from modules.infotext_utils import create_override_settings_dict, parse_generation_parameters
 from modules.processing import Processed, StableDiffusionProcessingImg2Img, process_images
 from modules.shared import opts, state
@@ -17,6 +17,32 @@ from modules.ui import plaintext_to_html
 import modules.scripts
 
 
+def mask_index(inpaint_masks):
+    """Returns a dict that maps an image's filename without extension to the first mask whose name starts with it and a dot."""
+
+    res = {}
+    for mask in inpaint_masks:
+        name = os.path.basename(mask)
+        for pos, char in enumerate(name):
+            if char == '.':
+                res.setdefault(name[:pos], mask)
+
+    return res
+
+
+def read_png_info(img, image, png_info_dir, png_info_props):
+    try:
+        info_img = img
+        if png_info_dir:
+            info_img_path = os.path.join(png_info_dir, os.path.basename(image))
+            info_img = images.read(info_img_path)
+        geninfo, _ = images.read_info_from_image(info_img)
+        parsed_parameters = parse_generation_parameters(geninfo)
+        return {k: v for k, v in parsed_parameters.items() if k in (png_info_props or {})}
+    except Exception:
+        return {}
+
+
 def process_batch(p, input, output_dir, inpaint_mask_dir, args, to_scale=False, scale_by=1.0, use_png_info=False, png_info_props=None, png_info_dir=None):
     output_dir = output_dir.strip()
     processing.fix_seed(p)
@@ -27,6 +53,7 @@ def process_batch(p, input, output_dir, inpaint_mask_dir, args, to_scale=False,
         batch_images = [os.path.abspath(x.name) for x in input]
 
     is_inpaint_batch = False
+    masks_by_name = {}
     if inpaint_mask_dir:
         inpaint_masks = shared.listfiles(inpaint_mask_dir)
         is_inpaint_batch = bool(inpaint_masks)
@@ -34,6 +61,27 @@ def process_batch(p, input, output_dir, inpaint_mask_dir, args, to_scale=False,
         if is_inpaint_batch:
             print(f"\nInpaint batch is enabled. {len(inpaint_masks)} masks found.")
 
+        masks_by_name = mask_index(inpaint_masks)
+
+    def load(image):
+        """Reads an input image, its mask and PNG info; runs on background threads, so that sampling does not wait for the disk."""
+
+        img = images.read(image)
+        # Use the EXIF orientation of photos taken by smartphones.
+        img = ImageOps.exif_transpose(img)
+        img.load()
+
+        mask_image = None
+        if is_inpaint_batch:
+            # try to find corresponding mask for an image using simple filename matching
+            mask_image_path = inpaint_masks[0] if len(inpaint_masks) == 1 else masks_by_name.get(Path(image).stem)
+            if mask_image_path is not None:
+                mask_image = images.read(mask_image_path)
+
+        parsed_parameters = read_png_info(img, image, png_info_dir, png_info_props) if use_png_info else None
+
+        return img, mask_image, parsed_parameters
+
     print(f"Will process {len(batch_images)} images, creating {p.n_iter * p.batch_size} new images for each.")
 
     state.job_count = len(batch_images) * p.n_iter
@@ -49,8 +97,9 @@ def process_batch(p, input, output_dir, inpaint_mask_dir, args, to_scale=False,
     sd_model_checkpoint_override = get_closet_checkpoint_match(override_settings.get("sd_model_checkpoint", None))
     batch_results = None
     discard_further_results = False
-    for i, image in enumerate(batch_images):
+    for i, (image, loaded) in enumerate(util.prefetch(batch_images, load, int(opts.img2img_batch_prefetch_images))):
         state.job = f"{i+1} out of {len(batch_images)}"
+        state.textinfo = os.path.basename(image)
         if state.skipped:
             state.skipped = False
 
@@ -58,12 +107,10 @@ def process_batch(p, input, output_dir, inpaint_mask_dir, args, to_scale=False,
             break
 
         try:
-            img = images.read(image)
+            img, mask_image, parsed_parameters = loaded.result()
         except UnidentifiedImageError as e:
             print(e)
             continue
-        # Use the EXIF orientation of photos taken by smartphones.
-        img = ImageOps.exif_transpose(img)
 
         if to_scale:
             p.width = int(img.width * scale_by)
@@ -73,37 +120,13 @@ def process_batch(p, input, output_dir, inpaint_mask_dir, args, to_scale=False,
 
         image_path = Path(image)
         if is_inpaint_batch:
-            # try to find corresponding mask for an image using simple filename matching
-            if len(inpaint_masks) == 1:
-                mask_image_path = inpaint_masks[0]
-            else:
-                # try to find corresponding mask for an image using simple filename matching
-                mask_image_dir = Path(inpaint_mask_dir)
-                masks_found = list(mask_image_dir.glob(f"{image_path.stem}.*"))
-
-                if len(masks_found) == 0:
-                    print(f"Warning: mask is not found for {image_path} in {mask_image_dir}. Skipping it.")
-                    continue
+            if mask_image is None:
+                print(f"Warning: mask is not found for {image_path} in {inpaint_mask_dir}. Skipping it.")
+                continue
 
-                # it should contain only 1 matching mask
-                # otherwise user has many masks with the same name but different extensions
-                mask_image_path = masks_found[0]
-
-            mask_image = images.read(mask_image_path)
             p.image_mask = mask_image
 
         if use_png_info:
-            try:
-                info_img = img
-                if png_info_dir:
-                    info_img_path = os.path.join(png_info_dir, os.path.basename(image))
-                    info_img = images.read(info_img_path)
-                geninfo, _ = images.read_info_from_image(info_img)
-                parsed_parameters = parse_generation_parameters(geninfo)
-                parsed_parameters = {k: v for k, v in parsed_parameters.items() if k in (png_info_props or {})}
-            except Exception:
-                parsed_parameters = {}
-
             p.prompt = prompt + (" " + parsed_parameters["Prompt"] if "Prompt" in parsed_parameters else "")
             p.negative_prompt = negative_prompt + (" " + parsed_parameters["Negative prompt"] if "Negative prompt" in parsed_parameters else "")
             p.seed = int(parsed_parameters.get("Seed", seed))
@@ -241,6 +264,8 @@ def img2img(id_task: str, request: gr.Request, mode: int, prompt: str, negative_
             if processed is None:
                 processed = process_images(p)
 
+            processing.wait_for_image_saves(p, processed)
+
     shared.total_tqdm.clear()
 
     generation_info_js = processed.js()
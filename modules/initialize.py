@@ -36,7 +36,12 @@ def imports():
     shared_init.initialize()
     startup_timer.record("initialize shared")
 
-    from modules import processing, gradio_extensons, ui  # noqa: F401
+    from modules import processing, gradio_extensons  # noqa: F401
+
+    from modules.shared_cmd_options import cmd_opts
+    if not cmd_opts.nowebui:
+        from modules import ui  # noqa: F401
+
     startup_timer.record("other imports")
 
 
@@ -63,17 +68,18 @@ def initialize():
 
     from modules.shared_cmd_options import cmd_opts
 
-    from modules import codeformer_model
-    warnings.filterwarnings(action="ignore", category=UserWarning, module="torchvision.transforms.functional_tensor")
-    codeformer_model.setup_model(cmd_opts.codeformer_models_path)
-    startup_timer.record("setup codeformer")
-
-    from modules import gfpgan_model
-    gfpgan_model.setup_model(cmd_opts.gfpgan_models_path)
-    startup_timer.record("setup gfpgan")
+    # with --nowebui, face restorers are set up when they are used for the first time
+    if not cmd_opts.nowebui:
+        from modules import face_restoration
+        face_restoration.setup_face_restorers()
+        startup_timer.record("setup face restorers")
 
     initialize_rest(reload_script_modules=False)
 
+    from modules import timer
+    if timer.import_profiler is not None:
+        print(f"Slowest imports:\n{timer.import_profiler.report()}")
+
 
 def initialize_rest(*, reload_script_modules=False):
     """
@@ -103,6 +109,10 @@ def initialize_rest(*, reload_script_modules=False):
     sd_models.list_models()
     startup_timer.record("list SD models")
 
+    from modules import hashes
+    hashes.background_hasher.resume()
+    startup_timer.record("resume background hashing")
+
     from modules import localization
     localization.list_localizations(cmd_opts.localizations_dir)
     startup_timer.record("list localizations")
@@ -115,9 +125,12 @@ def initialize_rest(*, reload_script_modules=False):
             importlib.reload(module)
         startup_timer.record("reload script modules")
 
-    from modules import modelloader
-    modelloader.load_upscalers()
-    startup_timer.record("load upscalers")
+    if cmd_opts.nowebui:
+        shared.sd_upscalers = None  # loaded when used for the first time
+    else:
+        from modules import modelloader
+        modelloader.load_upscalers()
+        startup_timer.record("load upscalers")
 
     from modules import sd_vae
     sd_vae.refresh_vae_list()
@@ -161,7 +174,8 @@ def initialize_rest(*, reload_script_modules=False):
 
     from modules import ui_extra_networks
     ui_extra_networks.initialize()
-    ui_extra_networks.register_default_pages()
+    if not cmd_opts.nowebui:
+        ui_extra_networks.register_default_pages()
 
     from modules import extra_networks
     extra_networks.initialize()
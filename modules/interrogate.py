@@ -1,23 +1,31 @@
+import glob
+import hashlib
 import os
 import sys
+import threading
 from collections import namedtuple
 from pathlib import Path
 import re
 
+import numpy as np
 import torch
 import torch.hub
 
 from torchvision import transforms
 from torchvision.transforms.functional import InterpolationMode
 
-from modules import devices, paths, shared, lowvram, modelloader, errors, torch_utils
+from modules import devices, paths, shared, lowvram, modelloader, errors, torch_utils, cache
 
 blip_image_eval_size = 384
 clip_model_name = 'ViT-L/14'
 
-Category = namedtuple("Category", ["name", "topn", "items"])
+text_features_version = 1
+text_features_batch_size = 256
+
+Category = namedtuple("Category", ["name", "topn", "items", "filename"], defaults=[None])
 
 re_topn = re.compile(r"\.top(\d+)$")
+re_text_features_file = re.compile(r"-[0-9a-f]{16}\.npy")
 
 def category_types():
     return [f.stem for f in Path(shared.interrogator.content_dir).glob('*.txt')]
@@ -52,6 +60,8 @@ class InterrogateModels:
     def __init__(self, content_dir):
         self.loaded_categories = None
         self.skip_categories = []
+        self.text_features = None
+        self.lock = threading.Lock()
         self.content_dir = content_dir
         self.running_on_cpu = devices.device_interrogate == torch.device("cpu")
 
@@ -76,7 +86,7 @@ class InterrogateModels:
                 with open(filename, "r", encoding="utf8") as file:
                     lines = [x.strip() for x in file.readlines()]
 
-                self.loaded_categories.append(Category(name=filename.stem, topn=topn, items=lines))
+                self.loaded_categories.append(Category(name=filename.stem, topn=topn, items=lines, filename=str(filename)))
 
         return self.loaded_categories
 
@@ -138,6 +148,10 @@ class InterrogateModels:
             if self.clip_model is not None:
                 self.clip_model = self.clip_model.to(devices.cpu)
 
+            if self.text_features is not None:
+                items, counts, features = self.text_features
+                self.text_features = items, counts, features.to(devices.cpu)
+
     def send_blip_to_ram(self):
         if not shared.opts.interrogate_keep_models_in_memory:
             if self.blip_model is not None:
@@ -162,14 +176,105 @@ class InterrogateModels:
         text_features = self.clip_model.encode_text(text_tokens).type(self.dtype)
         text_features /= text_features.norm(dim=-1, keepdim=True)
 
-        similarity = torch.zeros((1, len(text_array))).to(devices.device_interrogate)
-        for i in range(image_features.shape[0]):
-            similarity += (100.0 * image_features[i].unsqueeze(0) @ text_features.T).softmax(dim=-1)
-        similarity /= image_features.shape[0]
+        similarity = (100.0 * image_features @ text_features.T).softmax(dim=-1).mean(dim=0, keepdim=True)
 
         top_probs, top_labels = similarity.cpu().topk(top_count, dim=-1)
         return [(text_array[top_labels[0][i].numpy()], (top_probs[0][i].numpy()*100)) for i in range(top_count)]
 
+    def encode_texts(self, texts):
+        """Returns normalized CLIP text features for texts as a float16 array, encoding them in batches."""
+
+        import clip
+
+        res = []
+        for i in range(0, len(texts), text_features_batch_size):
+            text_tokens = clip.tokenize(list(texts[i:i + text_features_batch_size]), truncate=True).to(devices.device_interrogate)
+            text_features = self.clip_model.encode_text(text_tokens).float()
+            text_features /= text_features.norm(dim=-1, keepdim=True)
+            res.append(text_features.cpu().numpy().astype(np.float16))
+
+        return np.concatenate(res)
+
+    def category_text_features(self, category, count):
+        """
+        Returns normalized CLIP text features for the first count items of the category.
+
+        Features are stored in a .npy file per CLIP model and version of the category file, and read back memory-mapped; only items that
+        have not been encoded before are run through the text encoder, so the vocabularies are encoded once rather than for every image.
+        """
+
+        if category.filename is None:
+            return self.encode_texts(category.items[:count])
+
+        stat = os.stat(category.filename)
+        key = hashlib.sha256(f"{text_features_version}:{clip_model_name}:{os.path.abspath(category.filename)}:{stat.st_size}:{stat.st_mtime}".encode()).hexdigest()[:16]
+        dirname = os.path.join(cache.cache_dir, "interrogate-features")
+        filename = os.path.join(dirname, f"{category.name}-{key}.npy")
+
+        stored = np.load(filename, mmap_mode="r") if os.path.exists(filename) else None
+        if stored is not None and len(stored) >= count:
+            return np.array(stored[:count])
+
+        done = 0 if stored is None else len(stored)
+        features = self.encode_texts(category.items[done:count])
+        if stored is not None:
+            features = np.concatenate([stored, features])
+        del stored
+
+        os.makedirs(dirname, exist_ok=True)
+        for old in Path(dirname).glob(f"{glob.escape(category.name)}-*.npy"):
+            if str(old) != filename and re_text_features_file.fullmatch(old.name[len(category.name):]):
+                old.unlink(missing_ok=True)
+
+        with open(f"{filename}.tmp", "wb") as file:
+            np.save(file, features)
+        os.replace(f"{filename}.tmp", filename)
+
+        return features
+
+    def rank_categories(self, image_features, categories):
+        """
+        Returns a list of (category, matches) pairs, where matches is a list of (item, score) tuples with best matching items of the category.
+
+        Text features of all categories are compared with image features in a single matmul; softmax and top-k are then done for each category.
+        Features of all categories are kept in memory as one tensor, so files with them are read only on first use.
+        """
+
+        limit = int(shared.opts.interrogate_clip_dict_limit)
+
+        spans = []
+        for cat in categories:
+            count = len(cat.items) if limit == 0 else min(limit, len(cat.items))
+            if count > 0:
+                spans.append((cat, count))
+
+        if not spans:
+            return []
+
+        items = [cat.items for cat, _ in spans]
+        counts = [count for _, count in spans]
+
+        # categories are only re-read when the list of skipped ones changes, so the lists of items identify the cached features
+        cached = self.text_features
+        if cached is None or cached[1] != counts or len(cached[0]) != len(items) or any(a is not b for a, b in zip(cached[0], items)):
+            features = torch.cat([torch.from_numpy(self.category_text_features(cat, count)) for cat, count in spans])
+            cached = self.text_features = items, counts, features
+
+        text_features = cached[2].to(devices.device_interrogate, dtype=image_features.dtype)
+        self.text_features = items, counts, text_features
+
+        logits = 100.0 * image_features @ text_features.T
+
+        res = []
+        start = 0
+        for cat, count in spans:
+            similarity = logits[:, start:start + count].float().softmax(dim=-1).mean(dim=0)
+            top_probs, top_labels = similarity.cpu().topk(min(cat.topn, count))
+            res.append((cat, [(cat.items[i], prob * 100) for prob, i in zip(top_probs.tolist(), top_labels.tolist())]))
+            start += count
+
+        return res
+
     def generate_caption(self, pil_image):
         gpu_image = transforms.Compose([
             transforms.Resize((blip_image_eval_size, blip_image_eval_size), interpolation=InterpolationMode.BICUBIC),
@@ -183,17 +288,28 @@ class InterrogateModels:
         return caption[0]
 
     def interrogate(self, pil_image):
+        with self.lock:
+            return self.interrogate_locked(pil_image)
+
+    def interrogate_locked(self, pil_image):
         res = ""
-        shared.state.begin(job="interrogate")
+
+        # on CPU, interrogation does not touch VRAM or the progress of the current job, so it can run next to generation
+        exclusive = not self.running_on_cpu
+        if exclusive:
+            shared.state.begin(job="interrogate")
+
         try:
-            lowvram.send_everything_to_cpu()
-            devices.torch_gc()
+            if exclusive:
+                lowvram.send_everything_to_cpu()
+                devices.torch_gc()
 
             self.load()
 
             caption = self.generate_caption(pil_image)
             self.send_blip_to_ram()
-            devices.torch_gc()
+            if exclusive:
+                devices.torch_gc()
 
             res = caption
 
@@ -204,8 +320,7 @@ class InterrogateModels:
 
                 image_features /= image_features.norm(dim=-1, keepdim=True)
 
-                for cat in self.categories():
-                    matches = self.rank(image_features, cat.items, top_count=cat.topn)
+                for _, matches in self.rank_categories(image_features, self.categories()):
                     for match, score in matches:
                         if shared.opts.interrogate_return_ranks:
                             res += f", ({match}:{score/100:.3f})"
@@ -216,7 +331,8 @@ class InterrogateModels:
             errors.report("Error interrogating", exc_info=True)
             res += "<error>"
 
-        self.unload()
-        shared.state.end()
+        if exclusive:
+            self.unload()
+            shared.state.end()
 
         return res
@@ -0,0 +1,184 @@
+import collections
+import itertools
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+
+re_task_kind = re.compile(r"task\((\w+)-")
+
+
+class Ticket:
+    def __init__(self, lane, priority, client, id_task, seq):
+        self.lane = lane
+        self.priority = priority
+        self.client = client
+        self.id_task = id_task
+        self.seq = seq
+        self.submitted = time.time()
+        self.started = None
+
+        m = re_task_kind.match(id_task or "")
+        self.kind = f"{lane.name}/{m.group(1) if m else 'other'}"
+
+
+class Lane:
+    """
+    A group of jobs that share a fixed number of slots; jobs in different lanes run independently of each other.
+
+    Can be used as a drop-in replacement for a lock: `with lane:` runs a job with default priority.
+    """
+
+    def __init__(self, scheduler, name, slots):
+        self.scheduler = scheduler
+        self.name = name
+        self.slots = slots
+        self.local = threading.local()
+
+    @contextmanager
+    def job(self, id_task=None, priority=0, client=None):
+        """Waits for a slot in the lane; jobs with higher priority go first, then jobs of clients that used the lane the least recently."""
+
+        ticket = self.scheduler.submit(self, priority, client, id_task)
+        self.scheduler.wait(ticket)
+        try:
+            yield ticket
+        finally:
+            self.scheduler.release(ticket)
+
+    def acquire(self, blocking=True):
+        ticket = self.scheduler.submit(self, 0, None, None)
+        if not self.scheduler.wait(ticket, blocking=blocking):
+            return False
+
+        self.local.__dict__.setdefault("tickets", []).append(ticket)
+        return True
+
+    def release(self):
+        self.scheduler.release(self.local.tickets.pop())
+
+    __enter__ = acquire
+
+    def __exit__(self, t, v, tb):
+        self.release()
+
+
+class JobScheduler:
+    """
+    Runs jobs from multiple threads in lanes, one lane per kind of resource the jobs need (GPU, CPU).
+
+    Within a lane, jobs are ordered by priority, then by how much time the client has already spent in the lane since the lane
+    was last idle (so one client submitting many jobs does not starve the others), then by submission order.
+    Durations of finished jobs are remembered per kind of job, and used to estimate when queued jobs will start.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.lanes = {}
+        self.waiting = []
+        self.running = []
+        self.counter = itertools.count()
+        self.usage = collections.defaultdict(float)
+        self.durations = {}
+
+    def add_lane(self, name, slots=1):
+        self.lanes[name] = Lane(self, name, slots)
+        return self.lanes[name]
+
+    def lane(self, name):
+        return self.lanes[name]
+
+    def submit(self, lane, priority, client, id_task):
+        with self.condition:
+            ticket = Ticket(lane, priority, client, id_task, next(self.counter))
+            self.waiting.append(ticket)
+            return ticket
+
+    def sort_key(self, ticket):
+        return -ticket.priority, self.usage[(ticket.lane.name, ticket.client)], ticket.seq
+
+    def queue(self, lane):
+        return sorted((x for x in self.waiting if x.lane is lane), key=self.sort_key)
+
+    def can_start(self, ticket):
+        lane = ticket.lane
+        if len([x for x in self.running if x.lane is lane]) >= lane.slots:
+            return False
+
+        return self.queue(lane)[0] is ticket
+
+    def wait(self, ticket, blocking=True):
+        with self.condition:
+            while not self.can_start(ticket):
+                if not blocking:
+                    self.waiting.remove(ticket)
+                    return False
+
+                self.condition.wait()
+
+            self.waiting.remove(ticket)
+            ticket.started = time.time()
+            self.running.append(ticket)
+
+            return True
+
+    def release(self, ticket):
+        with self.condition:
+            self.running.remove(ticket)
+
+            duration = time.time() - ticket.started
+            previous = self.durations.get(ticket.kind)
+            self.durations[ticket.kind] = duration if previous is None else previous * 0.7 + duration * 0.3
+
+            lane = ticket.lane
+            if any(x.lane is lane for x in self.waiting + self.running):
+                self.usage[(lane.name, ticket.client)] += duration
+            else:
+                for key in [x for x in self.usage if x[0] == lane.name]:
+                    del self.usage[key]
+
+            self.condition.notify_all()
+
+    def estimate(self, ticket):
+        """Expected duration of the job in seconds, or None if no job of this kind has finished yet."""
+
+        return self.durations.get(ticket.kind)
+
+    def pending(self):
+        """Returns queued jobs in the order they will run, as dicts with expected number of seconds until each starts (None if unknown)."""
+
+        now = time.time()
+        res = []
+
+        with self.condition:
+            for lane in self.lanes.values():
+                slots = [0.0] * lane.slots
+                known = True
+
+                for i, ticket in enumerate(x for x in self.running if x.lane is lane):
+                    estimate = self.estimate(ticket)
+                    known = known and estimate is not None
+                    slots[i % lane.slots] = max(0.0, (estimate or 0) - (now - ticket.started))
+
+                for position, ticket in enumerate(self.queue(lane)):
+                    slot = min(range(len(slots)), key=lambda x: slots[x])
+                    estimate = self.estimate(ticket)
+
+                    res.append({
+                        "id_task": ticket.id_task,
+                        "lane": lane.name,
+                        "priority": ticket.priority,
+                        "position": position,
+                        "eta": slots[slot] if known else None,
+                    })
+
+                    known = known and estimate is not None
+                    slots[slot] += estimate or 0
+
+        return res
+
+
+scheduler = JobScheduler()
+scheduler.add_lane("gpu", slots=1)
+scheduler.add_lane("cpu", slots=2)
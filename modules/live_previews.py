@@ -0,0 +1,227 @@
+import asyncio
+import io
+import threading
+import time
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from modules import shared, errors
+
+payload_approximations = {
+    "full": 0,
+    "approx-nn": 1,
+    "approx-cheap": 2,
+    "taesd": 3,
+}
+"""payloads with a decoded image and corresponding indexes for sd_samplers_common.approximation_indexes; "latent" payload sends raw latents instead"""
+
+
+class Subscriber:
+    """A websocket client watching live previews of one task. Only the most recent frame is kept; frames produced while the client is busy are dropped."""
+
+    def __init__(self, loop, id_task, payload, min_interval):
+        self.loop = loop
+        self.id_task = id_task
+        self.payload = payload
+        self.min_interval = min_interval
+        self.last_sent = 0
+        self.frame = None
+        self.finished = False
+        self.event = asyncio.Event()
+
+    def is_due(self, now):
+        return now - self.last_sent >= self.min_interval
+
+    def deliver(self, frame):
+        """Called from the broadcaster thread."""
+
+        self.last_sent = time.time()
+        self.loop.call_soon_threadsafe(self.set_frame, frame)
+
+    def set_frame(self, frame):
+        self.frame = frame
+        self.event.set()
+
+    def finish(self):
+        self.loop.call_soon_threadsafe(self.set_finished)
+
+    def set_finished(self):
+        self.finished = True
+        self.event.set()
+
+    async def next_frame(self):
+        """Returns next frame, or None when the task is finished."""
+
+        while self.frame is None and not self.finished:
+            await self.event.wait()
+            self.event.clear()
+
+        frame, self.frame = self.frame, None
+        return frame
+
+
+class PreviewBroadcaster:
+    """
+    Sends live previews of the current task to subscribed websocket clients.
+
+    Sampling only hands the latest latent over (a cheap copy, done only if someone is watching the task and is due for a frame);
+    decoding and encoding happen on a separate thread, once per step for every kind of payload that the subscribers want,
+    no matter how many clients receive it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.pending = None
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def subscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.append(subscriber)
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.worker, name="live-previews", daemon=True)
+                self.thread.start()
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def watchers(self, id_task):
+        with self.lock:
+            return [x for x in self.subscribers if x.id_task == id_task]
+
+    def on_latent(self, latent):
+        """Called by the sampler on every step with the current latent."""
+
+        if not self.subscribers:
+            return
+
+        from modules import progress
+
+        now = time.time()
+        if not any(x.is_due(now) for x in self.watchers(progress.current_task)):
+            return
+
+        with self.lock:
+            self.pending = (progress.current_task, shared.state.sampling_step, shared.state.sampling_steps, latent.detach().clone())
+
+        self.wakeup.set()
+
+    def on_task_finished(self, id_task):
+        for subscriber in self.watchers(id_task):
+            subscriber.finish()
+
+    def worker(self):
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+
+            with self.lock:
+                pending, self.pending = self.pending, None
+
+            if pending is None:
+                continue
+
+            id_task, step, steps, latent = pending
+            now = time.time()
+            frames = {}
+
+            for subscriber in self.watchers(id_task):
+                if not subscriber.is_due(now):
+                    continue
+
+                if subscriber.payload not in frames:
+                    try:
+                        frames[subscriber.payload] = self.create_frame(subscriber.payload, latent, step, steps)
+                    except Exception:
+                        # the VAE can be unavailable while switching models during generation; same as in State.do_set_current_image
+                        errors.record_exception()
+                        frames[subscriber.payload] = None
+
+                if frames[subscriber.payload] is not None:
+                    subscriber.deliver(frames[subscriber.payload])
+
+    def create_frame(self, payload, latent, step, steps):
+        """Returns a tuple of a metadata dict and binary data for one step of generation."""
+
+        meta = {"step": step, "steps": steps, "payload": payload}
+
+        if payload == "latent":
+            data = latent.float().cpu().numpy()
+            meta["shape"] = list(data.shape)
+            meta["dtype"] = "float32"
+            return meta, data.tobytes()
+
+        from modules import sd_samplers_common
+
+        approximation = payload_approximations[payload]
+        if shared.opts.show_progress_grid:
+            image = sd_samplers_common.samples_to_image_grid(latent, approximation)
+        else:
+            image = sd_samplers_common.sample_to_image(latent, approximation=approximation)
+
+        image_format = shared.opts.live_previews_image_format
+        if image_format == 'jpeg' and image.mode in ('RGBA', 'P'):
+            image = image.convert('RGB')
+
+        buffered = io.BytesIO()
+        image.save(buffered, format=image_format)
+
+        meta["format"] = image_format
+        return meta, buffered.getvalue()
+
+
+broadcaster = PreviewBroadcaster()
+
+
+async def progress_websocket(websocket: WebSocket):
+    """
+    Websocket endpoint for live previews. The client sends one JSON message: {"id_task": ..., "payload": ..., "max_fps": ...}, where payload is
+    one of "taesd", "approx-cheap", "approx-nn", "full" or "latent" (default: method from settings). For every frame, the server sends a JSON
+    message with metadata followed by a binary message with an image in live previews format, or raw float32 latents for "latent" payload.
+    When the task is finished, the server sends {"completed": true} and closes the connection.
+    """
+
+    await websocket.accept()
+
+    try:
+        req = await websocket.receive_json()
+        from modules import sd_samplers_common
+
+        default_payload = next((k for k, v in payload_approximations.items() if v == sd_samplers_common.approximation_indexes.get(shared.opts.show_progress_type, 0)), "full")
+        payload = req.get("payload") or default_payload
+        if payload != "latent" and payload not in payload_approximations:
+            await websocket.send_json({"error": f"unknown payload: {payload}"})
+            await websocket.close()
+            return
+
+        max_fps = float(req.get("max_fps") or 1000 / max(shared.opts.live_preview_refresh_period, 1))
+        subscriber = Subscriber(asyncio.get_running_loop(), req.get("id_task"), payload, 1 / max(max_fps, 0.01))
+    except WebSocketDisconnect:
+        return
+
+    from modules import progress
+    broadcaster.subscribe(subscriber)
+
+    try:
+        if subscriber.id_task in progress.finished_tasks:
+            subscriber.set_finished()
+
+        while True:
+            frame = await subscriber.next_frame()
+            if frame is None:
+                break
+
+            meta, data = frame
+            await websocket.send_json(meta)
+            await websocket.send_bytes(data)
+
+        await websocket.send_json({"completed": True})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        broadcaster.unsubscribe(subscriber)
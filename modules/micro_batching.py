@@ -0,0 +1,213 @@
+import copy
+import json
+import threading
+import time
+
+from modules import shared, processing, extra_networks, sd_hijack
+
+per_item_fields = {"prompt", "negative_prompt", "seed", "subseed", "force_task_id"}
+"""arguments that can differ between jobs in one batch; all others must be equal"""
+
+
+def prompt_key(prompt):
+    """
+    Parts of the prompt that must be equal for jobs in one batch: extra networks are activated once for the whole batch with
+    the tags of its first prompt, and hashes of used extra networks and embeddings are written into infotexts of every image.
+    """
+
+    _, extra_network_data = extra_networks.parse_prompt(prompt or "")
+    embeddings = [name for name in sd_hijack.model_hijack.embedding_db.word_embeddings if name in (prompt or "")]
+
+    return {
+        "extra_networks": {name: [params.items for params in params_list] for name, params_list in extra_network_data.items()},
+        "embeddings": sorted(embeddings),
+    }
+
+
+def batch_key(args, priority=0, client=None):
+    """
+    Returns a key such that jobs with equal keys can run as one batch, or None if the job can't be batched with others.
+
+    The batch waits in the queue as the job of its first request, so only jobs with the same priority from the same client are batched.
+    """
+
+    if args.get("batch_size", 1) != 1 or args.get("n_iter", 1) != 1:
+        return None
+
+    key = {k: v for k, v in args.items() if k not in per_item_fields}
+    key["prompt"] = prompt_key(args.get("prompt"))
+    key["negative_prompt"] = prompt_key(args.get("negative_prompt"))
+    key["priority"] = priority
+    key["client"] = client
+
+    try:
+        return json.dumps(key, sort_keys=True)
+    except TypeError:
+        return None
+
+
+class Job:
+    def __init__(self, task_id, args, image_ready_callback):
+        self.task_id = task_id
+        self.args = args
+        self.image_ready_callback = image_ready_callback
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def finish(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.done.set()
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+
+        return self.result
+
+
+class Group:
+    def __init__(self, key):
+        self.key = key
+        self.jobs = []
+
+
+class ImageDispatcher:
+    """Passes images of a batch, as they are ready, to the callbacks of jobs they belong to."""
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.index = 0
+
+    def __call__(self, image, infotext):
+        if self.index < len(self.jobs) and self.jobs[self.index].image_ready_callback is not None:
+            self.jobs[self.index].image_ready_callback(image, infotext)
+
+        self.index += 1
+
+
+def merge_args(jobs):
+    args = dict(jobs[0].args)
+    args["prompt"] = [job.args.get("prompt") or "" for job in jobs]
+    args["negative_prompt"] = [job.args.get("negative_prompt") or "" for job in jobs]
+    args["seed"] = [processing.get_fixed_seed(job.args.get("seed", -1)) for job in jobs]
+    args["subseed"] = [processing.get_fixed_seed(job.args.get("subseed", -1)) for job in jobs]
+    args["batch_size"] = len(jobs)
+
+    # each job on its own would not get a grid
+    args["do_not_save_grid"] = True
+
+    return args
+
+
+def split_processed(processed, count):
+    """Splits the result of a batch into results for each of count jobs, as if they were run one by one."""
+
+    res = []
+    for i in range(count):
+        item = copy.copy(processed)
+        item.images = processed.images[i:i + 1]
+        item.prompt = processed.all_prompts[i]
+        item.negative_prompt = processed.all_negative_prompts[i]
+        item.seed = processed.all_seeds[i]
+        item.subseed = processed.all_subseeds[i]
+        item.all_prompts = [processed.all_prompts[i]]
+        item.all_negative_prompts = [processed.all_negative_prompts[i]]
+        item.all_seeds = [processed.all_seeds[i]]
+        item.all_subseeds = [processed.all_subseeds[i]]
+        item.infotexts = processed.infotexts[i:i + 1]
+        item.info = item.infotexts[0] if item.infotexts else processed.info
+        item.batch_size = 1
+        item.index_of_first_image = 0
+        res.append(item)
+
+    return res
+
+
+class MicroBatcher:
+    """
+    Combines compatible generation jobs that are waiting for their turn into one batch, so that the GPU processes them together.
+
+    The first job with a given key becomes the leader of a group and waits for its turn in the queue, plus a short window; jobs with
+    the same key that arrive in the meantime join its group and wait for the leader. Once the leader's turn comes, the group is closed,
+    all its jobs run as a single batch with per-item prompts and seeds, and each job gets its own part of the result.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.groups = {}
+
+    @staticmethod
+    def max_size():
+        return int(shared.opts.api_micro_batch_size)
+
+    def enabled(self):
+        return self.max_size() > 1
+
+    def join(self, key, job):
+        """Adds the job to an open group with the key, or creates a new group; returns the group and whether the job is its leader."""
+
+        with self.lock:
+            group = self.groups.get(key)
+            if group is not None:
+                group.jobs.append(job)
+                if len(group.jobs) >= self.max_size():
+                    del self.groups[key]
+
+                return group, False
+
+            group = Group(key)
+            group.jobs.append(job)
+            self.groups[key] = group
+
+            return group, True
+
+    def close(self, group):
+        with self.lock:
+            if self.groups.get(group.key) is group:
+                del self.groups[group.key]
+
+            return list(group.jobs)
+
+    def run(self, key, task_id, args, image_ready_callback, queue, process):
+        """
+        Runs a job, possibly as a part of a batch, and returns its Processed.
+
+        queue() returns a context manager that waits for the leader's turn to use the GPU; process(args, image_ready_callback, task_ids)
+        does the generation and returns Processed.
+        """
+
+        job = Job(task_id, args, image_ready_callback)
+        group, is_leader = self.join(key, job)
+        if not is_leader:
+            return job.wait()
+
+        # whatever happens to the leader, jobs that joined its group must be finished, or their requests would wait forever
+        try:
+            window = shared.opts.api_micro_batch_window / 1000
+            if window > 0:
+                time.sleep(window)
+
+            with queue():
+                jobs = self.close(group)
+
+                if len(jobs) == 1:
+                    results = [process(args, image_ready_callback, [task_id])]
+                else:
+                    processed = process(merge_args(jobs), ImageDispatcher(jobs), [x.task_id for x in jobs])
+                    results = split_processed(processed, len(jobs))
+        except BaseException as e:
+            for x in self.close(group)[1:]:
+                x.finish(error=e)
+
+            raise
+
+        for x, result in zip(jobs[1:], results[1:]):
+            x.finish(result=result)
+
+        return results[0]
+
+
+batcher = MicroBatcher()
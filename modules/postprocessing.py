@@ -1,17 +1,71 @@
+import functools
 import os
 
 from PIL import Image
 
-from modules import shared, images, devices, scripts, scripts_postprocessing, ui_common, infotext_utils
+from modules import shared, images, devices, scripts, scripts_postprocessing, ui_common, infotext_utils, images_writer, errors, util
 from modules.shared import opts
 
 
+def load_image(image_placeholder):
+    """Reads and decodes an input image and its existing PNG info; runs on background threads."""
+
+    if isinstance(image_placeholder, str):
+        image_data = images.read(image_placeholder)
+    else:
+        image_data = image_placeholder
+
+    image_data = image_data if image_data.mode in ("RGBA", "RGB") else image_data.convert("RGB")
+    image_data.load()
+
+    parameters, existing_pnginfo = images.read_info_from_image(image_data)
+    if parameters:
+        existing_pnginfo["parameters"] = parameters
+
+    return image_data, existing_pnginfo
+
+
+def write_caption(caption_filename, generated_caption):
+    """Writes the caption file; errors are reported to console and raised again."""
+
+    try:
+        write_caption_file(caption_filename, generated_caption)
+    except Exception as e:
+        errors.display(e, f"writing caption {caption_filename}")
+        raise
+
+
+def write_caption_file(caption_filename, generated_caption):
+    existing_caption = ""
+    try:
+        with open(caption_filename, encoding="utf8") as file:
+            existing_caption = file.read().strip()
+    except FileNotFoundError:
+        pass
+
+    action = shared.opts.postprocessing_existing_caption_action
+    if action == 'Prepend' and existing_caption:
+        caption = f"{existing_caption} {generated_caption}"
+    elif action == 'Append' and existing_caption:
+        caption = f"{generated_caption} {existing_caption}"
+    elif action == 'Keep' and existing_caption:
+        caption = existing_caption
+    else:
+        caption = generated_caption
+
+    caption = caption.strip()
+    if caption:
+        with open(caption_filename, "w", encoding="utf8") as file:
+            file.write(caption)
+
+
 def run_postprocessing(extras_mode, image, image_folder, input_dir, output_dir, show_extras_results, *args, save_output: bool = True):
     devices.torch_gc()
 
     shared.state.begin(job="extras")
 
     outputs = []
+    image_saves = []
 
     def get_images(extras_mode, image, image_folder, input_dir):
         if extras_mode == 1:
@@ -20,7 +74,7 @@ def run_postprocessing(extras_mode, image, image_folder, input_dir, output_dir,
                     image = images.fix_image(img)
                     fn = ''
                 else:
-                    image = images.read(os.path.abspath(img.name))
+                    image = os.path.abspath(img.name)  # read later, on background threads
                     fn = os.path.splitext(img.orig_name)[0]
                 yield image, fn
         elif extras_mode == 2:
@@ -44,36 +98,16 @@ def run_postprocessing(extras_mode, image, image_folder, input_dir, output_dir,
     data_to_process = list(get_images(extras_mode, image, image_folder, input_dir))
     shared.state.job_count = len(data_to_process)
 
-    for image_placeholder, name in data_to_process:
-        image_data: Image.Image
-
-        shared.state.nextjob()
-        shared.state.textinfo = name
-        shared.state.skipped = False
-
-        if shared.state.interrupted or shared.state.stopping_generation:
-            break
-
-        if isinstance(image_placeholder, str):
-            try:
-                image_data = images.read(image_placeholder)
-            except Exception:
-                continue
-        else:
-            image_data = image_placeholder
+    from modules import deepbooru
 
-        image_data = image_data if image_data.mode in ("RGBA", "RGB") else image_data.convert("RGB")
+    tagging = []  # (image, callback) for images to be tagged by DeepBooru together, in one pass through the model
+    deferred = []  # saving of processed images that wait for their tags
 
-        parameters, existing_pnginfo = images.read_info_from_image(image_data)
-        if parameters:
-            existing_pnginfo["parameters"] = parameters
+    def tag_later(image, callback):
+        tagging.append((image, callback))
 
-        initial_pp = scripts_postprocessing.PostprocessedImage(image_data)
-
-        scripts.scripts_postproc.run(initial_pp, args)
-
-        if shared.state.skipped:
-            continue
+    def save(name, initial_pp, existing_pnginfo):
+        nonlocal infotext
 
         used_suffixes = {}
         for pp in [initial_pp, *initial_pp.extra_images]:
@@ -95,35 +129,73 @@ def run_postprocessing(extras_mode, image, image_folder, input_dir, output_dir,
             shared.state.assign_current_image(pp.image)
 
             if save_output:
-                fullfn, _ = images.save_image(pp.image, path=outpath, basename=basename, extension=opts.samples_format, info=infotext, short_filename=True, no_prompt=True, grid=False, pnginfo_section_name="extras", existing_info=existing_pnginfo, forced_filename=forced_filename, suffix=suffix)
+                fullfn, _ = images.save_image(pp.image, path=outpath, basename=basename, extension=opts.samples_format, info=infotext, short_filename=True, no_prompt=True, grid=False, pnginfo_section_name="extras", existing_info=existing_pnginfo, forced_filename=forced_filename, suffix=suffix, image_saves=image_saves)
 
                 if pp.caption:
                     caption_filename = os.path.splitext(fullfn)[0] + ".txt"
-                    existing_caption = ""
-                    try:
-                        with open(caption_filename, encoding="utf8") as file:
-                            existing_caption = file.read().strip()
-                    except FileNotFoundError:
-                        pass
-
-                    action = shared.opts.postprocessing_existing_caption_action
-                    if action == 'Prepend' and existing_caption:
-                        caption = f"{existing_caption} {pp.caption}"
-                    elif action == 'Append' and existing_caption:
-                        caption = f"{pp.caption} {existing_caption}"
-                    elif action == 'Keep' and existing_caption:
-                        caption = existing_caption
-                    else:
-                        caption = pp.caption
-
-                    caption = caption.strip()
-                    if caption:
-                        with open(caption_filename, "w", encoding="utf8") as file:
-                            file.write(caption)
+                    future = images_writer.image_writer.run(functools.partial(write_caption, caption_filename, pp.caption))
+                    future.filename = caption_filename
+                    image_saves.append(future)
 
             if extras_mode != 2 or show_extras_results:
                 outputs.append(pp.image)
 
+    def flush():
+        if tagging:
+            deepbooru.model.start()
+            tags = deepbooru.model.tag_batch([image for image, _ in tagging])
+            deepbooru.model.stop()
+
+            for (_, callback), x in zip(tagging, tags):
+                callback(x)
+
+        for func in deferred:
+            func()
+
+        tagging.clear()
+        deferred.clear()
+
+    # the tagger of the caption script stays on GPU for the whole batch instead of being moved there and back for every image
+    with deepbooru.model.resident():
+        # images are read and decoded ahead on background threads; saving is done by the image writer's threads
+        for (_, name), loaded in util.prefetch(data_to_process, lambda x: load_image(x[0]), int(opts.postprocessing_prefetch_images)):
+            image_data: Image.Image
+
+            shared.state.nextjob()
+            shared.state.textinfo = name
+            shared.state.skipped = False
+
+            if shared.state.interrupted or shared.state.stopping_generation:
+                break
+
+            try:
+                image_data, existing_pnginfo = loaded.result()
+            except Exception:
+                if extras_mode == 2:
+                    continue  # unreadable files in the input directory are skipped
+
+                raise
+
+            initial_pp = scripts_postprocessing.PostprocessedImage(image_data)
+            initial_pp.tag_later = tag_later
+
+            scripts.scripts_postproc.run(initial_pp, args)
+
+            if shared.state.skipped:
+                continue
+
+            deferred.append(functools.partial(save, name, initial_pp, existing_pnginfo))
+
+            if len(tagging) == 0 or len(tagging) >= int(opts.deepbooru_batch_size):
+                flush()
+
+        flush()
+
+    # files are written in background; the job is done once they exist
+    save_errors = images_writer.image_writer.wait(image_saves)
+    if save_errors:
+        infotext = "\n".join([infotext, *save_errors]).strip()
+
     devices.torch_gc()
     shared.state.end()
     return outputs, ui_common.plaintext_to_html(infotext), ''
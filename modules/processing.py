@@ -16,7 +16,7 @@ from skimage import exposure
 from typing import Any
 
 import modules.sd_hijack
-from modules import devices, prompt_parser, masking, sd_samplers, lowvram, infotext_utils, extra_networks, sd_vae_approx, scripts, sd_samplers_common, sd_unet, errors, rng, profiling
+from modules import devices, prompt_parser, masking, sd_samplers, lowvram, infotext_utils, extra_networks, sd_vae_approx, scripts, sd_samplers_common, sd_unet, errors, rng, profiling, sd_hijack_optimizations, conds_cache, images_writer
 from modules.rng import slerp # noqa: F401
 from modules.sd_hijack import model_hijack
 from modules.sd_samplers_common import images_tensor_to_samples, decode_first_stage, approximation_indexes
@@ -225,11 +225,17 @@ class StableDiffusionProcessing:
 
     is_api: bool = field(default=False, init=False)
 
+    image_saves: list = field(default=None, init=False)
+    image_save_errors: list = field(default=None, init=False)
+    image_ready_callback: callable = field(default=None, init=False)
+
     def __post_init__(self):
         if self.sampler_index is not None:
             print("sampler_index argument for StableDiffusionProcessing does not do anything; use sampler_name", file=sys.stderr)
 
         self.comments = {}
+        self.image_saves = []
+        self.image_save_errors = []
 
         if self.styles is None:
             self.styles = []
@@ -484,8 +490,14 @@ class StableDiffusionProcessing:
 
         cache = caches[0]
 
-        with devices.autocast():
-            cache[1] = function(shared.sd_model, required_prompts, steps, hires_steps, shared.opts.use_old_scheduling)
+        shared_cache_key = conds_cache.conds_cache.key(function, required_prompts, cached_params)
+        cache[1] = conds_cache.conds_cache.get(shared_cache_key)
+
+        if cache[1] is None:
+            with devices.autocast():
+                cache[1] = function(shared.sd_model, required_prompts, steps, hires_steps, shared.opts.use_old_scheduling)
+
+            conds_cache.conds_cache.put(shared_cache_key, cache[1])
 
         cache[0] = cached_params
         return cache[1]
@@ -566,6 +578,7 @@ class Processed:
         self.all_seeds = all_seeds or p.all_seeds or [self.seed]
         self.all_subseeds = all_subseeds or p.all_subseeds or [self.subseed]
         self.infotexts = infotexts or [info] * len(images_list)
+        self.image_save_errors = list(p.image_save_errors or [])
         self.version = program_version()
 
     def js(self):
@@ -622,19 +635,54 @@ class DecodedSamples(list):
     already_decoded = True
 
 
+vae_decode_bytes_per_pixel = 128 * 12
+"""rough estimate of how much memory full VAE decoder needs per output pixel for each byte of its dtype; used to plan batch size for decoding"""
+
+
+def plan_vae_decode_batch_size(batch):
+    """Returns how many latents from batch to decode in a single VAE call."""
+
+    if shared.opts.sd_vae_decode_batch_size > 0:
+        return max(1, min(batch.shape[0], shared.opts.sd_vae_decode_batch_size))
+
+    pixels = batch.shape[2] * opt_f * batch.shape[3] * opt_f
+    bytes_per_image = pixels * vae_decode_bytes_per_pixel * torch.empty((), dtype=devices.dtype_vae).element_size()
+    available = sd_hijack_optimizations.get_available_vram() * 0.8
+
+    return max(1, min(batch.shape[0], int(available // bytes_per_image)))
+
+
 def decode_latent_batch(model, batch, target_device=None, check_for_nans=False):
+    """Decodes latents with VAE, running it on as many latents at once as fits in free memory; if that runs out of memory,
+    the batch size is halved and decoding is retried."""
+
     samples = DecodedSamples()
 
     if check_for_nans:
         devices.test_for_nans(batch, "unet")
 
-    for i in range(batch.shape[0]):
-        sample = decode_first_stage(model, batch[i:i + 1])[0]
+    batch_size = plan_vae_decode_batch_size(batch)
+
+    i = 0
+    while i < batch.shape[0]:
+        try:
+            decoded = decode_first_stage(model, batch[i:i + batch_size])
+        except Exception as e:
+            if batch_size == 1 or not devices.is_out_of_memory_error(e):
+                raise
+
+            decoded = None
+
+        if decoded is None:
+            devices.torch_gc()
+            batch_size = batch_size // 2
+            continue
 
         if check_for_nans:
 
             try:
-                devices.test_for_nans(sample, "vae")
+                for sample in decoded:
+                    devices.test_for_nans(sample, "vae")
             except devices.NansException as e:
                 if shared.opts.auto_vae_precision_bfloat16:
                     autofix_dtype = torch.bfloat16
@@ -662,12 +710,17 @@ def decode_latent_batch(model, batch, target_device=None, check_for_nans=False):
                 model.first_stage_model.to(devices.dtype_vae)
                 batch = batch.to(devices.dtype_vae)
 
-                sample = decode_first_stage(model, batch[i:i + 1])[0]
+                # the new dtype may need more memory per image
+                batch_size = min(batch_size, plan_vae_decode_batch_size(batch[i:]))
+                decoded = decode_first_stage(model, batch[i:i + batch_size])
+
+        for sample in decoded:
+            if target_device is not None:
+                sample = sample.to(target_device)
 
-        if target_device is not None:
-            sample = sample.to(target_device)
+            samples.append(sample)
 
-        samples.append(sample)
+        i += decoded.shape[0]
 
     return samples
 
@@ -816,6 +869,21 @@ def create_infotext(p, all_prompts, all_seeds, all_subseeds, comments=None, iter
     return f"{prompt_text}{negative_prompt_text}\n{generation_params_text}".strip()
 
 
+def wait_for_image_saves(p: StableDiffusionProcessing, processed: Processed):
+    """Waits for images saved with p after process_images returned, such as grids saved by scripts; errors are added to processed."""
+
+    if not p.image_saves:
+        return
+
+    save_errors = images_writer.image_writer.wait(p.image_saves)
+    p.image_saves.clear()
+
+    p.image_save_errors += save_errors
+    if processed is not None:
+        processed.image_save_errors += save_errors
+        processed.comments += "".join(f"{text}\n" for text in save_errors)
+
+
 def process_images(p: StableDiffusionProcessing) -> Processed:
     if p.scripts is not None:
         p.scripts.before_process(p)
@@ -1028,20 +1096,22 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
 
             save_samples = p.save_samples()
 
-            for i, x_sample in enumerate(x_samples_ddim):
-                p.batch_index = i
+            x_samples_np = [(255. * np.moveaxis(x_sample.cpu().numpy(), 0, 2)).astype(np.uint8) for x_sample in x_samples_ddim]
 
-                x_sample = 255. * np.moveaxis(x_sample.cpu().numpy(), 0, 2)
-                x_sample = x_sample.astype(np.uint8)
-
-                if p.restore_faces:
-                    if save_samples and opts.save_images_before_face_restoration:
+            if p.restore_faces:
+                if save_samples and opts.save_images_before_face_restoration:
+                    for i, x_sample in enumerate(x_samples_np):
+                        p.batch_index = i
                         images.save_image(Image.fromarray(x_sample), p.outpath_samples, "", p.seeds[i], p.prompts[i], opts.samples_format, info=infotext(i), p=p, suffix="-before-face-restoration")
 
-                    devices.torch_gc()
+                devices.torch_gc()
+
+                # faces from all images of the batch are restored together
+                x_samples_np = modules.face_restoration.restore_faces_batch(x_samples_np)
+                devices.torch_gc()
 
-                    x_sample = modules.face_restoration.restore_faces(x_sample)
-                    devices.torch_gc()
+            for i, x_sample in enumerate(x_samples_np):
+                p.batch_index = i
 
                 image = Image.fromarray(x_sample)
 
@@ -1090,6 +1160,9 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
                     image.info["parameters"] = text
                 output_images.append(image)
 
+                if p.image_ready_callback is not None:
+                    p.image_ready_callback(image, text)
+
                 if mask_for_overlay is not None:
                     if opts.return_mask or opts.save_mask:
                         image_mask = mask_for_overlay.convert('RGB')
@@ -1134,6 +1207,12 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
 
     devices.torch_gc()
 
+    # images are written in background while the next batch is generated; the files must exist before results are shown
+    p.image_save_errors += images_writer.image_writer.wait(p.image_saves)
+    p.image_saves.clear()
+    for text in p.image_save_errors:
+        p.comment(text)
+
     res = Processed(
         p,
         images_list=output_images,
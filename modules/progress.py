@@ -8,10 +8,11 @@ from pydantic import BaseModel, Field
 from modules.shared import opts
 
 import modules.shared as shared
+from modules import job_scheduler, live_previews
 from collections import OrderedDict
 import string
 import random
-from typing import List
+from typing import List, Optional
 
 current_task = None
 pending_tasks = OrderedDict()
@@ -37,6 +38,8 @@ def finish_task(id_task):
     if len(finished_tasks) > 16:
         finished_tasks.pop(0)
 
+    live_previews.broadcaster.on_task_finished(id_task)
+
 def create_task_id(task_type):
     N = 7
     res = ''.join(random.choices(string.ascii_uppercase +
@@ -52,9 +55,17 @@ def record_results(id_task, res):
 def add_task_to_queue(id_job):
     pending_tasks[id_job] = time.time()
 
+class PendingTask(BaseModel):
+    id_task: str = Field(title="Task ID")
+    lane: Optional[str] = Field(default=None, title="Lane", description="Which lane of job scheduler the task is queued in; empty if task has not reached the scheduler yet")
+    priority: int = Field(default=0, title="Priority")
+    position: Optional[int] = Field(default=None, title="Position in queue of the lane")
+    eta: Optional[float] = Field(default=None, title="Seconds until the task is expected to start")
+
 class PendingTasksResponse(BaseModel):
     size: int = Field(title="Pending task size")
     tasks: List[str] = Field(title="Pending task ids")
+    details: List[PendingTask] = Field(default=[], title="Pending tasks in order they will run, with time estimates")
 
 class ProgressRequest(BaseModel):
     id_task: str = Field(default=None, title="Task ID", description="id of the task to get progress for")
@@ -75,13 +86,24 @@ class ProgressResponse(BaseModel):
 
 def setup_progress_api(app):
     app.add_api_route("/internal/pending-tasks", get_pending_tasks, methods=["GET"])
+    app.add_api_websocket_route("/internal/progress-ws", live_previews.progress_websocket)
     return app.add_api_route("/internal/progress", progressapi, methods=["POST"], response_model=ProgressResponse)
 
 
+def pending_task_list():
+    details = [PendingTask(**x) for x in job_scheduler.scheduler.pending() if x["id_task"] in pending_tasks]
+
+    scheduled = {x.id_task for x in details}
+    for id_task in pending_tasks:
+        if id_task not in scheduled:
+            details.append(PendingTask(id_task=id_task))
+
+    return details
+
+
 def get_pending_tasks():
-    pending_tasks_ids = list(pending_tasks)
-    pending_len = len(pending_tasks_ids)
-    return PendingTasksResponse(size=pending_len, tasks=pending_tasks_ids)
+    details = pending_task_list()
+    return PendingTasksResponse(size=len(details), tasks=[x.id_task for x in details], details=details)
 
 
 def progressapi(req: ProgressRequest):
@@ -91,11 +113,16 @@ def progressapi(req: ProgressRequest):
 
     if not active:
         textinfo = "Waiting..."
+        eta = None
         if queued:
-            sorted_queued = sorted(pending_tasks.keys(), key=lambda x: pending_tasks[x])
-            queue_index = sorted_queued.index(req.id_task)
-            textinfo = "In queue: {}/{}".format(queue_index + 1, len(sorted_queued))
-        return ProgressResponse(active=active, queued=queued, completed=completed, id_live_preview=-1, textinfo=textinfo)
+            queue = pending_task_list()
+            task = next((x for x in queue if x.id_task == req.id_task), None)
+            if task is not None:
+                # jobs in other lanes run independently, so the position is counted among jobs of the same lane
+                lane_queue = [x for x in queue if x.lane == task.lane]
+                textinfo = "In queue: {}/{}".format(lane_queue.index(task) + 1, len(lane_queue))
+                eta = task.eta
+        return ProgressResponse(active=active, queued=queued, completed=completed, id_live_preview=-1, textinfo=textinfo, eta=eta)
 
     progress = 0
 
@@ -277,6 +277,57 @@ class DictWithShape(dict):
         return self["crossattn"].shape
 
 
+def get_schedule_index(schedule: list[ScheduledPromptConditioning], current_step):
+    """returns index of the entry in schedule that is used at current_step, same as reconstruct_cond_batch picks it"""
+
+    for current, entry in enumerate(schedule):
+        if current_step <= entry.end_at_step:
+            return current
+
+    return 0
+
+
+class StepConds:
+    """
+    Result of reconstruct_multicond_batch and reconstruct_cond_batch for one step, shared by all steps where the same schedule entries are used.
+    Must not be modified; padded holds versions of tensor and uncond padded to the same length, made by the sampler.
+    """
+
+    def __init__(self, conds_list, tensor, uncond):
+        self.conds_list = conds_list
+        self.tensor = tensor
+        self.uncond = uncond
+        self.padded = {}
+
+
+class StepCondsTable:
+    """
+    Conds for sampling steps, reconstructed from schedules only once for every distinct combination of schedule entries;
+    since schedules change at few steps, for most steps getting conds is a dictionary lookup.
+    """
+
+    def __init__(self, cond: MulticondLearnedConditioning, uncond: list[list[ScheduledPromptConditioning]]):
+        self.cond = cond
+        self.uncond = uncond
+        self.schedules = [composable_prompt.schedules for composable_prompts in cond.batch for composable_prompt in composable_prompts] + list(uncond)
+        self.step_keys = {}
+        self.entries = {}
+
+    def get(self, current_step) -> StepConds:
+        key = self.step_keys.get(current_step)
+        if key is None:
+            key = tuple(get_schedule_index(schedule, current_step) for schedule in self.schedules)
+            self.step_keys[current_step] = key
+
+        entry = self.entries.get(key)
+        if entry is None:
+            conds_list, tensor = reconstruct_multicond_batch(self.cond, current_step)
+            entry = StepConds(conds_list, tensor, reconstruct_cond_batch(self.uncond, current_step))
+            self.entries[key] = entry
+
+        return entry
+
+
 def reconstruct_cond_batch(c: list[list[ScheduledPromptConditioning]], current_step):
     param = c[0][0].cond
     is_dict = isinstance(param, dict)
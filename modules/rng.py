@@ -1,3 +1,5 @@
+import os
+
 import torch
 
 from modules import devices, rng_philox, shared
@@ -112,6 +114,9 @@ class ImageRNG:
     def first(self):
         noise_shape = self.shape if self.seed_resize_from_h <= 0 or self.seed_resize_from_w <= 0 else (self.shape[0], int(self.seed_resize_from_h) // 8, int(self.seed_resize_from_w // 8))
 
+        if shared.opts.randn_source == "NV" and len(self.seeds) > 1:
+            return self.first_nv(noise_shape)
+
         xs = []
 
         for i, (seed, generator) in enumerate(zip(self.seeds, self.generators)):
@@ -150,6 +155,47 @@ class ImageRNG:
 
         return torch.stack(xs).to(shared.device)
 
+    def first_nv(self, noise_shape):
+        """Same as first(), for NV random number generator; generates noise for all seeds at once rather than seed by seed."""
+
+        seeds = [int(seed) for seed in self.seeds]
+
+        # worth spreading over threads only for big batches
+        threads = min(os.cpu_count() or 1, 8) if len(seeds) * self.shape[0] * self.shape[1] * self.shape[2] >= 2 ** 20 else 1
+
+        noise = torch.asarray(rng_philox.randn_batch(seeds, noise_shape, threads=threads), device=devices.device)
+
+        if self.subseeds is not None and self.subseed_strength != 0:
+            subseeds = [0 if i >= len(self.subseeds) else int(self.subseeds[i]) for i in range(len(seeds))]
+            subnoise = torch.asarray(rng_philox.randn_batch(subseeds, noise_shape, threads=threads), device=devices.device)
+            noise = torch.stack([slerp(self.subseed_strength, noise[i], subnoise[i]) for i in range(len(seeds))])
+
+        if noise_shape != self.shape:
+            x = torch.asarray(rng_philox.randn_batch(seeds, self.shape, threads=threads), device=devices.device)
+            dx = (self.shape[2] - noise_shape[2]) // 2
+            dy = (self.shape[1] - noise_shape[1]) // 2
+            w = noise_shape[2] if dx >= 0 else noise_shape[2] + 2 * dx
+            h = noise_shape[1] if dy >= 0 else noise_shape[1] + 2 * dy
+            tx = 0 if dx < 0 else dx
+            ty = 0 if dy < 0 else dy
+            dx = max(-dx, 0)
+            dy = max(-dy, 0)
+
+            x[:, :, ty:ty + h, tx:tx + w] = noise[:, :, dy:dy + h, dx:dx + w]
+            noise = x
+
+        for generator in self.generators:
+            generator.offset += 1
+
+        # leave the global generator in the same state as generating seed by seed does
+        manual_seed(seeds[-1])
+
+        eta_noise_seed_delta = shared.opts.eta_noise_seed_delta or 0
+        if eta_noise_seed_delta:
+            self.generators = [create_generator(seed + eta_noise_seed_delta) for seed in self.seeds]
+
+        return noise.to(shared.device)
+
     def next(self):
         if self.is_first:
             self.is_first = False
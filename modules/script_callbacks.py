@@ -508,6 +508,8 @@ def on_image_saved(callback, *, name=None):
     """register a function to be called after an image is saved to a file.
     The callback is called with one argument:
         - params: ImageSaveParams - parameters the image was saved with. Changing fields in this object does nothing.
+    If saving images in background is enabled in settings, the callback is called from a writer thread rather than the thread that saved
+    the image; calls are still made one at a time, in the order the images were saved, after each file is written.
     """
     add_callback(callback_map['callbacks_image_saved'], callback, name=name, category='image_saved')
 
@@ -22,6 +22,10 @@ class PostprocessedImage:
         self.disable_processing = False
         self.caption = None
 
+        # if set, tag_later(image, callback) queues the image to be tagged by DeepBooru together with other images of the job,
+        # and calls callback(tags) before the image is saved
+        self.tag_later = None
+
     def get_suffix(self, used_suffixes=None):
         used_suffixes = {} if used_suffixes is None else used_suffixes
         suffix = "-".join(self.nametags)
@@ -47,6 +51,7 @@ class PostprocessedImage:
         pp.nametags = self.nametags.copy()
         pp.info = self.info.copy()
         pp.disable_processing = disable_processing
+        pp.tag_later = self.tag_later
 
         if nametags is not None:
             pp.nametags += nametags
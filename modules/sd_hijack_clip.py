@@ -3,9 +3,12 @@ from collections import namedtuple
 
 import torch
 
-from modules import prompt_parser, devices, sd_hijack, sd_emphasis
+from modules import prompt_parser, devices, sd_hijack, sd_emphasis, extra_networks
 from modules.shared import opts
 
+max_chunks_per_pass = 64
+"""maximum number of distinct prompt chunks sent through transformers at once"""
+
 
 class PromptChunk:
     """
@@ -43,6 +46,8 @@ class TextConditionalModel(torch.nn.Module):
         self.id_end = None
         self.id_pad = None
 
+        self.empty_chunk_encoded = None
+
     def empty_chunk(self):
         """creates an empty PromptChunk and returns it"""
 
@@ -211,20 +216,27 @@ class TextConditionalModel(torch.nn.Module):
 
         used_embeddings = {}
         chunk_count = max([len(x) for x in batch_chunks])
+        batch_chunks = [chunks + [self.empty_chunk()] * (chunk_count - len(chunks)) for chunks in batch_chunks]
+
+        for chunks in batch_chunks:
+            for chunk in chunks:
+                for _position, embedding in chunk.fixes:
+                    used_embeddings[embedding.name] = embedding
+
+        # all chunks of all texts are encoded together; emphasis is still applied to every chunk index separately, same as before,
+        # since it depends on all chunks it's given
+        encoded = self.encode_chunks([chunk for chunks in batch_chunks for chunk in chunks])
 
         zs = []
         for i in range(chunk_count):
-            batch_chunk = [chunks[i] if i < len(chunks) else self.empty_chunk() for chunks in batch_chunks]
+            batch_chunk = [chunks[i] for chunks in batch_chunks]
+            rows = [encoded[n * chunk_count + i] for n in range(len(batch_chunks))]
 
-            tokens = [x.tokens for x in batch_chunk]
-            multipliers = [x.multipliers for x in batch_chunk]
-            self.hijack.fixes = [x.fixes for x in batch_chunk]
+            z = torch.stack([row for row, _ in rows])
+            if rows[0][1] is not None:
+                z.pooled = torch.stack([pooled for _, pooled in rows])
 
-            for fixes in self.hijack.fixes:
-                for _position, embedding in fixes:
-                    used_embeddings[embedding.name] = embedding
-            devices.torch_npu_set_device()
-            z = self.process_tokens(tokens, multipliers)
+            z = self.apply_emphasis(z, [x.tokens for x in batch_chunk], [x.multipliers for x in batch_chunk])
             zs.append(z)
 
         if opts.textual_inversion_add_hashes_to_infotext and used_embeddings:
@@ -258,6 +270,14 @@ class TextConditionalModel(torch.nn.Module):
         Multipliers are used to give more or less weight to the outputs of transformers network. Each multiplier
         corresponds to one token.
         """
+
+        z = self.encode_tokens(remade_batch_tokens)
+
+        return self.apply_emphasis(z, remade_batch_tokens, batch_multipliers)
+
+    def encode_tokens(self, remade_batch_tokens):
+        """sends a batch of prompt chunks' tokens through transformers network; embedding fixes for the batch must be set in self.hijack.fixes"""
+
         tokens = torch.asarray(remade_batch_tokens).to(devices.device)
 
         # this is for SD2: SD1 uses the same token for padding and end of text, while SD2 uses different ones.
@@ -266,7 +286,51 @@ class TextConditionalModel(torch.nn.Module):
                 index = remade_batch_tokens[batch_pos].index(self.id_end)
                 tokens[batch_pos, index+1:tokens.shape[1]] = self.id_pad
 
-        z = self.encode_with_transformers(tokens)
+        return self.encode_with_transformers(tokens)
+
+    def empty_chunk_cache_key(self):
+        """encoded empty chunk is reused while this stays the same"""
+
+        from modules import shared
+
+        return getattr(shared.sd_model, 'sd_model_checkpoint', None), opts.CLIP_stop_at_last_layers, opts.sdxl_clip_l_skip, extra_networks.active_key, devices.dtype
+
+    def encode_chunks(self, chunks):
+        """
+        Sends chunks through transformers network; identical chunks are only encoded once, and all the rest are encoded together in as few
+        passes as possible. The encoded empty chunk is remembered between calls. Returns a list with a tuple of (z, pooled) for each chunk, where z
+        has shape (T, C), and pooled is None if the model does not produce pooled output.
+        """
+
+        keys = [(tuple(x.tokens), tuple((offset, id(embedding)) for offset, embedding in x.fixes)) for x in chunks]
+        distinct = dict(zip(keys, chunks))
+
+        empty_key = (tuple(self.empty_chunk().tokens), ())
+        cache_key = self.empty_chunk_cache_key()
+
+        results = {}
+        if empty_key in distinct and self.empty_chunk_encoded is not None and self.empty_chunk_encoded[0] == cache_key:
+            results[empty_key] = self.empty_chunk_encoded[1]
+
+        pending = [(key, chunk) for key, chunk in distinct.items() if key not in results]
+        for start in range(0, len(pending), max_chunks_per_pass):
+            part = pending[start:start + max_chunks_per_pass]
+
+            self.hijack.fixes = [chunk.fixes for _, chunk in part]
+            devices.torch_npu_set_device()
+            z = self.encode_tokens([chunk.tokens for _, chunk in part])
+            pooled = getattr(z, 'pooled', None)
+
+            for i, (key, _) in enumerate(part):
+                results[key] = (z[i], None if pooled is None else pooled[i])
+
+                if key == empty_key:
+                    self.empty_chunk_encoded = (cache_key, tuple(None if x is None else x.detach().clone() for x in results[key]))
+
+        return [results[key] for key in keys]
+
+    def apply_emphasis(self, z, remade_batch_tokens, batch_multipliers):
+        """applies multipliers to a batch of encoded prompt chunks according to emphasis mode from settings"""
 
         pooled = getattr(z, 'pooled', None)
 
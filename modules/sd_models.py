@@ -12,7 +12,7 @@ from omegaconf import OmegaConf, ListConfig
 from urllib import request
 import ldm.modules.midas as midas
 
-from modules import paths, shared, modelloader, devices, script_callbacks, sd_vae, sd_disable_initialization, errors, hashes, sd_models_config, sd_unet, sd_models_xl, cache, extra_networks, processing, lowvram, sd_hijack, patches
+from modules import paths, shared, modelloader, devices, script_callbacks, sd_vae, sd_disable_initialization, errors, hashes, sd_models_config, sd_unet, sd_models_xl, cache, extra_networks, processing, lowvram, sd_hijack, patches, sd_models_mmap, sd_models_scan
 from modules.timer import Timer
 from modules.shared import opts
 import tomesd
@@ -54,7 +54,9 @@ def replace_key(d, key, new_key, value):
 
 
 class CheckpointInfo:
-    def __init__(self, filename):
+    def __init__(self, filename, scan_entry=None):
+        """scan_entry is information about the file from sd_models_scan.scan(); if it's passed, the file is not read."""
+
         self.filename = filename
         abspath = os.path.abspath(filename)
         abs_ckpt_dir = os.path.abspath(shared.cmd_opts.ckpt_dir) if shared.cmd_opts.ckpt_dir is not None else None
@@ -78,7 +80,13 @@ class CheckpointInfo:
             return metadata
 
         self.metadata = {}
-        if self.is_safetensors:
+        self.scan_key = None
+        if scan_entry is not None:
+            self.metadata = scan_entry["metadata"]
+            self.scan_key = (scan_entry["size"], scan_entry["mtime"])
+            if scan_entry.get("modelspec_thumbnail") is not None:
+                self.modelspec_thumbnail = scan_entry["modelspec_thumbnail"]
+        elif self.is_safetensors:
             try:
                 self.metadata = cache.cached_data_for_file('safetensors-metadata', "checkpoint/" + name, filename, read_metadata)
             except Exception as e:
@@ -87,9 +95,9 @@ class CheckpointInfo:
         self.name = name
         self.name_for_extra = os.path.splitext(os.path.basename(filename))[0]
         self.model_name = os.path.splitext(name.replace("/", "_").replace("\\", "_"))[0]
-        self.hash = model_hash(filename)
+        self.hash = model_hash(filename) if scan_entry is None else scan_entry["hash"]
 
-        self.sha256 = hashes.sha256_from_cache(self.filename, f"checkpoint/{name}")
+        self.sha256 = hashes.sha256_from_cache(self.filename, f"checkpoint/{name}", mtime=self.scan_key[1] if self.scan_key else None)
         self.shorthash = self.sha256[0:10] if self.sha256 else None
 
         self.title = name if self.shorthash is None else f'{name} [{self.shorthash}]'
@@ -151,9 +159,6 @@ def checkpoint_tiles(use_short=False):
 
 
 def list_models():
-    checkpoints_list.clear()
-    checkpoint_aliases.clear()
-
     cmd_ckpt = shared.cmd_opts.ckpt
     if shared.cmd_opts.no_download_sd_model or cmd_ckpt != shared.sd_model_file or os.path.exists(cmd_ckpt):
         model_url = None
@@ -164,17 +169,59 @@ def list_models():
 
     model_list = modelloader.load_models(model_path=model_path, model_url=model_url, command_path=shared.cmd_opts.ckpt_dir, ext_filter=[".ckpt", ".safetensors"], download_name="v1-5-pruned-emaonly.safetensors", ext_blacklist=[".vae.ckpt", ".vae.safetensors"], hash_prefix=expected_sha256)
 
+    filenames = list(model_list)
     if os.path.exists(cmd_ckpt):
-        checkpoint_info = CheckpointInfo(cmd_ckpt)
-        checkpoint_info.register()
-
-        shared.opts.data['sd_model_checkpoint'] = checkpoint_info.title
+        filenames.insert(0, cmd_ckpt)
     elif cmd_ckpt is not None and cmd_ckpt != shared.default_sd_model_file:
         print(f"Checkpoint in --ckpt argument not found (Possible it was moved to {model_path}: {cmd_ckpt}", file=sys.stderr)
 
-    for filename in model_list:
-        checkpoint_info = CheckpointInfo(filename)
-        checkpoint_info.register()
+    scanned = sd_models_scan.scan(filenames)
+    existing = {info.filename: info for info in checkpoints_list.values()}
+
+    infos = []
+    for filename in filenames:
+        entry = scanned.get(filename)
+        checkpoint_info = existing.get(filename)
+        if checkpoint_info is None or entry is None or checkpoint_info.scan_key != (entry["size"], entry["mtime"]):
+            checkpoint_info = CheckpointInfo(filename, scan_entry=entry)
+            existing[filename] = checkpoint_info
+
+        infos.append(checkpoint_info)
+
+    update_checkpoints_list(infos)
+
+    if os.path.exists(cmd_ckpt):
+        shared.opts.data['sd_model_checkpoint'] = infos[0].title
+
+    for checkpoint_info in checkpoints_list.values():
+        if checkpoint_info.sha256 is None:
+            priority = hashes.background_hasher.priority_load if shared.opts.sd_model_checkpoint in checkpoint_info.ids else None
+            hashes.background_hasher.enqueue(checkpoint_info.filename, f"checkpoint/{checkpoint_info.name}", priority=priority)
+
+
+def update_checkpoints_list(infos):
+    """
+    Makes checkpoints_list and checkpoint_aliases contain only infos, in the same order, by removing and adding individual entries rather than
+    clearing them, so that lookups of checkpoints that are still present do not fail while the list is being refreshed.
+    """
+
+    keep = {id(info) for info in infos}
+
+    for title, info in list(checkpoints_list.items()):
+        if id(info) not in keep or info.title != title:
+            del checkpoints_list[title]
+
+    for alias, info in list(checkpoint_aliases.items()):
+        if id(info) not in keep:
+            del checkpoint_aliases[alias]
+
+    for info in infos:
+        info.register()
+
+    titles = list(dict.fromkeys(info.title for info in infos))
+    if list(checkpoints_list) != titles:
+        for title in titles:
+            checkpoints_list[title] = checkpoints_list.pop(title)
 
 
 re_strip_checksum = re.compile(r"\s*\[[^]]+]\s*$")
@@ -340,6 +387,13 @@ def get_checkpoint_state_dict(checkpoint_info: CheckpointInfo, timer):
         checkpoints_loaded.move_to_end(checkpoint_info)
         return checkpoints_loaded[checkpoint_info]
 
+    res = sd_models_mmap.read_state_dict(checkpoint_info.filename)
+    if res is not None:
+        print(f"Loading weights [{sd_model_hash}] from memory-mapped {checkpoint_info.filename}")
+        res = get_state_dict_from_checkpoint(res)
+        timer.record("map weights from disk")
+        return res
+
     print(f"Loading weights [{sd_model_hash}] from {checkpoint_info.filename}")
     res = read_state_dict(checkpoint_info.filename)
     timer.record("load weights from disk")
@@ -528,6 +582,18 @@ def load_model_weights(model, checkpoint_info: CheckpointInfo, state_dict, timer
     while len(checkpoints_loaded) > shared.opts.sd_checkpoint_cache:
         checkpoints_loaded.popitem(last=False)
 
+    model.tensor_fingerprints = None
+    if shared.opts.sd_checkpoint_delta_switch and checkpoint_info.is_safetensors:
+        try:
+            model.tensor_fingerprints = sd_models_scan.tensor_fingerprints(checkpoint_info.filename)
+            timer.record("read tensor fingerprints")
+        except Exception as e:
+            errors.display(e, f"reading tensors of {checkpoint_info.filename}")
+
+    set_model_checkpoint(model, checkpoint_info, sd_model_hash, timer)
+
+
+def set_model_checkpoint(model, checkpoint_info, sd_model_hash, timer):
     model.sd_model_hash = sd_model_hash
     model.sd_model_checkpoint = checkpoint_info.filename
     model.sd_checkpoint_info = checkpoint_info
@@ -543,6 +609,78 @@ def load_model_weights(model, checkpoint_info: CheckpointInfo, state_dict, timer
     timer.record("load VAE")
 
 
+def load_model_weights_delta(model, checkpoint_info: CheckpointInfo, timer):
+    """
+    Switches model to another checkpoint by reading only tensors that differ from ones already in the model, which is much faster than
+    loading everything for fine-tunes and merges that share the text encoder or VAE with the current checkpoint. Tensors are compared by
+    fingerprints from sd_models_scan.tensor_fingerprints. Returns False without loading anything if the model can't be switched this way,
+    in which case it should be loaded as usual.
+    """
+
+    current = getattr(model, 'tensor_fingerprints', None)
+    if not shared.opts.sd_checkpoint_delta_switch or current is None or not checkpoint_info.is_safetensors:
+        return False
+
+    # resident weights must be exactly what was read from the current checkpoint, and must not need any conversion after loading
+    if devices.fp8 or check_fp8(model) or shared.opts.sd_checkpoint_cache > 0 or model.is_sd2:
+        return False
+
+    if hasattr(model, "before_load_weights") or hasattr(model, "after_load_weights"):
+        return False
+
+    if sd_models_config.find_checkpoint_config_near_filename(checkpoint_info) != sd_models_config.find_checkpoint_config_near_filename(model.sd_checkpoint_info):
+        return False
+
+    if any(getattr(module, 'network_current_names', ()) for module in model.modules()):
+        return False
+
+    wanted = sd_models_scan.tensor_fingerprints(checkpoint_info.filename)
+    if {k: v[0:2] for k, v in wanted.items()} != {k: v[0:2] for k, v in current.items()}:
+        return False
+
+    changed = [k for k, v in wanted.items() if v != current[k]]
+
+    is_sd2_turbo = 'conditioner.embedders.0.model.ln_final.weight' in wanted and wanted['conditioner.embedders.0.model.ln_final.weight'][1][0] == 1024
+    replacements = checkpoint_dict_replacements_sd2_turbo if is_sd2_turbo else checkpoint_dict_replacements_sd1
+    keys = {k: transform_checkpoint_dict_key(k, replacements) for k in changed}
+
+    # the model keeps a modified copy of the noise schedule, so it can't be updated in place
+    if 'alphas_cumprod' in keys.values():
+        return False
+
+    if sd_vae.loaded_vae_file:
+        sd_vae.restore_base_vae(model)
+        if sd_vae.loaded_vae_file:
+            return False
+
+    timer.record("compare tensor fingerprints")
+
+    sd_model_hash = checkpoint_info.calculate_shorthash()
+    timer.record("calculate hash")
+
+    if not SkipWritingToConfig.skip:
+        shared.opts.data["sd_model_checkpoint"] = checkpoint_info.title
+
+    state_dict = {}
+    with safetensors.safe_open(checkpoint_info.filename, framework="pt", device="cpu") as file:
+        for key, model_key in keys.items():
+            state_dict[model_key] = file.get_tensor(key)
+
+    # also resets weights cached by extensions in all layers, same as loading the full state dict
+    model.load_state_dict(state_dict, strict=False)
+    del state_dict
+
+    loaded = sum(wanted[k][2] for k in changed)
+    skipped = sum(v[2] for v in wanted.values()) - loaded
+    timer.record("load changed weights")
+    print(f"Loaded {len(changed)} of {len(wanted)} tensors ({loaded / 2**20:.1f} MB); skipped {skipped / 2**20:.1f} MB identical to current checkpoint")
+
+    model.tensor_fingerprints = wanted
+    set_model_checkpoint(model, checkpoint_info, sd_model_hash, timer)
+
+    return True
+
+
 def enable_midas_autodownload():
     """
     Gives the ldm.modules.midas.api.load_model function automatic downloading.
@@ -790,6 +928,7 @@ def get_obj_from_str(string, reload=False):
 def load_model(checkpoint_info=None, already_loaded_state_dict=None, checkpoint_config=None):
     from modules import sd_hijack
     checkpoint_info = checkpoint_info or select_checkpoint()
+    hashes.background_hasher.prioritize(checkpoint_info.filename, f"checkpoint/{checkpoint_info.name}")
 
     timer = Timer()
 
@@ -944,6 +1083,7 @@ def reuse_model_from_already_loaded(sd_model, checkpoint_info, timer):
 
 def reload_model_weights(sd_model=None, info=None, forced_reload=False):
     checkpoint_info = info or select_checkpoint()
+    hashes.background_hasher.prioritize(checkpoint_info.filename, f"checkpoint/{checkpoint_info.name}")
 
     timer = Timer()
 
@@ -966,9 +1106,30 @@ def reload_model_weights(sd_model=None, info=None, forced_reload=False):
 
     if sd_model is not None:
         sd_unet.apply_unet("None")
-        send_model_to_cpu(sd_model)
         sd_hijack.model_hijack.undo_hijack(sd_model)
 
+        try:
+            switched = load_model_weights_delta(sd_model, checkpoint_info, timer)
+        except Exception as e:
+            errors.display(e, f"loading changed weights from {checkpoint_info.filename}")
+            switched = False
+
+        if switched:
+            sd_hijack.model_hijack.hijack(sd_model)
+            timer.record("hijack")
+
+            script_callbacks.model_loaded_callback(sd_model)
+            timer.record("script callbacks")
+
+            print(f"Weights loaded in {timer.summary()}.")
+
+            model_data.set_sd_model(sd_model)
+            sd_unet.apply_unet()
+
+            return sd_model
+
+        send_model_to_cpu(sd_model)
+
     state_dict = get_checkpoint_state_dict(checkpoint_info, timer)
 
     checkpoint_config = sd_models_config.find_checkpoint_config(state_dict, checkpoint_info)
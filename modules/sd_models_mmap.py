@@ -0,0 +1,165 @@
+import collections
+import json
+import mmap
+import os
+import threading
+
+import torch
+
+from modules import shared, errors
+
+safetensors_dtypes = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+if hasattr(torch, "float8_e4m3fn"):
+    safetensors_dtypes["F8_E4M3"] = torch.float8_e4m3fn
+    safetensors_dtypes["F8_E5M2"] = torch.float8_e5m2
+
+
+def read_safetensors_header(file):
+    """Reads the JSON header of an opened .safetensors file. Returns the header dict and the offset at which tensor data starts."""
+
+    file.seek(0)
+    header_len = int.from_bytes(file.read(8), "little")
+    header = json.loads(file.read(header_len))
+
+    return header, 8 + header_len
+
+
+class MappedCheckpoint:
+    """A .safetensors file mapped into memory; tensors are views over the mapping and do not own their storage."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.mtime = os.path.getmtime(filename)
+        self.tensors = {}
+
+        with open(filename, "rb") as file:
+            header, data_start = read_safetensors_header(file)
+
+            # ACCESS_COPY gives a private, writable mapping, so torch does not complain about read-only buffers; pages stay shared with
+            # the OS page cache unless something writes into them, which loading weights into a model never does
+            self.mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+
+        self.nbytes = len(self.mapping)
+
+        for key, info in header.items():
+            if key == "__metadata__":
+                continue
+
+            dtype = safetensors_dtypes[info["dtype"]]
+            begin, end = info["data_offsets"]
+            shape = info["shape"]
+
+            if end == begin:
+                self.tensors[key] = torch.empty(shape, dtype=dtype)
+                continue
+
+            count = (end - begin) // torch.empty((), dtype=dtype).element_size()
+            self.tensors[key] = torch.frombuffer(self.mapping, dtype=dtype, count=count, offset=data_start + begin).reshape(shape)
+
+    def is_stale(self):
+        try:
+            return os.path.getmtime(self.filename) != self.mtime
+        except OSError:
+            return True
+
+
+class MappedCheckpointCache:
+    """
+    Keeps recently used .safetensors checkpoints memory-mapped, bounded by total mapped size rather than by number of entries.
+
+    A state dict obtained from the cache holds no copy of the weights; switching back to a cached checkpoint costs page cache reads
+    when the weights are copied into the model, instead of a full deserialization.
+    """
+
+    def __init__(self):
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def size_limit(self):
+        return int(shared.opts.sd_checkpoint_cache_mmap_size * 1024 * 1024)
+
+    def enabled(self):
+        return self.size_limit > 0
+
+    def get_state_dict(self, filename):
+        """Returns a fresh dict of tensors backed by the memory-mapped file; the dict can be freely modified by the caller."""
+
+        with self.lock:
+            entry = self.entries.get(filename)
+            if entry is not None and entry.is_stale():
+                del self.entries[filename]
+                entry = None
+
+            if entry is not None:
+                self.hits += 1
+                self.entries.move_to_end(filename)
+            else:
+                self.misses += 1
+                entry = MappedCheckpoint(filename)
+                self.entries[filename] = entry
+                self.evict()
+
+            return dict(entry.tensors)
+
+    def evict(self):
+        """Drops least recently used mappings until the limit is satisfied; the most recent entry is always kept.
+        A mapping is closed by garbage collector once no tensors viewing it remain."""
+
+        while len(self.entries) > 1 and self.mapped_bytes() > self.size_limit:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def apply_size_limit(self):
+        with self.lock:
+            if self.enabled():
+                self.evict()
+            else:
+                self.entries.clear()
+
+    def mapped_bytes(self):
+        return sum(entry.nbytes for entry in self.entries.values())
+
+    def stats(self):
+        with self.lock:
+            return {
+                "enabled": self.enabled(),
+                "entries": len(self.entries),
+                "mapped_bytes": self.mapped_bytes(),
+                "size_limit": self.size_limit,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "files": list(self.entries.keys()),
+            }
+
+
+mapped_checkpoints = MappedCheckpointCache()
+
+
+def read_state_dict(filename):
+    """Reads a state dict from .safetensors file using the memory-mapped cache; returns None if the cache is disabled or can't be used."""
+
+    if not mapped_checkpoints.enabled() or os.path.splitext(filename)[1].lower() != ".safetensors":
+        return None
+
+    try:
+        return mapped_checkpoints.get_state_dict(filename)
+    except Exception as e:
+        errors.display(e, f"memory-mapping {filename}")
+        return None
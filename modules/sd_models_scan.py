@@ -0,0 +1,142 @@
+import concurrent.futures
+import hashlib
+import os
+
+from modules import cache, errors, shared
+
+scan_version = 1
+fingerprint_version = 2
+fingerprint_sample_size = 4096
+fingerprint_samples = 8
+fingerprint_full_size = 1024 * 1024
+
+
+def scan_cache():
+    return cache.cache("checkpoint-scan")
+
+
+def fingerprints_cache():
+    return cache.cache("checkpoint-tensors")
+
+
+def read_entry(filename, stat):
+    """Reads the old hash and safetensors metadata of a checkpoint; this is the only part of listing checkpoints that opens the files."""
+
+    from modules import sd_models
+
+    entry = {
+        "version": scan_version,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "hash": sd_models.model_hash(filename),
+        "metadata": {},
+        "modelspec_thumbnail": None,
+    }
+
+    if os.path.splitext(filename)[1].lower() == ".safetensors":
+        try:
+            metadata = sd_models.read_metadata_from_safetensors(filename)
+            entry["modelspec_thumbnail"] = metadata.pop('modelspec.thumbnail', None)
+            entry["metadata"] = metadata
+        except Exception as e:
+            errors.display(e, f"reading metadata for {filename}")
+
+    return entry
+
+
+def scan(filenames):
+    """
+    Returns a dict of filename -> entry with size, mtime, old hash and metadata for every checkpoint that exists.
+
+    Entries are stored on disk and reused while file's size and mtime stay the same, so listing an unchanged library only stats the files.
+    Files that are new or changed are read on a thread pool, since reading headers from network or spinning drives is mostly waiting.
+    The thumbnail is only returned for files that were read, and is not stored.
+    """
+
+    entries = scan_cache()
+    res = {}
+    missing = []
+
+    for filename in dict.fromkeys(filenames):
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            continue
+
+        entry = entries.get(filename)
+        if entry is None or entry.get("version") != scan_version or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+            missing.append((filename, stat))
+        else:
+            res[filename] = entry
+
+    if not missing:
+        return res
+
+    threads = max(1, min(int(shared.opts.sd_checkpoint_scan_threads), len(missing)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads, thread_name_prefix="checkpoint-scan") as executor:
+        futures = {executor.submit(read_entry, filename, stat): filename for filename, stat in missing}
+
+        for future in concurrent.futures.as_completed(futures):
+            filename = futures[future]
+            try:
+                entry = future.result()
+            except Exception as e:
+                errors.display(e, f"reading checkpoint {filename}")
+                continue
+
+            entries[filename] = {k: v for k, v in entry.items() if k != "modelspec_thumbnail"}
+            res[filename] = entry
+
+    return res
+
+
+def read_tensor_fingerprints(filename):
+    from modules import sd_models_mmap
+
+    res = {}
+    with open(filename, "rb") as file:
+        header, data_start = sd_models_mmap.read_safetensors_header(file)
+
+        for key, info in header.items():
+            if key == "__metadata__":
+                continue
+
+            begin, end = info["data_offsets"]
+            length = end - begin
+            sha = hashlib.sha256()
+
+            # merges and fine-tunes can change only some rows of embedding tables (e.g. added tokens), so those are always hashed in full
+            if length <= fingerprint_full_size or "embedding" in key:
+                file.seek(data_start + begin)
+                sha.update(file.read(length))
+            else:
+                step = (length - fingerprint_sample_size) // (fingerprint_samples - 1)
+                for i in range(fingerprint_samples):
+                    file.seek(data_start + begin + i * step)
+                    sha.update(file.read(fingerprint_sample_size))
+
+            res[key] = (info["dtype"], tuple(info["shape"]), length, sha.hexdigest())
+
+    return res
+
+
+def tensor_fingerprints(filename):
+    """
+    Returns a dict of tensor name -> (dtype, shape, number of bytes, hash) for a .safetensors file.
+
+    The hash covers the whole tensor if it's small or an embedding table, or several evenly spaced samples from it otherwise; fine-tuning
+    and merging change practically every value in other tensors, so two tensors with the same samples are treated as identical. Stored
+    on disk, keyed by file's size and mtime; calculated the first time a checkpoint is loaded or switched to, not when listing checkpoints.
+    """
+
+    stat = os.stat(filename)
+    entries = fingerprints_cache()
+
+    entry = entries.get(filename)
+    if entry is not None and entry["version"] == fingerprint_version and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+        return entry["tensors"]
+
+    tensors = read_tensor_fingerprints(filename)
+    entries[filename] = {"version": fingerprint_version, "size": stat.st_size, "mtime": stat.st_mtime, "tensors": tensors}
+
+    return tensors
@@ -1,5 +1,5 @@
 import torch
-from modules import prompt_parser, sd_samplers_common
+from modules import prompt_parser, sd_samplers_common, script_callbacks
 
 from modules.shared import opts, state
 import modules.shared as shared
@@ -22,6 +22,15 @@ def subscript_cond(cond, a, b):
     return {key: vec[a:b] for key, vec in cond.items()}
 
 
+def copy_cond(cond, clone=False):
+    """Returns a copy of cond that can be padded without changing the original; with clone=True, tensors are copied too."""
+
+    if not isinstance(cond, dict):
+        return cond.clone() if clone else cond
+
+    return prompt_parser.DictWithShape({key: vec.clone() if clone else vec for key, vec in cond.items()})
+
+
 def pad_cond(tensor, repeats, empty):
     if not isinstance(tensor, dict):
         return torch.cat([tensor, empty.repeat((tensor.shape[0], repeats, 1))], axis=1)
@@ -63,6 +72,8 @@ class CFGDenoiser(torch.nn.Module):
         self.need_last_noise_uncond = False
         self.last_noise_uncond = None
 
+        self.conds_table = None
+
         # NOTE: masking before denoising can cause the original latents to be oversmoothed
         # as the original latents do not have noise
         self.mask_before_denoising = False
@@ -110,6 +121,30 @@ class CFGDenoiser(torch.nn.Module):
 
         return cond, uncond
 
+    def pad_conds(self, tensor, uncond):
+        """pads cond and uncond to the same length according to settings; sets padded_cond_uncond and padded_cond_uncond_v0 flags"""
+
+        self.padded_cond_uncond = False
+        self.padded_cond_uncond_v0 = False
+        if shared.opts.pad_cond_uncond_v0 and tensor.shape[1] != uncond.shape[1]:
+            tensor, uncond = self.pad_cond_uncond_v0(tensor, uncond)
+        elif shared.opts.pad_cond_uncond and tensor.shape[1] != uncond.shape[1]:
+            tensor, uncond = self.pad_cond_uncond(tensor, uncond)
+
+        return tensor, uncond
+
+    def pad_step_conds(self, step_conds):
+        """same as pad_conds for conds from StepCondsTable, but padding is done only once for all steps that share the conds"""
+
+        key = (shared.opts.pad_cond_uncond_v0, shared.opts.pad_cond_uncond)
+        padded = step_conds.padded.get(key)
+        if padded is None:
+            tensor, uncond = self.pad_conds(copy_cond(step_conds.tensor), copy_cond(step_conds.uncond))
+            padded = step_conds.padded[key] = (tensor, uncond, self.padded_cond_uncond, self.padded_cond_uncond_v0)
+
+        tensor, uncond, self.padded_cond_uncond, self.padded_cond_uncond_v0 = padded
+        return tensor, uncond
+
     def pad_cond_uncond_v0(self, cond, uncond):
         """
         Pads the 'uncond' tensor to match the shape of the 'cond' tensor.
@@ -165,8 +200,14 @@ class CFGDenoiser(torch.nn.Module):
         # so is_edit_model is set to False to support AND composition.
         is_edit_model = shared.sd_model.cond_stage_key == "edit" and self.image_cfg_scale is not None and self.image_cfg_scale != 1.0
 
-        conds_list, tensor = prompt_parser.reconstruct_multicond_batch(cond, self.step)
-        uncond = prompt_parser.reconstruct_cond_batch(uncond, self.step)
+        # conds for the step are made once for every segment of prompt schedules and reused; callbacks get copies in case they modify them
+        if self.conds_table is None or self.conds_table.cond is not cond or self.conds_table.uncond is not uncond:
+            self.conds_table = prompt_parser.StepCondsTable(cond, uncond)
+
+        step_conds = self.conds_table.get(self.step)
+        conds_list, tensor, uncond = step_conds.conds_list, step_conds.tensor, step_conds.uncond
+        if script_callbacks.callback_map['callbacks_cfg_denoiser']:
+            tensor, uncond = copy_cond(tensor, clone=True), copy_cond(uncond, clone=True)
 
         assert not is_edit_model or all(len(conds) == 1 for conds in conds_list), "AND is not supported for InstructPix2Pix checkpoint (unless using Image CFG scale = 1.0)"
 
@@ -230,12 +271,11 @@ class CFGDenoiser(torch.nn.Module):
             x_in = x_in[:-batch_size]
             sigma_in = sigma_in[:-batch_size]
 
-        self.padded_cond_uncond = False
-        self.padded_cond_uncond_v0 = False
-        if shared.opts.pad_cond_uncond_v0 and tensor.shape[1] != uncond.shape[1]:
-            tensor, uncond = self.pad_cond_uncond_v0(tensor, uncond)
-        elif shared.opts.pad_cond_uncond and tensor.shape[1] != uncond.shape[1]:
-            tensor, uncond = self.pad_cond_uncond(tensor, uncond)
+        # conds straight from the table are padded once per table entry; ones replaced or copied for callbacks are padded every step
+        if tensor is step_conds.tensor and uncond is step_conds.uncond:
+            tensor, uncond = self.pad_step_conds(step_conds)
+        else:
+            tensor, uncond = self.pad_conds(tensor, uncond)
 
         if tensor.shape[1] == uncond.shape[1] or skip_uncond:
             if is_edit_model:
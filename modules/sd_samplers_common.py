@@ -3,7 +3,7 @@ from collections import namedtuple
 import numpy as np
 import torch
 from PIL import Image
-from modules import devices, images, sd_vae_approx, sd_samplers, sd_vae_taesd, shared, sd_models
+from modules import devices, images, sd_vae_approx, sd_samplers, sd_vae_taesd, shared, sd_models, live_previews
 from modules.shared import opts, state
 import k_diffusion.sampling
 
@@ -114,6 +114,7 @@ def images_tensor_to_samples(image, approximation=None, model=None):
 
 def store_latent(decoded):
     state.current_latent = decoded
+    live_previews.broadcaster.on_latent(decoded)
 
     if opts.live_previews_enable and opts.show_progress_every_n_steps > 0 and shared.state.sampling_step % opts.show_progress_every_n_steps == 0:
         if not shared.parallel_processing_allowed:
@@ -48,9 +48,6 @@ def initialize():
     from modules import styles
     shared.prompt_styles = styles.StyleDatabase(shared.styles_filename)
 
-    from modules import interrogate
-    shared.interrogator = interrogate.InterrogateModels("interrogate")
-
     from modules import shared_total_tqdm
     shared.total_tqdm = shared_total_tqdm.TotalTQDM()
 
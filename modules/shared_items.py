@@ -1,5 +1,6 @@
 import html
 import sys
+import threading
 
 from modules import script_callbacks, scripts, ui_components
 from modules.options import OptionHTML, OptionInfo
@@ -16,6 +17,11 @@ def dat_models_names():
     return [x.name for x in modules.dat_model.get_dat_models(None)]
 
 
+def interrogate_category_types():
+    import modules.interrogate
+    return modules.interrogate.category_types()
+
+
 def postprocessing_scripts(filter_out_extra_only=False, filter_out_main_ui_only=False):
     import modules.scripts
     return list(filter(
@@ -162,13 +168,22 @@ def callbacks_order_settings():
     return options
 
 
+lazy_fields_lock = threading.RLock()
+
+
 class Shared(sys.modules[__name__].__class__):
     """
     this class is here to provide sd_model field as a property, so that it can be created and loaded on demand rather than
     at program startup.
+
+    Same goes for upscalers, face restorers and the interrogator: with --nowebui, modules implementing them are not imported
+    until they are used for the first time.
     """
 
     sd_model_val = None
+    sd_upscalers_val = None
+    face_restorers_val = None
+    interrogator_val = None
 
     @property
     def sd_model(self):
@@ -182,5 +197,47 @@ class Shared(sys.modules[__name__].__class__):
 
         modules.sd_models.model_data.set_sd_model(value)
 
+    @property
+    def sd_upscalers(self):
+        if self.sd_upscalers_val is None:
+            with lazy_fields_lock:
+                if self.sd_upscalers_val is None:
+                    import modules.modelloader
+                    modules.modelloader.load_upscalers()
+
+        return self.sd_upscalers_val
+
+    @sd_upscalers.setter
+    def sd_upscalers(self, value):
+        self.sd_upscalers_val = value
+
+    @property
+    def face_restorers(self):
+        if self.face_restorers_val is None:
+            with lazy_fields_lock:
+                if self.face_restorers_val is None:
+                    import modules.face_restoration
+                    modules.face_restoration.setup_face_restorers()
+
+        return self.face_restorers_val
+
+    @face_restorers.setter
+    def face_restorers(self, value):
+        self.face_restorers_val = value
+
+    @property
+    def interrogator(self):
+        if self.interrogator_val is None:
+            with lazy_fields_lock:
+                if self.interrogator_val is None:
+                    import modules.interrogate
+                    self.interrogator_val = modules.interrogate.InterrogateModels("interrogate")
+
+        return self.interrogator_val
+
+    @interrogator.setter
+    def interrogator(self, value):
+        self.interrogator_val = value
+
 
 sys.modules['modules.shared'].__class__ = Shared
@@ -1,7 +1,7 @@
 import os
 import gradio as gr
 
-from modules import localization, ui_components, shared_items, shared, interrogate, shared_gradio_themes, util, sd_emphasis
+from modules import localization, ui_components, shared_items, shared, shared_gradio_themes, util, sd_emphasis
 from modules.paths_internal import models_path, script_path, data_path, sd_configs_path, sd_default_config, sd_model_file, default_sd_model_file, extensions_dir, extensions_builtin_dir, default_output_dir  # noqa: F401
 from modules.shared_cmd_options import cmd_opts
 from modules.options import options_section, OptionInfo, OptionHTML, categories
@@ -36,7 +36,10 @@ options_templates.update(options_section(('saving-images', "Saving images/grids"
     "samples_format": OptionInfo('png', 'File format for images', ui_components.DropdownEditable, {"choices": ("png", "jpg", "jpeg", "webp", "avif")}).info("manual input of <a href='https://pillow.readthedocs.io/en/stable/handbook/image-file-formats.html' target='_blank'>other formats</a> is possible, but compatibility is not guaranteed"),
     "samples_filename_pattern": OptionInfo("", "Images filename pattern", component_args=hide_dirs).link("wiki", "https://github.com/AUTOMATIC1111/stable-diffusion-webui/wiki/Custom-Images-Filename-Name-and-Subdirectory"),
     "save_images_add_number": OptionInfo(True, "Add number to filename when saving", component_args=hide_dirs),
+    "save_images_sequence_index": OptionInfo(False, "Remember next number for filenames instead of listing the directory for every image", component_args=hide_dirs).info("directory is listed once after startup; numbers of files deleted after that are not reused"),
     "save_images_replace_action": OptionInfo("Replace", "Saving the image to an existing file", gr.Radio, {"choices": ["Replace", "Add number suffix"], **hide_dirs}),
+    "save_images_async_threads": OptionInfo(0, "Number of threads for saving images in background", gr.Slider, {"minimum": 0, "maximum": 8, "step": 1}).info("0 = disable; next batch is generated while images of previous one are being written to disk"),
+    "save_images_fsync": OptionInfo(False, "Flush saved images to disk before they are considered saved").info("fsync; protects images from being lost on power failure, at the cost of slower saving"),
     "grid_save": OptionInfo(True, "Always save all generated image grids"),
     "grid_format": OptionInfo('png', 'File format for grids', ui_components.DropdownEditable, {"choices": ("png", "jpg", "jpeg", "webp", "avif")}).info("manual input of <a href='https://pillow.readthedocs.io/en/stable/handbook/image-file-formats.html' target='_blank'>other formats</a> is possible, but compatibility is not guaranteed"),
     "grid_extended_filename": OptionInfo(False, "Add extended info (seed, prompt) to filename when saving grid"),
@@ -103,6 +106,7 @@ options_templates.update(options_section(('upscaling', "Upscaling", "postprocess
     "dat_enabled_models": OptionInfo(["DAT x2", "DAT x3", "DAT x4"], "Select which DAT models to show in the web UI.", gr.CheckboxGroup, lambda: {"choices": shared_items.dat_models_names()}),
     "DAT_tile": OptionInfo(192, "Tile size for DAT upscalers.", gr.Slider, {"minimum": 0, "maximum": 512, "step": 16}).info("0 = no tiling"),
     "DAT_tile_overlap": OptionInfo(8, "Tile overlap for DAT upscalers.", gr.Slider, {"minimum": 0, "maximum": 48, "step": 1}).info("Low values = visible seam"),
+    "upscaler_tile_batch_size": OptionInfo(0, "Tile batch size for upscalers", gr.Slider, {"minimum": 0, "maximum": 32, "step": 1}).info("0 = automatic, based on free VRAM; how many tiles are processed by the upscaler model at once"),
     "upscaler_for_img2img": OptionInfo(None, "Upscaler for img2img", gr.Dropdown, lambda: {"choices": [x.name for x in shared.sd_upscalers]}),
     "set_scale_by_when_changing_upscaler": OptionInfo(False, "Automatically set the Scale by factor based on the name of the selected Upscaler."),
 }))
@@ -112,6 +116,7 @@ options_templates.update(options_section(('face-restoration', "Face restoration"
     "face_restoration_model": OptionInfo("CodeFormer", "Face restoration model", gr.Radio, lambda: {"choices": [x.name() for x in shared.face_restorers]}),
     "code_former_weight": OptionInfo(0.5, "CodeFormer weight", gr.Slider, {"minimum": 0, "maximum": 1, "step": 0.01}).info("0 = maximum effect; 1 = minimum effect"),
     "face_restoration_unload": OptionInfo(False, "Move face restoration model from VRAM into RAM after processing"),
+    "face_restoration_batch_size": OptionInfo(8, "Face restoration batch size", gr.Slider, {"minimum": 1, "maximum": 64, "step": 1}).info("number of faces restored at once, from all images of a batch; lower uses less VRAM"),
 }))
 
 options_templates.update(options_section(('system', "System", "system"), {
@@ -126,6 +131,7 @@ options_templates.update(options_section(('system', "System", "system"), {
     "print_hypernet_extra": OptionInfo(False, "Print extra hypernetwork information to console."),
     "list_hidden_files": OptionInfo(True, "Load models/files in hidden directories").info("directory is hidden if its name starts with \".\""),
     "disable_mmap_load_safetensors": OptionInfo(False, "Disable memmapping for loading .safetensors files.").info("fixes very slow loading speed in some cases"),
+    "hashes_background_threads": OptionInfo(0, "Number of threads for calculating hashes of models in background", gr.Slider, {"minimum": 0, "maximum": 16, "step": 1}).info("0 = disable; hashes of checkpoints and LoRAs are calculated ahead of time instead of when they are first used; unfinished work is resumed after restart"),
     "hide_ldm_prints": OptionInfo(True, "Prevent Stability-AI's ldm/sgm modules from printing noise to console."),
     "dump_stacks_on_signal": OptionInfo(False, "Print stack traces before exiting the program with ctrl+c."),
     "concurrent_git_fetch_limit": OptionInfo(16, "Number of simultaneous extension update checks ", gr.Slider, {"step": 1, "minimum": 1, "maximum": 100}).info("reduce extension update check time"),
@@ -151,6 +157,8 @@ options_templates.update(options_section(('API', "API", "system"), {
     "api_enable_requests": OptionInfo(True, "Allow http:// and https:// URLs for input images in API", restrict_api=True),
     "api_forbid_local_requests": OptionInfo(True, "Forbid URLs to local resources", restrict_api=True),
     "api_useragent": OptionInfo("", "User agent for requests", restrict_api=True),
+    "api_micro_batch_size": OptionInfo(1, "Maximum number of txt2img API requests to combine into one batch", gr.Slider, {"minimum": 1, "maximum": 16, "step": 1}).info("requests that differ only in prompt and seed and wait in queue at the same time are generated together; 1 = disable"),
+    "api_micro_batch_window": OptionInfo(0, "Time to wait for more requests to combine into a batch", gr.Number, {"precision": 0}).info("in milliseconds; requests that come while previous ones are being generated are combined anyway"),
 }))
 
 options_templates.update(options_section(('training', "Training", "training"), {
@@ -173,6 +181,9 @@ options_templates.update(options_section(('sd', "Stable Diffusion", "sd"), {
     "sd_checkpoints_limit": OptionInfo(1, "Maximum number of checkpoints loaded at the same time", gr.Slider, {"minimum": 1, "maximum": 10, "step": 1}),
     "sd_checkpoints_keep_in_cpu": OptionInfo(True, "Only keep one model on device").info("will keep models other than the currently used one in RAM rather than VRAM"),
     "sd_checkpoint_cache": OptionInfo(0, "Checkpoints to cache in RAM", gr.Slider, {"minimum": 0, "maximum": 10, "step": 1}).info("obsolete; set to 0 and use the two settings above instead"),
+    "sd_checkpoint_delta_switch": OptionInfo(False, "Switch between checkpoints by loading only weights that differ").info("compares tensors of .safetensors checkpoints by fingerprints and reads only changed ones when switching to a checkpoint with the same architecture; large tensors are compared by samples, so a merge that changes only a few of their values can be missed"),
+    "sd_checkpoint_scan_threads": OptionInfo(8, "Threads for reading new checkpoints when refreshing the list", gr.Slider, {"minimum": 1, "maximum": 32, "step": 1}).info("reading headers of unchanged checkpoints is skipped; more threads help with network drives"),
+    "sd_checkpoint_cache_mmap_size": OptionInfo(0, "Memory-mapped checkpoint cache size", gr.Number, {"precision": 0}).info("in MB; keeps recently used .safetensors checkpoints mapped into memory so that switching back to them does not read the file again; 0 = disable"),
     "sd_unet": OptionInfo("Automatic", "SD Unet", gr.Dropdown, lambda: {"choices": shared_items.sd_unet_items()}, refresh=shared_items.refresh_unet_list).info("choose Unet model: Automatic = use one with same filename as checkpoint; None = use Unet from checkpoint"),
     "enable_quantization": OptionInfo(False, "Enable quantization in K samplers for sharper and cleaner results. This may change existing seeds").needs_reload_ui(),
     "emphasis": OptionInfo("Original", "Emphasis mode", gr.Radio, lambda: {"choices": [x.name for x in sd_emphasis.options]}, infotext="Emphasis").info("makes it possible to make model to pay (more:1.1) or (less:0.9) attention to text when you use the syntax in prompt; " + sd_emphasis.get_options_descriptions()),
@@ -211,6 +222,7 @@ For img2img, VAE is used to process user's input image before the sampling, and
     "auto_vae_precision": OptionInfo(True, "Automatically revert VAE to 32-bit floats").info("triggers when a tensor with NaNs is produced in VAE; disabling the option in this case will result in a black square image"),
     "sd_vae_encode_method": OptionInfo("Full", "VAE type for encode", gr.Radio, {"choices": ["Full", "TAESD"]}, infotext='VAE Encoder').info("method to encode image to latent (use in img2img, hires-fix or inpaint mask)"),
     "sd_vae_decode_method": OptionInfo("Full", "VAE type for decode", gr.Radio, {"choices": ["Full", "TAESD"]}, infotext='VAE Decoder').info("method to decode latent to image"),
+    "sd_vae_decode_batch_size": OptionInfo(0, "Maximum batch size for VAE decode", gr.Slider, {"minimum": 0, "maximum": 64, "step": 1}).info("0 = automatic, decode as many images at once as fits in free VRAM; 1 = decode images one by one"),
 }))
 
 options_templates.update(options_section(('img2img', "img2img", "sd"), {
@@ -226,6 +238,7 @@ options_templates.update(options_section(('img2img', "img2img", "sd"), {
     "img2img_inpaint_sketch_default_brush_color": OptionInfo("#ffffff", "Inpaint sketch initial brush color", ui_components.FormColorPicker, {}).info("default brush color of img2img inpaint sketch").needs_reload_ui(),
     "return_mask": OptionInfo(False, "For inpainting, include the greyscale mask in results for web"),
     "return_mask_composite": OptionInfo(False, "For inpainting, include masked composite in results for web"),
+    "img2img_batch_prefetch_images": OptionInfo(4, "Images to read ahead in img2img batch", gr.Slider, {"minimum": 0, "maximum": 32, "step": 1}).info("next images, their masks and PNG info are read on background threads while the current one is processed; 0 = read each image when it is reached"),
     "img2img_batch_show_results_limit": OptionInfo(32, "Show the first N batch img2img results in UI", gr.Slider, {"minimum": -1, "maximum": 1000, "step": 1}).info('0: disable, -1: show all images. Too many images can cause lag'),
     "overlay_inpaint": OptionInfo(True, "Overlay original for inpaint").info("when inpainting, overlay the original image over the areas that weren't inpainted."),
 }))
@@ -240,6 +253,8 @@ options_templates.update(options_section(('optimizations', "Optimizations", "sd"
     "pad_cond_uncond": OptionInfo(False, "Pad prompt/negative prompt", infotext='Pad conds').info("improves performance when prompt and negative prompt have different lengths; changes seeds"),
     "pad_cond_uncond_v0": OptionInfo(False, "Pad prompt/negative prompt (v0)", infotext='Pad conds v0').info("alternative implementation for the above; used prior to 1.6.0 for DDIM sampler; overrides the above if set; WARNING: truncates negative prompt if it's too long; changes seeds"),
     "persistent_cond_cache": OptionInfo(True, "Persistent cond cache").info("do not recalculate conds from prompts if prompts have not changed since previous calculation"),
+    "conds_cache_size": OptionInfo(0, "Shared cond cache size", gr.Number, {"precision": 0}).info("in MB; 0 = disable; remembers conds for many recently used prompts across all generations, rather than just for the previous one"),
+    "conds_cache_disk": OptionInfo(False, "Store conds evicted from shared cond cache on disk").info("they are loaded back when the same prompt is used again, including after restart"),
     "batch_cond_uncond": OptionInfo(True, "Batch cond/uncond").info("do both conditional and unconditional denoising in one batch; uses a bit more VRAM during sampling, but improves speed; previously this was controlled by --always-batch-cond-uncond commandline argument"),
     "fp8_storage": OptionInfo("Disable", "FP8 weight", gr.Radio, {"choices": ["Disable", "Enable for SDXL", "Enable"]}).info("Use FP8 to store Linear/Conv layers' weight. Require pytorch>=2.1.0."),
     "cache_fp16_weight": OptionInfo(False, "Cache FP16 weight for LoRA").info("Cache fp16 weight when enabling FP8, will increase the quality of LoRA. Use more system ram."),
@@ -264,12 +279,13 @@ options_templates.update(options_section(('interrogate', "Interrogate"), {
     "interrogate_clip_min_length": OptionInfo(24, "BLIP: minimum description length", gr.Slider, {"minimum": 1, "maximum": 128, "step": 1}),
     "interrogate_clip_max_length": OptionInfo(48, "BLIP: maximum description length", gr.Slider, {"minimum": 1, "maximum": 256, "step": 1}),
     "interrogate_clip_dict_limit": OptionInfo(1500, "CLIP: maximum number of lines in text file").info("0 = No limit"),
-    "interrogate_clip_skip_categories": OptionInfo([], "CLIP: skip inquire categories", gr.CheckboxGroup, lambda: {"choices": interrogate.category_types()}, refresh=interrogate.category_types),
+    "interrogate_clip_skip_categories": OptionInfo([], "CLIP: skip inquire categories", gr.CheckboxGroup, lambda: {"choices": shared_items.interrogate_category_types()}, refresh=shared_items.interrogate_category_types),
     "interrogate_deepbooru_score_threshold": OptionInfo(0.5, "deepbooru: score threshold", gr.Slider, {"minimum": 0, "maximum": 1, "step": 0.01}),
     "deepbooru_sort_alpha": OptionInfo(True, "deepbooru: sort tags alphabetically").info("if not: sort by score"),
     "deepbooru_use_spaces": OptionInfo(True, "deepbooru: use spaces in tags").info("if not: use underscores"),
     "deepbooru_escape": OptionInfo(True, "deepbooru: escape (\\) brackets").info("so they are used as literal brackets and not for emphasis"),
     "deepbooru_filter_tags": OptionInfo("", "deepbooru: filter out those tags").info("separate by comma"),
+    "deepbooru_batch_size": OptionInfo(16, "deepbooru: batch size for tagging many images", gr.Slider, {"minimum": 1, "maximum": 128, "step": 1}),
 }))
 
 options_templates.update(options_section(('extra_networks', "Extra Networks", "sd"), {
@@ -416,6 +432,7 @@ options_templates.update(options_section(('postprocessing', "Postprocessing", "p
     'postprocessing_disable_in_extras': OptionInfo([], "Disable postprocessing operations in extras tab", ui_components.DropdownMulti, lambda: {"choices": [x.name for x in shared_items.postprocessing_scripts(filter_out_main_ui_only=True)]}),
     'postprocessing_operation_order': OptionInfo([], "Postprocessing operation order", ui_components.DropdownMulti, lambda: {"choices": [x.name for x in shared_items.postprocessing_scripts(filter_out_main_ui_only=True)]}),
     'upscaling_max_images_in_cache': OptionInfo(5, "Maximum number of images in upscaling cache", gr.Slider, {"minimum": 0, "maximum": 10, "step": 1}),
+    'postprocessing_prefetch_images': OptionInfo(4, "Images to read ahead when processing a batch", gr.Slider, {"minimum": 0, "maximum": 32, "step": 1}).info("decoded on background threads while the current image is processed; 0 = read each image when it is reached"),
     'postprocessing_existing_caption_action': OptionInfo("Ignore", "Action for existing captions", gr.Radio, {"choices": ["Ignore", "Keep", "Prepend", "Append"]}).info("when generating captions using postprocessing; Ignore = use generated; Keep = use original; Prepend/Append = combine both"),
 }))
 
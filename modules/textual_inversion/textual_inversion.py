@@ -23,6 +23,8 @@ from modules.textual_inversion.saving_settings import save_settings_to_file
 TextualInversionTemplate = namedtuple("TextualInversionTemplate", ["name", "path"])
 textual_inversion_templates = {}
 
+embeddings_index_version = 1
+
 
 def list_textual_inversion_templates():
     textual_inversion_templates.clear()
@@ -38,6 +40,8 @@ def list_textual_inversion_templates():
 
 class Embedding:
     def __init__(self, vec, name, step=None):
+        self.vec_val = None
+        self.vec_loader = None
         self.vec = vec
         self.name = name
         self.step = step
@@ -87,6 +91,20 @@ class Embedding:
         self.hash = v
         self.shorthash = self.hash[0:12]
 
+    @property
+    def vec(self):
+        """Vectors of the embedding; for embeddings restored from the index, they are read from the file when first used."""
+
+        if self.vec_val is None and self.vec_loader is not None:
+            self.vec_val = self.vec_loader()
+            self.vec_loader = None
+
+        return self.vec_val
+
+    @vec.setter
+    def vec(self, value):
+        self.vec_val = value
+
 
 class DirWithTextualInversionEmbeddings:
     def __init__(self, path):
@@ -117,6 +135,7 @@ class EmbeddingDatabase:
         self.embedding_dirs = {}
         self.previously_displayed_embeddings = ()
         self.image_embedding_cache = cache.cache('image-embedding')
+        self.embeddings_index = cache.cache('textual-inversion-index')
 
     def add_embedding_dir(self, path):
         self.embedding_dirs[path] = DirWithTextualInversionEmbeddings(path)
@@ -180,35 +199,112 @@ class EmbeddingDatabase:
             errors.report(f"Error loading embedding {path}", exc_info=True)
         return None, None
 
-    def load_from_file(self, path, filename):
+    def read_embedding_data(self, path, filename):
+        """Returns data loaded from an embedding file and embedding's name; data is None if the file is not an embedding, and name is also None if it's not even a supported file."""
+
         name, ext = os.path.splitext(filename)
         ext = ext.upper()
 
         if ext in ['.PNG', '.WEBP', '.JXL', '.AVIF']:
             _, second_ext = os.path.splitext(name)
             if second_ext.upper() == '.PREVIEW':
-                return
+                return None, None
 
             data, name = self.read_embedding_from_image(path, name)
             if data is None:
-                return
+                return None, None
 
         elif ext in ['.BIN', '.PT']:
             data = torch.load(path, map_location="cpu")
         elif ext in ['.SAFETENSORS']:
             data = safetensors.torch.load_file(path, device="cpu")
         else:
-            return
+            return None, None
+
+        return data, name
+
+    def embedding_from_index(self, path, filename, stat):
+        """
+        Returns an embedding described by the stored entry for the file if the file did not change since, or None otherwise.
+
+        The embedding's vectors are not read until they are used, so listing an unchanged embeddings directory does not load any files.
+        """
+
+        entry = self.embeddings_index.get(path)
+        if entry is None or entry.get("version") != embeddings_index_version or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+            return None
+
+        embedding = Embedding(None, entry["name"], step=entry["step"])
+        embedding.sd_checkpoint = entry["sd_checkpoint"]
+        embedding.sd_checkpoint_name = entry["sd_checkpoint_name"]
+        embedding.vectors = entry["vectors"]
+        embedding.shape = entry["shape"]
+        embedding.filename = path
+        embedding.set_hash(entry["hash"])
+        embedding.vec_loader = lambda: self.vec_from_index(path, filename, stat)
+
+        return embedding
+
+    def vec_from_index(self, path, filename, stat):
+        """Reads vectors of an embedding restored from the index; returns None if the file changed since it was indexed or can't be read."""
+
+        try:
+            current = os.stat(path)
+            if current.st_size != stat.st_size or current.st_mtime != stat.st_mtime:
+                print(f"Textual inversion embedding changed since it was listed, reloading: {path}")
+                return None
+
+            return embedding_vec_from_data(self.read_embedding_data(path, filename)[0], filename)[0]
+        except Exception:
+            errors.report(f"Error loading embedding {path}", exc_info=True)
+            return None
+
+    def reload_embedding(self, embedding):
+        """Replaces an embedding restored from the index with the one read from its file again."""
+
+        self.embeddings_index.pop(embedding.filename, None)
+        self.register_embedding_by_name(None, shared.sd_model, embedding.name)
+
+        try:
+            if os.path.isfile(embedding.filename):
+                self.load_from_file(embedding.filename, os.path.basename(embedding.filename))
+        except Exception:
+            errors.report(f"Error loading embedding {embedding.filename}", exc_info=True)
+
+    def store_in_index(self, embedding, stat):
+        self.embeddings_index[embedding.filename] = {
+            "version": embeddings_index_version,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "name": embedding.name,
+            "step": embedding.step,
+            "sd_checkpoint": embedding.sd_checkpoint,
+            "sd_checkpoint_name": embedding.sd_checkpoint_name,
+            "vectors": embedding.vectors,
+            "shape": embedding.shape,
+            "hash": embedding.hash,
+        }
+
+    def load_from_file(self, path, filename, stat=None):
+        stat = stat or os.stat(path)
+
+        embedding = self.embedding_from_index(path, filename, stat)
+        if embedding is None:
+            data, name = self.read_embedding_data(path, filename)
+            if name is None:
+                return
+
+            if data is None:
+                print(f"Unable to load Textual inversion embedding due to data issue: '{name}'.")
+                return
 
-        if data is not None:
             embedding = create_embedding_from_data(data, name, filename=filename, filepath=path)
+            self.store_in_index(embedding, stat)
 
-            if self.expected_shape == -1 or self.expected_shape == embedding.shape:
-                self.register_embedding(embedding, shared.sd_model)
-            else:
-                self.skipped_embeddings[name] = embedding
+        if self.expected_shape == -1 or self.expected_shape == embedding.shape:
+            self.register_embedding(embedding, shared.sd_model)
         else:
-            print(f"Unable to load Textual inversion embedding due to data issue: '{name}'.")
+            self.skipped_embeddings[embedding.name] = embedding
 
     def load_from_dir(self, embdir):
         if not os.path.isdir(embdir.path):
@@ -219,10 +315,11 @@ class EmbeddingDatabase:
                 try:
                     fullfn = os.path.join(root, fn)
 
-                    if os.stat(fullfn).st_size == 0:
+                    stat = os.stat(fullfn)
+                    if stat.st_size == 0:
                         continue
 
-                    self.load_from_file(fullfn, fn)
+                    self.load_from_file(fullfn, fn, stat)
                 except Exception:
                     errors.report(f"Error loading embedding {fn}", exc_info=True)
                     continue
@@ -269,6 +366,12 @@ class EmbeddingDatabase:
 
         for ids, embedding in possible_matches:
             if tokens[offset:offset + len(ids)] == ids:
+                # vectors are read here rather than in the forward pass, so a file that changed or disappeared since
+                # the embedding was listed does not break generation
+                if embedding.vec is None:
+                    self.reload_embedding(embedding)
+                    return self.find_embedding_at_position(tokens, offset)
+
                 return embedding, len(ids)
 
         return None, None
@@ -302,7 +405,9 @@ def create_embedding(name, num_vectors_per_token, overwrite_old, init_text='*'):
     return fn
 
 
-def create_embedding_from_data(data, name, filename='unknown embedding file', filepath=None):
+def embedding_vec_from_data(data, filename='unknown embedding file'):
+    """Returns vectors of an embedding from data loaded from its file, the size of each vector, and the number of vectors."""
+
     if 'string_to_param' in data:  # textual inversion embeddings
         param_dict = data['string_to_param']
         param_dict = getattr(param_dict, '_parameters', param_dict)  # fix for torch 1.12.1 loading saved file from torch 1.11
@@ -327,6 +432,12 @@ def create_embedding_from_data(data, name, filename='unknown embedding file', fi
     else:
         raise Exception(f"Couldn't identify {filename} as neither textual inversion embedding nor diffuser concept.")
 
+    return vec, shape, vectors
+
+
+def create_embedding_from_data(data, name, filename='unknown embedding file', filepath=None):
+    vec, shape, vectors = embedding_vec_from_data(data, filename)
+
     embedding = Embedding(vec, name)
     embedding.step = data.get('step', None)
     embedding.sd_checkpoint = data.get('sd_checkpoint', None)
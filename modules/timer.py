@@ -1,3 +1,6 @@
+import builtins
+import sys
+import threading
 import time
 import argparse
 
@@ -82,10 +85,93 @@ class Timer:
         self.__init__()
 
 
+class ImportProfiler:
+    """
+    Measures how long it takes to import each module by wrapping builtins.__import__.
+
+    For every module loaded by an import statement in the main thread, records the total time (including modules it imports in turn)
+    and own time (excluding them). Submodules loaded by `from package import module` are recorded under their full names.
+    """
+
+    def __init__(self):
+        self.records = {}
+        self.stack = []
+        self.original_import = None
+        self.thread_id = None
+
+    def install(self):
+        self.original_import = builtins.__import__
+        self.thread_id = threading.get_ident()
+        builtins.__import__ = self.profiled_import
+
+    def uninstall(self):
+        if builtins.__import__ == self.profiled_import:
+            builtins.__import__ = self.original_import
+
+    def profiled_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level != 0 or threading.get_ident() != self.thread_id:
+            return self.original_import(name, globals, locals, fromlist, level)
+
+        if name not in sys.modules:
+            key = name
+        else:
+            missing = [f"{name}.{x}" for x in fromlist or () if x != "*" and f"{name}.{x}" not in sys.modules and not hasattr(sys.modules[name], x)]
+            if not missing:
+                return self.original_import(name, globals, locals, fromlist, level)
+
+            key = ", ".join(missing)
+
+        self.stack.append(0)
+        start = time.perf_counter()
+        try:
+            return self.original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = self.stack.pop()
+            if self.stack:
+                self.stack[-1] += elapsed
+
+            total, own = self.records.get(key, (0, 0))
+            self.records[key] = (total + elapsed, own + elapsed - children)
+
+    def report(self, count=25):
+        """Returns a text table with modules that took the longest to import by themselves."""
+
+        lines = [f"{'own':>8} {'total':>8}  module"]
+        for key, (total, own) in sorted(self.records.items(), key=lambda x: x[1][1], reverse=True)[:count]:
+            lines.append(f"{own:>7.3f}s {total:>7.3f}s  {key}")
+
+        return "\n".join(lines)
+
+
 parser = argparse.ArgumentParser(add_help=False)
 parser.add_argument("--log-startup", action='store_true', help="print a detailed log of what's happening at startup")
+parser.add_argument("--profile-imports", action='store_true', help="measure import time of every module at startup and print modules that take the longest")
 args = parser.parse_known_args()[0]
 
+process_start = time.time()
+
 startup_timer = Timer(print_log=args.log_startup)
 
 startup_record = None
+
+first_response_time = None
+"""seconds from the start of the program until the server sent its first response"""
+
+import_profiler = None
+if args.profile_imports:
+    import_profiler = ImportProfiler()
+    import_profiler.install()
+
+
+def record_first_response():
+    global first_response_time
+
+    if first_response_time is not None:
+        return
+
+    first_response_time = time.time() - process_start
+    print(f"Time to first API response: {first_response_time:.1f}s")
+
+    if startup_record is not None:
+        startup_record["first response"] = first_response_time
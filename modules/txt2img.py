@@ -82,6 +82,8 @@ def txt2img_upscale(id_task: str, request: gr.Request, gallery, gallery_index, g
         if processed is None:
             processed = processing.process_images(p)
 
+        processing.wait_for_image_saves(p, processed)
+
     shared.total_tqdm.clear()
 
     new_gallery = []
@@ -108,6 +110,8 @@ def txt2img(id_task: str, request: gr.Request, *args):
         if processed is None:
             processed = processing.process_images(p)
 
+        processing.wait_for_image_saves(p, processed)
+
     shared.total_tqdm.clear()
 
     generation_info_js = processed.js()
@@ -7,7 +7,7 @@ from contextlib import nullcontext
 
 import gradio as gr
 
-from modules import call_queue, shared, ui_tempdir, util
+from modules import call_queue, shared, ui_tempdir, util, images_writer
 from modules.infotext_utils import image_from_url_text
 import modules.images
 from modules.ui_components import ToolButton
@@ -75,6 +75,7 @@ def save_files(js_data, images, do_make_zip, index):
 
     data = json.loads(js_data)
     p = MyObject(data)
+    image_saves = []
 
     path = shared.opts.outdir_save
     save_to_dirs = shared.opts.use_save_to_dirs_for_ui
@@ -123,7 +124,7 @@ def save_files(js_data, images, do_make_zip, index):
 
             parameters = parameters_copypaste.parse_generation_parameters(data["infotexts"][image_index], [])
             parsed_infotexts.append(parameters)
-            fullfn, txt_fullfn = modules.images.save_image(image, path, "", seed=parameters['Seed'], prompt=parameters['Prompt'], extension=extension, info=p.infotexts[image_index], grid=is_grid, p=p, save_to_dirs=save_to_dirs)
+            fullfn, txt_fullfn = modules.images.save_image(image, path, "", seed=parameters['Seed'], prompt=parameters['Prompt'], extension=extension, info=p.infotexts[image_index], grid=is_grid, p=p, save_to_dirs=save_to_dirs, image_saves=image_saves)
 
             filename = os.path.relpath(fullfn, path)
             filenames.append(filename)
@@ -135,6 +136,11 @@ def save_files(js_data, images, do_make_zip, index):
         if file:
             writer.writerow([parsed_infotexts[0]['Prompt'], parsed_infotexts[0]['Seed'], data["width"], data["height"], data["sampler_name"], data["cfg_scale"], data["steps"], filenames[0], parsed_infotexts[0]['Negative prompt'], data["sd_model_name"], data["sd_model_hash"]])
 
+    # files are written in background; they must exist before being zipped or offered for download
+    save_errors = images_writer.image_writer.wait(image_saves)
+    if save_errors:
+        return gr.File.update(value=None, visible=False), plaintext_to_html("\n".join(save_errors))
+
     # Make Zip
     if do_make_zip:
         p.all_seeds = [parameters['Seed'] for parameters in parsed_infotexts]
@@ -1,4 +1,7 @@
+from __future__ import annotations
+
 import logging
+import math
 from typing import Callable
 
 import numpy as np
@@ -6,7 +9,7 @@ import torch
 import tqdm
 from PIL import Image
 
-from modules import devices, images, shared, torch_utils
+from modules import devices, shared, torch_utils
 
 logger = logging.getLogger(__name__)
 
@@ -48,6 +51,158 @@ def upscale_pil_patch(model, img: Image.Image) -> Image.Image:
             return torch_bgr_to_pil_image(model(tensor))
 
 
+def tile_positions(length: int, tile_size: int, overlap: int) -> list[int]:
+    """
+    Returns offsets of tiles of size `tile_size` covering `length` pixels, spaced evenly
+    so that neighbouring tiles overlap by at least `overlap` pixels (same as `images.split_grid`).
+    """
+    if length <= tile_size:
+        return [0]
+
+    count = math.ceil((length - overlap) / (tile_size - overlap))
+    step = (length - tile_size) / (count - 1)
+    return [int(i * step) for i in range(count)]
+
+
+def feather_mask(
+    h: int,
+    w: int,
+    ramp: int,
+    *,
+    top: bool,
+    bottom: bool,
+    left: bool,
+    right: bool,
+    device: torch.device,
+) -> torch.Tensor:
+    """
+    Returns a (h, w) weight mask for blending a tile into the output: weights rise linearly
+    from the tile's edges over `ramp` pixels, except for edges that lie on the image border.
+    """
+
+    def ramp_1d(n, start, end):
+        x = torch.ones(n, device=device)
+        r = min(ramp, n // 2)
+        if r > 0:
+            rising = torch.arange(1, r + 1, device=device) / (r + 1)
+            if start:
+                x[:r] = rising
+            if end:
+                x[-r:] = torch.minimum(x[-r:], rising.flip(0))
+        return x
+
+    return ramp_1d(h, top, bottom)[:, None] * ramp_1d(w, left, right)[None, :]
+
+
+upscaler_bytes_per_output_pixel = 512
+"""rough estimate of how much memory an upscaler model needs per output pixel for each byte of its dtype; used to choose tile batch size"""
+
+
+def tile_batch_size(out_tile: torch.Tensor, tile_count: int) -> int:
+    if shared.opts.upscaler_tile_batch_size > 0:
+        return shared.opts.upscaler_tile_batch_size
+
+    from modules import sd_hijack_optimizations
+
+    bytes_per_tile = out_tile.shape[-2] * out_tile.shape[-1] * out_tile.element_size() * upscaler_bytes_per_output_pixel
+    available = sd_hijack_optimizations.get_available_vram() * 0.8
+
+    return max(1, min(tile_count, int(available // bytes_per_tile)))
+
+
+def tiled_upscale_batched(
+    img: torch.Tensor,
+    model,
+    *,
+    tile_size: int,
+    tile_overlap: int,
+    device: torch.device,
+    dtype: torch.dtype,
+    desc="Tiled upscale",
+    partial=False,
+) -> torch.Tensor | None:
+    """
+    Upscales a (1, C, H, W) image tensor by running the model on several tiles at once.
+
+    The whole image and the output are kept on `device`; overlapping regions of tiles are blended
+    with feathered weights. Tile batch size is chosen from free memory, and halved if the model runs
+    out of memory. The scale of the model is determined from its output for the first tile.
+
+    Returns None if interrupted; with partial=True, returns the output with the tiles done so far instead (None if there are none),
+    leaving the rest of it black.
+    """
+    img = img.to(device=device, dtype=dtype)
+    _, _, h, w = img.shape
+
+    tile_h = min(tile_size, h)
+    tile_w = min(tile_size, w)
+    tile_overlap = max(0, min(tile_overlap, tile_h // 2, tile_w // 2))
+
+    ys = tile_positions(h, tile_h, tile_overlap)
+    xs = tile_positions(w, tile_w, tile_overlap)
+    positions = [(y, x) for y in ys for x in xs]
+
+    result = None
+    weights = None
+    scale = None
+    batch_size = 1
+
+    logger.debug("Upscaling %s with %d tiles of %dx%d", img.shape, len(positions), tile_w, tile_h)
+
+    with tqdm.tqdm(total=len(positions), desc=desc, disable=not shared.opts.enable_upscale_progressbar) as pbar:
+        i = 0
+        while i < len(positions):
+            if shared.state.interrupted or shared.state.skipped:
+                if not partial or result is None:
+                    return None
+
+                return result.div_(weights.clamp_(min=1e-8))
+
+            batch_positions = positions[i:i + batch_size]
+            in_batch = torch.cat([img[..., y:y + tile_h, x:x + tile_w] for y, x in batch_positions])
+
+            try:
+                with devices.without_autocast():
+                    out_batch = model(in_batch)
+            except Exception as e:
+                if batch_size == 1 or not devices.is_out_of_memory_error(e):
+                    raise
+
+                out_batch = None
+
+            if out_batch is None:
+                devices.torch_gc()
+                batch_size = batch_size // 2
+                continue
+
+            if result is None:
+                scale = out_batch.shape[-1] // tile_w
+                result = torch.zeros((1, out_batch.shape[1], h * scale, w * scale), device=device, dtype=torch.float32)
+                weights = torch.zeros((1, 1, h * scale, w * scale), device=device, dtype=torch.float32)
+                batch_size = tile_batch_size(out_batch, len(positions) - 1)
+
+            for (y, x), out_tile in zip(batch_positions, out_batch):
+                mask = feather_mask(
+                    tile_h * scale,
+                    tile_w * scale,
+                    tile_overlap * scale,
+                    top=y > 0,
+                    bottom=y + tile_h < h,
+                    left=x > 0,
+                    right=x + tile_w < w,
+                    device=device,
+                )
+
+                region = (..., slice(y * scale, (y + tile_h) * scale), slice(x * scale, (x + tile_w) * scale))
+                result[region].addcmul_(out_tile.float(), mask)
+                weights[region].add_(mask)
+
+            i += len(batch_positions)
+            pbar.update(len(batch_positions))
+
+    return result.div_(weights)
+
+
 def upscale_with_model(
     model: Callable[[torch.Tensor], torch.Tensor],
     img: Image.Image,
@@ -62,30 +217,23 @@ def upscale_with_model(
         logger.debug("=> %s", output)
         return output
 
-    grid = images.split_grid(img, tile_size, tile_size, tile_overlap)
-    newtiles = []
-
-    with tqdm.tqdm(total=grid.tile_count, desc=desc, disable=not shared.opts.enable_upscale_progressbar) as p:
-        for y, h, row in grid.tiles:
-            newrow = []
-            for x, w, tile in row:
-                if shared.state.interrupted:
-                    return img
-                output = upscale_pil_patch(model, tile)
-                scale_factor = output.width // tile.width
-                newrow.append([x * scale_factor, w * scale_factor, output])
-                p.update(1)
-            newtiles.append([y * scale_factor, h * scale_factor, newrow])
-
-    newgrid = images.Grid(
-        newtiles,
-        tile_w=grid.tile_w * scale_factor,
-        tile_h=grid.tile_h * scale_factor,
-        image_w=grid.image_w * scale_factor,
-        image_h=grid.image_h * scale_factor,
-        overlap=grid.overlap * scale_factor,
-    )
-    return images.combine_grid(newgrid)
+    param = torch_utils.get_param(model)
+
+    with torch.inference_mode():
+        output = tiled_upscale_batched(
+            pil_image_to_torch_bgr(img).unsqueeze(0),
+            model,
+            tile_size=tile_size,
+            tile_overlap=tile_overlap,
+            device=param.device,
+            dtype=param.dtype,
+            desc=desc,
+        )
+
+        if output is None:
+            return img
+
+        return torch_bgr_to_pil_image(output)
 
 
 def tiled_upscale_2(
@@ -98,68 +246,37 @@ def tiled_upscale_2(
     device: torch.device,
     desc="Tiled upscale",
 ):
-    # Alternative implementation of `upscale_with_model` originally used by
-    # SwinIR and ScuNET.  It differs from `upscale_with_model` in that tiling and
-    # weighting is done in PyTorch space, as opposed to `images.Grid` doing it in
-    # Pillow space without weighting.
+    # Originally a separate implementation used by SwinIR and ScuNET that did tiling in PyTorch
+    # space, as opposed to `images.Grid` doing it in Pillow space; now both go through
+    # `tiled_upscale_batched`. `scale` is kept for compatibility; the actual scale is
+    # determined from the model's output.
 
-    b, c, h, w = img.size()
-    tile_size = min(tile_size, h, w)
+    b, _, h, w = img.size()
 
-    if tile_size <= 0:
+    if min(tile_size, h, w) <= 0:
         logger.debug("Upscaling %s without tiling", img.shape)
         return model(img)
 
-    stride = tile_size - tile_overlap
-    h_idx_list = list(range(0, h - tile_size, stride)) + [h - tile_size]
-    w_idx_list = list(range(0, w - tile_size, stride)) + [w - tile_size]
-    result = torch.zeros(
-        b,
-        c,
-        h * scale,
-        w * scale,
-        device=device,
-        dtype=img.dtype,
-    )
-    weights = torch.zeros_like(result)
-    logger.debug("Upscaling %s to %s with tiles", img.shape, result.shape)
-    with tqdm.tqdm(total=len(h_idx_list) * len(w_idx_list), desc=desc, disable=not shared.opts.enable_upscale_progressbar) as pbar:
-        for h_idx in h_idx_list:
-            if shared.state.interrupted or shared.state.skipped:
-                break
-
-            for w_idx in w_idx_list:
-                if shared.state.interrupted or shared.state.skipped:
-                    break
-
-                # Only move this patch to the device if it's not already there.
-                in_patch = img[
-                    ...,
-                    h_idx : h_idx + tile_size,
-                    w_idx : w_idx + tile_size,
-                ].to(device=device)
-
-                out_patch = model(in_patch)
-
-                result[
-                    ...,
-                    h_idx * scale : (h_idx + tile_size) * scale,
-                    w_idx * scale : (w_idx + tile_size) * scale,
-                ].add_(out_patch)
-
-                out_patch_mask = torch.ones_like(out_patch)
-
-                weights[
-                    ...,
-                    h_idx * scale : (h_idx + tile_size) * scale,
-                    w_idx * scale : (w_idx + tile_size) * scale,
-                ].add_(out_patch_mask)
+    outputs = []
+    for i in range(b):
+        output = tiled_upscale_batched(
+            img[i:i + 1],
+            model,
+            tile_size=tile_size,
+            tile_overlap=tile_overlap,
+            device=device,
+            dtype=img.dtype,
+            desc=desc,
+            partial=True,
+        )
 
-                pbar.update(1)
+        # when interrupted, the part upscaled so far is returned, same as it always was for this function
+        if output is None:
+            output = torch.zeros((1, img.shape[1], h * scale, w * scale), device=device)
 
-    output = result.div_(weights)
+        outputs.append(output.to(img.dtype))
 
-    return output
+    return torch.cat(outputs)
 
 
 def upscale_2(
@@ -187,4 +304,8 @@ def upscale_2(
             desc=desc,
             device=param.device,
         )
+
+    if output is None:
+        return img
+
     return torch_bgr_to_pil_image(output)
@@ -1,3 +1,5 @@
+import collections
+import concurrent.futures
 import os
 import re
 
@@ -51,6 +53,41 @@ def walk_files(path, allowed_extensions=None):
             yield os.path.join(root, filename)
 
 
+def prefetch(items, func, depth):
+    """
+    Yields (item, future) pairs for items in order, where future holds the result of func(item).
+
+    func is called on background threads for at most depth items ahead of the one being consumed, so that e.g. reading and decoding
+    next images from disk overlaps with processing the current one, while memory use does not depend on the number of items. With
+    depth 0, func is called on the calling thread when the item is reached.
+    """
+
+    if depth <= 0:
+        for item in items:
+            future = concurrent.futures.Future()
+            try:
+                future.set_result(func(item))
+            except Exception as e:
+                future.set_exception(e)
+
+            yield item, future
+
+        return
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(depth, os.cpu_count() or 1), thread_name_prefix="prefetch")
+    try:
+        pending = collections.deque()
+        for item in items:
+            pending.append((item, executor.submit(func, item)))
+            if len(pending) > depth:
+                yield pending.popleft()
+
+        while pending:
+            yield pending.popleft()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
 def ldm_print(*args, **kwargs):
     if shared.opts.hide_ldm_prints:
         return
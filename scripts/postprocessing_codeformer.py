@@ -1,7 +1,7 @@
 from PIL import Image
 import numpy as np
 
-from modules import scripts_postprocessing, codeformer_model, ui_components
+from modules import scripts_postprocessing, codeformer_model, ui_components, shared
 import gradio as gr
 
 
@@ -25,6 +25,8 @@ class ScriptPostprocessingCodeFormer(scripts_postprocessing.ScriptPostprocessing
         if codeformer_visibility == 0 or not enable:
             return
 
+        shared.face_restorers  # noqa: B018 - sets up face restorers if that was deferred until first use
+
         restored_img = codeformer_model.codeformer.restore(np.array(pp.image.convert("RGB"), dtype=np.uint8), w=codeformer_weight)
         res = Image.fromarray(restored_img)
 
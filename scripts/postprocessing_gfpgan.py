@@ -1,7 +1,7 @@
 from PIL import Image
 import numpy as np
 
-from modules import scripts_postprocessing, gfpgan_model, ui_components
+from modules import scripts_postprocessing, gfpgan_model, ui_components, shared
 import gradio as gr
 
 
@@ -22,6 +22,8 @@ class ScriptPostprocessingGfpGan(scripts_postprocessing.ScriptPostprocessing):
         if gfpgan_visibility == 0 or not enable:
             return
 
+        shared.face_restorers  # noqa: B018 - sets up face restorers if that was deferred until first use
+
         restored_img = gfpgan_model.gfpgan_fix_faces(np.array(pp.image.convert("RGB"), dtype=np.uint8))
         res = Image.fromarray(restored_img)
 
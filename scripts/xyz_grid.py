@@ -808,7 +808,7 @@ class Script(scripts.Script):
             for g in range(grid_count):
                 # TODO: See previous comment about intentional data misalignment.
                 adj_g = g - 1 if g > 0 else g
-                images.save_image(processed.images[g], p.outpath_grids, "xyz_grid", info=processed.infotexts[g], extension=opts.grid_format, prompt=processed.all_prompts[adj_g], seed=processed.all_seeds[adj_g], grid=True, p=processed)
+                images.save_image(processed.images[g], p.outpath_grids, "xyz_grid", info=processed.infotexts[g], extension=opts.grid_format, prompt=processed.all_prompts[adj_g], seed=processed.all_seeds[adj_g], grid=True, p=processed, image_saves=p.image_saves)
                 if not include_sub_grids:  # if not include_sub_grids then skip saving after the first grid
                     break
 
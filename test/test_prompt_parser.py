@@ -0,0 +1,35 @@
+import torch
+
+from modules import prompt_parser
+
+
+def make_schedule(boundaries, steps, tokens=77, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    ends = list(boundaries) + [steps]
+    return [prompt_parser.ScheduledPromptConditioning(end, torch.randn((tokens, 8), generator=generator)) for end in ends]
+
+
+def test_step_conds_table_matches_reconstruct():
+    steps = 150
+    cond = prompt_parser.MulticondLearnedConditioning(shape=(2,), batch=[
+        [prompt_parser.ComposableScheduledPromptConditioning(make_schedule(range(3, steps, 3), steps, seed=1))],
+        [
+            prompt_parser.ComposableScheduledPromptConditioning(make_schedule([10, 40, 90], steps, tokens=154, seed=2), 0.7),
+            prompt_parser.ComposableScheduledPromptConditioning(make_schedule([], steps, seed=3), 0.3),
+        ],
+    ])
+    uncond = [make_schedule([75], steps, seed=4), make_schedule([], steps, seed=5)]
+
+    table = prompt_parser.StepCondsTable(cond, uncond)
+
+    # going past the last step too, where schedules fall back to the first entry
+    for step in list(range(steps + 5)) + [0, 75, 76]:
+        conds_list, tensor = prompt_parser.reconstruct_multicond_batch(cond, step)
+        step_conds = table.get(step)
+
+        assert step_conds.conds_list == conds_list
+        assert torch.equal(step_conds.tensor, tensor)
+        assert torch.equal(step_conds.uncond, prompt_parser.reconstruct_cond_batch(uncond, step))
+
+    assert len(table.entries) == len(set(table.step_keys.values()))
+    assert table.get(4) is table.get(5)
@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+from modules import rng_philox
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+@pytest.mark.parametrize("offset", [0, 2])
+def test_randn_batch_matches_generator(threads, offset):
+    seeds = [0, 1, 12345, 4294967295, 2**40 + 7]
+    shape = (4, 13, 11)
+
+    expected = []
+    for seed in seeds:
+        generator = rng_philox.Generator(seed)
+        generator.offset = offset
+        expected.append(generator.randn(shape))
+
+    res = rng_philox.randn_batch(seeds, shape, offset=offset, threads=threads)
+
+    assert res.dtype == np.float32
+    assert res.shape == (len(seeds), *shape)
+    assert np.array_equal(res.view(np.uint32), np.stack(expected).view(np.uint32))
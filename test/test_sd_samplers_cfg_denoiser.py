@@ -0,0 +1,54 @@
+import types
+
+import pytest
+import torch
+
+from test.test_prompt_parser import make_schedule
+
+
+def pad_every_step(denoiser, tensor, uncond, opts):
+    """padding as it was done by CFGDenoiser.forward for every step"""
+
+    denoiser.padded_cond_uncond = False
+    denoiser.padded_cond_uncond_v0 = False
+    if opts.pad_cond_uncond_v0 and tensor.shape[1] != uncond.shape[1]:
+        tensor, uncond = denoiser.pad_cond_uncond_v0(tensor, uncond)
+    elif opts.pad_cond_uncond and tensor.shape[1] != uncond.shape[1]:
+        tensor, uncond = denoiser.pad_cond_uncond(tensor, uncond)
+
+    return tensor, uncond, denoiser.padded_cond_uncond, denoiser.padded_cond_uncond_v0
+
+
+@pytest.mark.usefixtures("initialize")
+@pytest.mark.parametrize("pad_cond_uncond_v0,pad_cond_uncond", [(True, False), (False, True), (False, False)])
+def test_padded_step_conds_match_padding_every_step(monkeypatch, pad_cond_uncond_v0, pad_cond_uncond):
+    from modules import prompt_parser, shared, sd_samplers_cfg_denoiser
+
+    monkeypatch.setitem(shared.opts.data, "pad_cond_uncond_v0", pad_cond_uncond_v0)
+    monkeypatch.setitem(shared.opts.data, "pad_cond_uncond", pad_cond_uncond)
+    monkeypatch.setattr(shared, "sd_model", types.SimpleNamespace(cond_stage_model_empty_prompt=torch.randn((1, 77, 8))))
+
+    steps = 40
+    cond = prompt_parser.MulticondLearnedConditioning(shape=(2,), batch=[
+        [prompt_parser.ComposableScheduledPromptConditioning(make_schedule([10, 20], steps, tokens=154, seed=1))],
+        [prompt_parser.ComposableScheduledPromptConditioning(make_schedule([15], steps, tokens=154, seed=2))],
+    ])
+    uncond = [make_schedule([30], steps, seed=3), make_schedule([], steps, seed=4)]
+
+    denoiser = sd_samplers_cfg_denoiser.CFGDenoiser(sampler=None)
+    table = prompt_parser.StepCondsTable(cond, uncond)
+
+    for step in range(steps + 1):
+        _, tensor = prompt_parser.reconstruct_multicond_batch(cond, step)
+        expected_tensor, expected_uncond, padded, padded_v0 = pad_every_step(denoiser, tensor, prompt_parser.reconstruct_cond_batch(uncond, step), shared.opts)
+
+        step_conds = table.get(step)
+        padded_tensor, padded_uncond = denoiser.pad_step_conds(step_conds)
+
+        assert torch.equal(padded_tensor, expected_tensor)
+        assert torch.equal(padded_uncond, expected_uncond)
+        assert (denoiser.padded_cond_uncond, denoiser.padded_cond_uncond_v0) == (padded, padded_v0)
+
+        # padding is done once for every entry of the table, and does not change the entry
+        assert denoiser.pad_step_conds(step_conds)[0] is padded_tensor
+        assert step_conds.tensor.shape[1] == 154 and step_conds.uncond.shape[1] == 77